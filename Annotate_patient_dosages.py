@@ -1,165 +1,159 @@
 import pandas as pd
 import numpy as np
 import re
+import warnings
 import argparse
-import pickle
-from scipy.stats import zscore, norm
-
-# import the drug dictionary
-drug_dictionary = pickle.load(open('data/drug_dictionary.p', 'rb'))
 
 # import the relevant objects
 from utils.answer_mapping import AnswerMapper
+from utils.mapping_cache import MappingCache
+from utils.resources import get_drug_dictionary, DRUG_DICTIONARY_FILEPATH, BNF_CLASSES_FILEPATH
+from utils.incremental import IncrementalState, fingerprint_respondents, get_state_key, patch_output
 from Annotate_patients import PatientAnnotator, drug_classes, specific_drugs
 
 # class for scaling dosage values
 class DosageScaler(PatientAnnotator):
 
+    # columns of the reference statistics of the dosages of each drugbank id (or set of ids)
+    stats_columns = ['q1', 'q3', 'mean', 'std']
+
     # class takes in the full survey answers, medication answers, dosage answers, dosage units answers, and a drug dictionary
-    def __init__(self, survey_data, meds, dosages, units, RoAs, drug_dict):
+    # optionally, a dictionary of reference statistics for each id set (as produced in the dosage_stats attribute) can be
+    # provided, in which case dosages are scaled relative to the reference rather than to the answers given
+    def __init__(self, survey_data, meds, dosages, units, RoAs, drug_dict, reference_stats = None):
         '''
-        The meds, dosages, and units series should be on the same multi-index of the form (patient_number, question_number)
+        The meds, dosages, and units series should be on the same multi-index of the form (patient_number, question_number),
+        with the answers in the same order (as produced by AnswerMapper), since they are aligned by position.
 
         We use the first five letters of the question number index to distinguish between med, dosage, and unit questions, i.e.
         - q1421_x -> meds
         - q1431_x -> dosage values
         - q1432_x -> dosage units
         '''
-        # initialise parent class to call read_bnf()
+        # initialise parent class to call read_bnf() and map the answers to drugbank id sets
         super().__init__(meds, RoAs, drug_dict)
         self.survey_data = survey_data
-        self.med_db_ids = meds.apply(lambda answer: drug_dict.get(answer) if drug_dict.get(answer) else set())
         self.dosages = dosages
         self.units = units
+        self.reference_stats = reference_stats
+        # statistics of the dosages of each id set, recorded as dosages are normalised
+        self.dosage_stats = {}
 
-    # function for aligning question indices in a survey answer mask to another survey answer series
+    # function for getting the key of a set of drugbank ids in a dictionary of reference statistics
     @staticmethod
-    def align_mask(mask, series):
-        # index pattern is everything before the first underscore in the first index entry
-        mask_idx_pattern = re.sub('_.*$', '', mask.index[0][1])
-        series_idx_pattern = re.sub('_.*$', '', series.index[0][1])
-        # get the question patterns from of the first five letters of the mask and answer series indices
-        q1_pattern = mask.index[0][1][:min(5, len(mask_idx_pattern))]
-        q2_pattern = series.index[0][1][:min(5, len(series_idx_pattern))]
-        # rename the question index in the mask
-        mask_renamed = mask.rename({q_id: q_id.replace(q1_pattern, q2_pattern) for q_id in mask.index.get_level_values(1).unique()}, level = 1)
-        # align it to the series
-        _, mask_aligned = series.align(mask_renamed, fill_value = False)
-        return mask_aligned
-
-    # function for getting normalised drug dosages for a drugbank ID
-    def get_normalised_dosages(self, id):
-
-        # if a single id is provided, convert into a set
-        ids = set([id]) if isinstance(id, str) else id
-
-        # make copy of the dosage question so the global object is not modified
-        dosages = self.dosages.copy()
-        # filter for answers containing the same DB id(s)
-        drug_mask = self.med_db_ids.apply(lambda drug_ids: True if ids.issubset(drug_ids) else False)
-        # change index name
-        drug_mask = DosageScaler.align_mask(drug_mask, self.units)
-
-        # if any drugs are hit, get the dosages
-        if drug_mask.any():
-
-            # filter for answers containing the same DB id(s)
-            exact_drug_mask = self.med_db_ids.apply(lambda drug_ids: True if ids == drug_ids else False)
-            # change index name
-            exact_drug_mask = DosageScaler.align_mask(exact_drug_mask, self.units)
+    def get_id_set_key(ids):
+        return '; '.join(sorted(ids))
 
-            # get mixture compounds
-            mixture_mask = DosageScaler.align_mask(drug_mask != exact_drug_mask, dosages)
+    # function for getting normalised drug dosages for a list of drugbank IDs (or sets of IDs), as a data frame of answers x IDs
+    def get_normalised_dosage_table(self, ids_list):
 
-            # if there are any exact matches, scale the drug dosages
-            if exact_drug_mask.any():
+        from scipy.stats import norm
 
-                # get all dosage units specified for the drug
-                dosage_units = self.units[exact_drug_mask].copy()
-                mg_mask = DosageScaler.align_mask(dosage_units == 1, dosages)
-                micg_mask = DosageScaler.align_mask(dosage_units == 2, dosages)
-                # get invalid units
-                invalid_unit_mask = DosageScaler.align_mask((dosage_units != 1) & (dosage_units != 2), dosages)
-
-                # get iqr and quantiles of the mg drug dosages
-                q1, q3 = dosages[mg_mask].quantile([0.25, 0.75])
-                dose_iqr = q3 - q1
-
-                # change the microgram values in the actual dosage values if the resulting answers are not outliers
-                dosages[micg_mask] = np.where((dosages[micg_mask] / 1000 < q1-dose_iqr) | (dosages[micg_mask] / 1000 > q3+dose_iqr),
-                                              dosages[micg_mask], dosages[micg_mask] / 1000)
-
-                # get all dosage values with valid dosage units
-                valid_unit_mask = mg_mask | micg_mask
-                valid_dosages = dosages[valid_unit_mask]
-
-                # calculate z score
-                valid_dosages_scaled = zscore(valid_dosages)
-
-                # normalised using probit function
-                valid_dosages_norm = pd.Series(norm.cdf(valid_dosages_scaled), index = valid_dosages.index)
-            else:
-                invalid_unit_mask = pd.Series(False, index = dosages.index)
-                valid_dosages_norm = pd.Series()
-
-            # NA values are either mixtures or invalid dosages
-            NA_mask = invalid_unit_mask | mixture_mask
+        # if a single id is provided, convert into a set
+        ids_list = [frozenset([ids]) if isinstance(ids, str) else frozenset(ids) for ids in ids_list]
+
+        # test each distinct id set in the answers against each id set, for answers containing the whole set and answers with
+        # exactly the set (rather than a mixture compound containing it) - sets with an id missing from the answers match nothing
+        contains_mask = np.zeros((len(self.id_sets.sets), len(ids_list)), dtype = bool)
+        exact_mask = np.zeros((len(self.id_sets.sets), len(ids_list)), dtype = bool)
+        for i, ids in enumerate(ids_list):
+            contains_mask[:, i] = self.id_sets.contains(ids)
+            exact_mask[:, i] = self.id_sets.equals(ids)
+
+        # explode the answers into (answer, id set) rows, keeping rows where the answer contains the whole set
+        answer_rows, id_set_columns = np.nonzero(contains_mask[self.answer_set_codes])
+        drug_rows = pd.DataFrame({'answer': answer_rows, 'id_set': id_set_columns})
+        drug_rows['exact'] = exact_mask[self.answer_set_codes[answer_rows], id_set_columns]
+        drug_rows['dose'] = self.dosages.to_numpy()[drug_rows['answer']].astype(float)
+        drug_rows['unit'] = self.units.to_numpy()[drug_rows['answer']]
+
+        # get mg and microgram dosages for the exact matches
+        mg_mask = drug_rows['exact'] & (drug_rows['unit'] == 1)
+        micg_mask = drug_rows['exact'] & (drug_rows['unit'] == 2)
+
+        # reference statistics of each id set, taken from the population of answers unless reference statistics were provided
+        keys = [DosageScaler.get_id_set_key(ids) for ids in ids_list]
+        if self.reference_stats is None:
+            stats = pd.DataFrame(index = range(len(ids_list)), columns = DosageScaler.stats_columns, dtype = float)
+        else:
+            stats = pd.DataFrame([self.reference_stats.get(key, (np.nan,) * 4) for key in keys],
+                                 columns = DosageScaler.stats_columns, dtype = float)
+
+        # get iqr and quantiles of the mg drug dosages for each id set
+        if self.reference_stats is None:
+            mg_quantiles = drug_rows[mg_mask].groupby('id_set')['dose'].quantile([0.25, 0.75]).unstack()
+            mg_quantiles = mg_quantiles.reindex(index = range(len(ids_list)), columns = [0.25, 0.75])
+            stats['q1'] = mg_quantiles[0.25].to_numpy()
+            stats['q3'] = mg_quantiles[0.75].to_numpy()
+        q1 = stats['q1'].to_numpy()[drug_rows['id_set']]
+        q3 = stats['q3'].to_numpy()[drug_rows['id_set']]
+        dose_iqr = q3 - q1
+
+        # change the microgram values in the actual dosage values if the resulting answers are not outliers
+        micg_dose = drug_rows['dose'] / 1000
+        micg_outlier_mask = (micg_dose < q1-dose_iqr) | (micg_dose > q3+dose_iqr)
+        drug_rows.loc[micg_mask & ~micg_outlier_mask, 'dose'] = micg_dose
+
+        # calculate z scores among the dosages with valid units for each id set
+        valid_unit_mask = mg_mask | micg_mask
+        valid_dosages = drug_rows.loc[valid_unit_mask, ['id_set', 'dose']]
+        if self.reference_stats is None:
+            dose_groups = valid_dosages.groupby('id_set')['dose']
+            stats['mean'] = dose_groups.mean().reindex(range(len(ids_list))).to_numpy()
+            stats['std'] = dose_groups.std(ddof = 0).reindex(range(len(ids_list))).to_numpy()
+        dose_means = stats['mean'].to_numpy()[valid_dosages['id_set']]
+        dose_stds = stats['std'].to_numpy()[valid_dosages['id_set']]
+        valid_dosages_scaled = (valid_dosages['dose'] - dose_means) / dose_stds
+
+        # save the statistics used for each id set, so they can be stored as a reference for later runs
+        self.dosage_stats.update(zip(keys, stats.itertuples(index = False, name = None)))
+
+        # NA values are either mixtures or invalid dosages, and valid dosages are normalised using the probit function
+        drug_rows['value'] = -1.0
+        drug_rows.loc[valid_unit_mask, 'value'] = norm.cdf(valid_dosages_scaled)
+
+        # answers that do not contain a set of ids get a value of 0
+        normalised_dosages = np.zeros((len(self.dosages), len(ids_list)))
+        normalised_dosages[drug_rows['answer'], drug_rows['id_set']] = drug_rows['value']
+
+        columns = [next(iter(ids)) if len(ids) == 1 else ids for ids in ids_list]
+        return pd.DataFrame(normalised_dosages, index = self.dosages.index, columns = columns)
 
-            # get invalid dosages
-            invalid_dosages = dosages[NA_mask].apply(lambda dosage: -1)
+    # function for getting normalised drug dosages for a drugbank ID
+    def get_normalised_dosages(self, id):
+        return self.get_normalised_dosage_table([id]).iloc[:, 0]
 
-            # combine the two dosage lists
-            all_dosage_values = invalid_dosages.append(valid_dosages_norm)
-            all_dosage_values = all_dosage_values.sort_index()
-            all_dosage_values[(all_dosage_values == -99) | (all_dosage_values == '-99')] = -1
+    # function for combining dosage data into a single value (either a sum or NA) across the columns of each row of an array
+    # if a sparse matrix of groups x rows is provided, the values within each group of rows are combined instead
+    @staticmethod
+    def combine_dosages(dosages, group_matrix = None):
 
-            # align to the larger series
-            _, drug_dosages_aligned = dosages.align(all_dosage_values, fill_value=0)
+        # any NA value (-1) makes the combined value NA, otherwise the values are summed, ignoring missing values
+        dosages = np.asarray(dosages, dtype = float)
+        na_mask = dosages == -1
+        valid_dosages = np.where(na_mask | np.isnan(dosages), 0, dosages)
 
-        # otherwise save the dosages as a series of 0
+        if group_matrix is None:
+            na_counts = na_mask.sum(axis = 1)
+            dosage_sums = valid_dosages.sum(axis = 1)
         else:
-            drug_dosages_aligned = pd.Series(0, index = dosages.index)
+            na_counts = group_matrix @ na_mask.astype(np.int32)
+            dosage_sums = group_matrix @ valid_dosages
 
-        return drug_dosages_aligned
-
-    @staticmethod
-    # function for checking if a series of dosage answers consists of only NA and 0 values
-    def is_na(row):
-        return False if all(row == 0) else False if all(row != -1) else True
-
-    @staticmethod
-    # function for combining dosage data across multiple drugs into a single value (either a sum or NA)
-    def combine_func(row):
-        return -1 if DosageScaler.is_na(row) else row[row != -1].sum()
+        return np.where(na_counts > 0, -1, dosage_sums)
 
     # function for getting the dosage values for each class
     def get_class_doses(self, drug_class):
 
-        # filter for BNF listings that mapped to the drug dictionary
-        valid_class_mask = self.bnf_classes['db_id'].apply(lambda ids: len(ids) > 0)
-        valid_bnf_classes = self.bnf_classes[valid_class_mask]
-
-        # get bnf entries that fall into the desired drug class
-        drug_class_mask = valid_bnf_classes['primary'].str.contains(drug_class) | valid_bnf_classes['secondary'].str.contains(drug_class)
-        class_drugs = valid_bnf_classes[drug_class_mask]
-
-        # isolate entries that in the drug class that correspond to single drugbank IDs, to avoid ambiguity with mixture products
-        single_id_mask = class_drugs['db_id'].apply(lambda ids: len(ids) == 1)
         # get the db ids corresponding to the drug class
-        class_db_ids = set().union(*class_drugs['db_id'][single_id_mask])
-
-        # loop through ids in the class and add dosages to the dictionary of dosage data
-        drug_dosages = {}
-        for id in class_db_ids:
-            dosages = self.get_normalised_dosages(id)
-            drug_dosages[id] = dosages
+        class_db_ids = self.get_class_db_ids(drug_class)
 
         # make data frame from the dosage data for all drugs in the class
-        dosage_df = pd.DataFrame(drug_dosages)
+        dosage_df = self.get_normalised_dosage_table(sorted(class_db_ids))
 
-        # group by patient, summing to get the total dose per patient within each class
-        question_dosages = dosage_df.apply(DosageScaler.combine_func, axis = 1)
-        patient_dosages = question_dosages.groupby(level = 0).apply(DosageScaler.combine_func)
+        # sum across drugs to get the dose for each answer, then across answers to get the total dose per patient within the class
+        question_dosages = DosageScaler.combine_dosages(dosage_df.to_numpy())
+        patient_dosages = pd.Series(DosageScaler.combine_dosages(question_dosages, self.patient_answer_matrix), index = self.patients)
 
         # align to the total set of survey answers
         _, patient_dosages_aligned = self.survey_data.align(patient_dosages, axis = 0, fill_value = 0)
@@ -170,39 +164,20 @@ class DosageScaler(PatientAnnotator):
     def get_drug_doses(self, drug):
 
         # get the drugbank id corresponding to the drug of interest
-        drug_db_ids = drug_dictionary[drug]
+        drug_db_ids = self.drug_dictionary[drug]
         # get the normalised dosages
         dosages = self.get_normalised_dosages(drug_db_ids)
-        # group by patient, summing to get the total dose per patient within each class
-        patient_dosages = dosages.groupby(level = 0).apply(self.combine_func)
+        # sum across answers to get the total dose per patient
+        patient_dosages = pd.Series(DosageScaler.combine_dosages(dosages.to_numpy(), self.patient_answer_matrix), index = self.patients)
         # align to the total set of survey answers
         _, patient_dosages_aligned = self.survey_data.align(patient_dosages, axis = 0, fill_value = 0)
 
         return patient_dosages_aligned
 
-
-if __name__ == '__main__':
-
-    # file path and column name arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
-    parser.add_argument('-q', '--questions', default = ['q1421', 'q1431', 'q1432', 'q1442'], nargs = 4, type = str,
-                        help = 'Column names for medication, dosage, unit, and RoA questions')
-    parser.add_argument('-id', '--patient_id', default='uid', type=str, help='Column name for unique patient identifiers')
-    args = parser.parse_args()
-
-    # get the filename prefix from the filepath, for output file name
-    filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
-
-    # create instance of answer mapper class with the survey file path
-    mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q = args.questions[0],
-                          dosage_q = args.questions[1], units_q = args.questions[2], RoAs_q = args.questions[3])
-
-    # generate answer mappings
-    mapper.map_answers()
-
-    # update drug dictionary with manual corrections file
-    mapper.update_drug_dictionary(manual_corrections_filepath='data/answer_mappings_complete.csv')
+# function for getting a data frame of drug class and drug dosage features for each row of the survey data, along with
+# the statistics the dosages of each drug were scaled with - the answer series should only contain answers from the rows
+# of the survey data, and if reference statistics are provided, dosages are scaled relative to them
+def get_patient_dose_features(survey_data, meds, dosages, units, RoAs, drug_dict, patient_id, reference_stats = None):
 
     # dictionary for patient drug classes
     drug_class_doses = {}
@@ -211,9 +186,9 @@ if __name__ == '__main__':
     specific_drug_doses = {}
 
     # make a class instance with the mapped answer data
-    scaler = DosageScaler(survey_data = mapper.survey_data, meds = mapper.meds_cleaned,
-                          dosages = mapper.dosages, units = mapper.units,
-                          RoAs = mapper.RoAs, drug_dict = mapper.drug_dictionary)
+    scaler = DosageScaler(survey_data = survey_data, meds = meds,
+                          dosages = dosages, units = units,
+                          RoAs = RoAs, drug_dict = drug_dict, reference_stats = reference_stats)
 
     # label patient drug classes
     for drug_class in drug_classes:
@@ -228,27 +203,27 @@ if __name__ == '__main__':
 
     # make a data frame
     patient_dose_feature_df = pd.DataFrame(patient_dose_feature_dict)
-    patient_dose_feature_df.insert(0, args.patient_id, mapper.survey_data[args.patient_id])
+    patient_dose_feature_df.insert(0, patient_id, survey_data[patient_id])
 
     patient_dose_feature_df.rename({'^calcium$': 'calcium', 'oestrogens|androgens': 'sex hormone therapy',
                                     'antimuscarinics, other': 'antimuscarinics',
                                     'non-steroidal anti-inflammatory drugs': 'nsaids'}, axis=1, inplace=True)
 
     # mask for unspecified HRT answers
-    HRT_mask = mapper.meds_cleaned.str.contains('hrt|estrogen|hormone replacement therapy|contracept')
-    HRT_idx = mapper.meds_cleaned[HRT_mask].index.get_level_values(0)
+    HRT_mask = meds.str.contains('hrt|estrogen|hormone replacement therapy|contracept')
+    HRT_idx = meds[HRT_mask].index.get_level_values(0)
 
     # mask for unspecified vitamin d3
-    d3_mask = mapper.meds_cleaned.str.contains('(\s|^)d3|vitamin d(\s|$)', case=False)
-    d3_idx = mapper.meds_cleaned[d3_mask].index.get_level_values(0)
+    d3_mask = meds.str.contains('(\s|^)d3|vitamin d(\s|$)', case=False)
+    d3_idx = meds[d3_mask].index.get_level_values(0)
 
     # mask for unspecified statin answers
-    statin_mask = mapper.meds_cleaned.str.contains('(\s|^)statin(s|\s|$)', case=False)
-    statin_idx = mapper.meds_cleaned[statin_mask].index.get_level_values(0)
+    statin_mask = meds.str.contains('(\s|^)statin(s|\s|$)', case=False)
+    statin_idx = meds[statin_mask].index.get_level_values(0)
 
     # mask for unspecified steroid answers
-    steroid_mask = mapper.meds_cleaned.str.contains('(\s|^)corticosteroid(s|\s|$)', case=False)
-    steroid_idx = mapper.meds_cleaned[steroid_mask].index.get_level_values(0)
+    steroid_mask = meds.str.contains('(\s|^)corticosteroid(s|\s|$)', case=False)
+    steroid_idx = meds[steroid_mask].index.get_level_values(0)
 
     # set unspecified medications to NA
     patient_dose_feature_df.loc[HRT_idx, 'sex hormone therapy'] = -1
@@ -256,5 +231,94 @@ if __name__ == '__main__':
     patient_dose_feature_df.loc[statin_idx, 'statins'] = -1
     patient_dose_feature_df.loc[steroid_idx, 'corticosteroids'] = -1
 
-    # save to csv file
-    patient_dose_feature_df.to_csv('{}_Drug_Dosages.csv'.format(filename), index = False)
\ No newline at end of file
+    return patient_dose_feature_df, scaler.dosage_stats
+
+if __name__ == '__main__':
+
+    warnings.simplefilter('ignore')
+
+    # file path and column name arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
+    parser.add_argument('-q', '--questions', default = ['q1421', 'q1431', 'q1432', 'q1442'], nargs = 4, type = str,
+                        help = 'Column names for medication, dosage, unit, and RoA questions')
+    parser.add_argument('-id', '--patient_id', default='uid', type=str, help='Column name for unique patient identifiers')
+    parser.add_argument('--chunksize', default=None, type=int,
+                        help='Number of survey rows to read at a time, to limit memory use for large survey files')
+    parser.add_argument('-c', '--cache', default='data/answer_mapping_cache.db', type=str,
+                        help='Path to the cache of answer mappings from previous runs')
+    parser.add_argument('--no_cache', action='store_true', help='Map all answers without reading or writing the cache')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recompute respondents whose answers changed since the last run, patching the output file')
+    parser.add_argument('-s', '--state', default='data/incremental_state.db', type=str,
+                        help='Path to the state file of incremental runs')
+    parser.add_argument('--refresh_reference', action='store_true',
+                        help='In incremental mode, recompute the reference dosage statistics and every respondent')
+    parser.add_argument('--refresh_threshold', default=0.1, type=float,
+                        help='In incremental mode, fraction of respondents that can be recomputed before the reference '
+                             'dosage statistics are refreshed')
+    args = parser.parse_args()
+
+    # get the filename prefix from the filepath, for output file name
+    filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
+
+    # import the drug dictionary
+    drug_dictionary = get_drug_dictionary()
+
+    # create instance of answer mapper class with the survey file path
+    mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q = args.questions[0],
+                          dosage_q = args.questions[1], units_q = args.questions[2], RoAs_q = args.questions[3],
+                          drug_dict_filepath = DRUG_DICTIONARY_FILEPATH, id_column = args.patient_id,
+                          chunksize = args.chunksize)
+
+    # generate answer mappings
+    cache = None if args.no_cache else MappingCache(args.cache, drug_dictionary_filepath=DRUG_DICTIONARY_FILEPATH,
+                                                    manual_corrections_filepath='data/answer_mappings_complete.csv')
+    mapper.map_answers(cache = cache)
+
+    # update drug dictionary with manual corrections file
+    mapper.update_drug_dictionary(manual_corrections_filepath='data/answer_mappings_complete.csv')
+
+    output_filepath = '{}_Drug_Dosages.csv'.format(filename)
+
+    # in incremental mode, compare the answers of each respondent to the last run
+    if args.incremental:
+        state = IncrementalState(args.state, output_filepath, key = get_state_key([BNF_CLASSES_FILEPATH], args.questions))
+        fingerprints = fingerprint_respondents(mapper, args.patient_id)
+        changed, removed = state.get_changes(fingerprints)
+        reference_stats = state.get_reference_stats()
+
+        # the dosages are scaled relative to reference statistics from the last full run, which are refreshed (recomputing
+        # every respondent) when requested, or when the respondents recomputed since then exceed a fraction of the reference
+        refresh_reference = args.refresh_reference or reference_stats is None or \
+            state.n_changed + len(changed) + len(removed) > args.refresh_threshold * state.n_reference
+
+    # if the reference statistics are kept, only recompute the changed respondents and patch them into the output file
+    if args.incremental and not refresh_reference:
+        changed_rows = mapper.survey_data.index[mapper.survey_data[args.patient_id].astype(str).isin(changed)]
+        answer_mask = mapper.meds_cleaned.index.get_level_values(0).isin(changed_rows)
+        patient_dose_feature_df, _ = get_patient_dose_features(mapper.survey_data.loc[changed_rows],
+                                                               mapper.meds_cleaned[answer_mask], mapper.dosages[answer_mask],
+                                                               mapper.units[answer_mask], mapper.RoAs[answer_mask],
+                                                               mapper.drug_dictionary, args.patient_id,
+                                                               reference_stats = reference_stats)
+        patch_output(output_filepath, patient_dose_feature_df, args.patient_id, mapper.survey_data[args.patient_id],
+                     changed, removed)
+        state.save(fingerprints, n_changed = len(changed) + len(removed))
+        print('{} respondents updated, {} removed'.format(len(changed), len(removed)))
+
+    # otherwise make a data frame of the dosage features for every respondent, scaled relative to all answers
+    else:
+        patient_dose_feature_df, dosage_stats = get_patient_dose_features(mapper.survey_data, mapper.meds_cleaned,
+                                                                          mapper.dosages, mapper.units, mapper.RoAs,
+                                                                          mapper.drug_dictionary, args.patient_id)
+
+        # save to csv file
+        patient_dose_feature_df.to_csv(output_filepath, index = False)
+
+        # save the statistics of this run as the reference for later incremental runs
+        if args.incremental:
+            state.save(fingerprints, reference_stats = dosage_stats)
+
+    if args.incremental:
+        state.close()
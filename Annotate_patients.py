@@ -1,17 +1,16 @@
 import pandas as pd
 import numpy as np
 import warnings
-import pickle
 import re
 import argparse
 from itertools import compress
-warnings.simplefilter('ignore')
 
 # import class for mapping survey answers
 from utils.answer_mapping import AnswerMapper
-
-# import the drug dictionary
-drug_dictionary = pickle.load(open('../data/drug_dictionary.p', 'rb'))
+from utils.mapping_cache import MappingCache
+from utils.id_sets import IDSetTable
+from utils.resources import get_drug_dictionary, get_bnf_classes, DRUG_DICTIONARY_FILEPATH, BNF_CLASSES_FILEPATH
+from utils.incremental import IncrementalState, fingerprint_respondents, get_state_key, patch_output
 
 # drug classes and specific drugs to investigate
 drug_classes = ['statins', 'ace inhibitors', 'proton pump inhibitors', 'corticosteroids',
@@ -29,6 +28,9 @@ drug_classes = ['statins', 'ace inhibitors', 'proton pump inhibitors', 'corticos
 
 specific_drugs = ['paracetamol', 'metformin', 'aspirin', 'digoxin']
 
+# drug classes restricted to a route of administration (answers to the roa question - 1: oral, 2: inhaled)
+drug_class_roas = {'inhaled_corticosteroids': ('corticosteroids', 2), 'oral_corticosteroids': ('corticosteroids', 1)}
+
 # class for annotating patients with BNF drug classes
 class PatientAnnotator:
 
@@ -36,8 +38,7 @@ class PatientAnnotator:
     def read_in_bnf(self, drug_dictionary):
 
         # import bnf class dataframe
-        bnf_classes = pd.read_csv('data/bnf_drug_classifications.csv')
-        bnf_classes['drugs'] = bnf_classes['drugs'].str.split('; ')
+        bnf_classes = get_bnf_classes()
 
         # map bnf columns to drugbank ids
         bnf_classes['db_id'] = bnf_classes['drugs'].apply(
@@ -92,10 +93,33 @@ class PatientAnnotator:
         self.drug_dictionary = drug_dict
         # get bnf data from the data directory
         self.read_in_bnf(drug_dict)
+        # map the answers to drugbank id sets
+        self.build_answer_id_sets()
 
-    # function for updating dictionary with a list of patient indices belonging to a drug class
-    def get_patients_in_class(self, drug_class, roa = None):
+    # function for mapping each answer to its set of drugbank ids in a table of distinct sets, and building the patient x answer matrix
+    def build_answer_id_sets(self):
+
+        from scipy import sparse
+
+        # encode the answers as integer codes into the distinct answer strings, so each string is only looked up once
+        answer_codes, unique_answers = pd.factorize(self.meds)
+
+        # table of the distinct drugbank id sets of the answers, with the index of each answer's set
+        self.id_sets = IDSetTable()
+        unique_answer_set_codes = np.array([self.id_sets.intern(self.drug_dictionary.get(answer) or set())
+                                            for answer in unique_answers], dtype = np.int64)
+        self.answer_set_codes = unique_answer_set_codes[answer_codes]
+
+        # matrix of patients x answers, with patients in the same order as a groupby on the first index level
+        patient_codes, self.patients = pd.factorize(self.meds.index.get_level_values(0), sort = True)
+        self.patient_answer_matrix = sparse.csr_matrix((np.ones(len(patient_codes), dtype = np.int32),
+                                                        (patient_codes, np.arange(len(patient_codes)))),
+                                                       shape = (len(self.patients), len(patient_codes)))
+
+    # function for getting the drugbank ids of a drug class
+    def get_class_db_ids(self, drug_class):
 
+        # filter for BNF listings that mapped to the drug dictionary
         valid_bnf_classes = self.bnf_classes[self.bnf_classes['db_id'].apply(lambda ids: len(ids) > 0)]
 
         # get bnf entries that fall into the desired drug class
@@ -108,25 +132,55 @@ class PatientAnnotator:
         # get the db ids corresponding to the drug class
         class_db_ids = set().union(*class_drugs['db_id'][single_id_mask])
 
-        # function for checking if a patient's answers are in a drug class
+        return class_db_ids
+
+    # function for getting a boolean array of answers x drug classes, indicating the answers containing an id in each class
+    def get_answer_class_mask(self, drug_classes):
+
+        # test each distinct id set against each class, then take the row of each answer's set
+        set_class_mask = np.zeros((len(self.id_sets.sets), len(drug_classes)), dtype = bool)
+        for i, drug_class in enumerate(drug_classes):
+            set_class_mask[:, i] = self.id_sets.intersects(self.get_class_db_ids(drug_class))
+
+        return set_class_mask[self.answer_set_codes]
+
+    # function for getting a boolean data frame of patients x drug classes, indicating the patients in each class
+    def get_class_flags(self, drug_classes):
+
+        # count the answers of each patient that contain an id in each class, with a single sparse matrix product
+        answer_class_mask = self.get_answer_class_mask(drug_classes)
+        patient_class_counts = self.patient_answer_matrix @ answer_class_mask.astype(np.int32)
+
+        return pd.DataFrame(patient_class_counts > 0, index = self.patients, columns = drug_classes)
+
+    # function for getting a boolean data frame of patients x features, where each feature is a (drug class, roa) pair
+    def get_class_roa_flags(self, class_roas):
+
+        # answers x features, for answers containing an id in each feature's class
+        answer_class_mask = self.get_answer_class_mask([drug_class for drug_class, _ in class_roas.values()])
+
+        # answers x features, for answers given with each feature's route of administration
+        # the roa answers are aligned with the medication answers by position
+        RoAs = self.RoAs.to_numpy()
+        answer_roa_mask = np.zeros(answer_class_mask.shape, dtype = bool)
+        for i, (_, roa) in enumerate(class_roas.values()):
+            answer_roa_mask[:, i] = RoAs == roa
+
+        # count the answers of each patient in each class with the right route of administration
+        answer_feature_mask = (answer_class_mask & answer_roa_mask).astype(np.int32)
+        patient_feature_counts = self.patient_answer_matrix @ answer_feature_mask
+
+        return pd.DataFrame(patient_feature_counts > 0, index = self.patients, columns = list(class_roas))
+
+    # function for updating dictionary with a list of patient indices belonging to a drug class
+    def get_patients_in_class(self, drug_class, roa = None):
+
         # if roa not specified take all members from the class
         if roa is None:
-            is_in_class = lambda patient: patient.apply(
-                lambda answer: any([db_id in class_db_ids for db_id in self.drug_dictionary.get(answer)])
-                if self.drug_dictionary.get(answer) else False).any()
-            # group by patient and apply the is_in_class function to each patient
-            patient_class_mask = self.meds.groupby(level=0).aggregate(func=is_in_class)
+            patient_class_mask = self.get_class_flags([drug_class])[drug_class]
         # otherwise match by roa as well
         else:
-            is_in_class = lambda meds, roas: any([any([db_id in class_db_ids for db_id in self.drug_dictionary.get(patient_med)])
-                                                  and patient_roa == roa if self.drug_dictionary.get(patient_med) else False
-                                                  for patient_med, patient_roa in zip(meds, roas)])
-            patient_class_mask = []
-            for patient in self.meds.index.get_level_values(0):
-                in_class = is_in_class(self.meds[patient], self.RoAs[patient])
-                patient_class_mask.append(in_class)
-                
-            patient_class_mask = pd.Series(patient_class_mask, index = self.meds.index.get_level_values(0))
+            patient_class_mask = self.get_class_roa_flags({drug_class: (drug_class, roa)})[drug_class]
 
         # get the indices of patients in the class
         patients_in_class = patient_class_mask.index[patient_class_mask].tolist()
@@ -139,41 +193,20 @@ class PatientAnnotator:
         # get the drugbank ids corresponding to the drug of interest
         drug_db_ids = self.drug_dictionary[drug]
 
-        # function for assessing whether each patient takes the drug
-        takes_drug = lambda patient: patient.apply(lambda drug: self.drug_dictionary.get(drug).issuperset(drug_db_ids)
-                                                   if self.drug_dictionary.get(drug) else False).any()
+        # answers containing all of the drug's ids - if any id is not in the answers, no patient takes the drug
+        answer_drug_mask = self.id_sets.contains(drug_db_ids)[self.answer_set_codes]
 
-        # group by patient and apply the takes_drug function to each patient
-        patient_drug_mask = self.meds.groupby(level = 0).aggregate(func = takes_drug)
+        # patients with any answer containing the drug
+        patient_drug_mask = pd.Series(self.patient_answer_matrix @ answer_drug_mask > 0, index = self.patients)
 
         # get the indices of patients taking the drug
         patients_on_drug = patient_drug_mask.index[patient_drug_mask].tolist()
 
         return patients_on_drug
 
-# if run from the command line, output a CSV file with answer mappings
-if __name__ == '__main__':
-
-    # file path and question column name arguments
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
-    parser.add_argument('-q', '--questions', default = ['q1421', 'q1431', 'q1432', 'q1442'], nargs = 4, type = str,
-                        help = 'Column names for medication, dosage, unit, and route of administration questions')
-    parser.add_argument('-id', '--patient_id', default='uid', type=str, help='Column name for unique patient identifiers')
-    args = parser.parse_args()
-
-    # get the filename prefix from the filepath, for output file
-    filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
-
-    # create instance of answer mapper class with the survey file path
-    mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q = args.questions[0],
-                          dosage_q = args.questions[1], units_q = args.questions[2], RoAs_q = args.questions[3])
-
-    # call map answers
-    mapper.map_answers()
-
-    # update drug dictionary with manual corrections file
-    mapper.update_drug_dictionary(manual_corrections_filepath='data/answer_mappings_complete.csv')
+# function for getting a data frame of binary drug class and drug features for each row of the survey data
+# the meds and RoAs series should only contain answers from the rows of the survey data
+def get_patient_features(survey_data, meds, RoAs, drug_dict, patient_id):
 
     # dictionary for patient drug classes
     patient_drug_class_dict = {}
@@ -182,14 +215,17 @@ if __name__ == '__main__':
     patient_drug_dict = {}
 
     # initialise class instance
-    annotator = PatientAnnotator(meds=mapper.meds_cleaned, RoAs=mapper.RoAs, drug_dict=mapper.drug_dictionary)
+    annotator = PatientAnnotator(meds=meds, RoAs=RoAs, drug_dict=drug_dict)
 
     # label patient drug classes
+    patient_class_flags = annotator.get_class_flags(drug_classes)
     for drug_class in drug_classes:
-        patient_drug_class_dict[drug_class] = annotator.get_patients_in_class(drug_class)
+        patient_drug_class_dict[drug_class] = patient_class_flags.index[patient_class_flags[drug_class]].tolist()
 
-    patient_drug_class_dict['inhaled_corticosteroids'] = annotator.get_patients_in_class('corticosteroids', roa = 2)
-    patient_drug_class_dict['oral_corticosteroids'] = annotator.get_patients_in_class('corticosteroids', roa = 1)
+    # label patient drug classes by route of administration
+    patient_class_roa_flags = annotator.get_class_roa_flags(drug_class_roas)
+    for feature in drug_class_roas:
+        patient_drug_class_dict[feature] = patient_class_roa_flags.index[patient_class_roa_flags[feature]].tolist()
 
     # label patient drugs
     for drug in specific_drugs:
@@ -199,8 +235,8 @@ if __name__ == '__main__':
     patient_feature_dict = {**patient_drug_class_dict, **patient_drug_dict}
 
     # make a data frame
-    patient_feature_df = pd.DataFrame(0, index = mapper.survey_data.index, columns = patient_feature_dict)
-    patient_feature_df.insert(0, args.patient_id, mapper.survey_data[args.patient_id])
+    patient_feature_df = pd.DataFrame(0, index = survey_data.index, columns = patient_feature_dict)
+    patient_feature_df.insert(0, patient_id, survey_data[patient_id])
 
     # set patient indices for each feature to 1 in the full patient feature data frame
     for feature in patient_feature_dict:
@@ -213,23 +249,23 @@ if __name__ == '__main__':
                               axis = 1, inplace = True)
 
     # manual corrections for HRT answers not in the drug dictionary
-    HRT_mask = mapper.meds_cleaned.str.contains('hrt|estrogen|hormone replacement therapy|contracept')
-    HRT_idx = mapper.meds_cleaned[HRT_mask].index.get_level_values(0)
+    HRT_mask = meds.str.contains('hrt|estrogen|hormone replacement therapy|contracept')
+    HRT_idx = meds[HRT_mask].index.get_level_values(0)
     patient_feature_df.loc[HRT_idx, 'sex hormone therapy'] = 1
 
     # manual corrections for vitamin d3 answers not in the drug dictionary
-    d3_mask = mapper.meds_cleaned.str.contains('(\s|^)d3|vitamin d(\s|$)', case = False)
-    d3_idx = mapper.meds_cleaned[d3_mask].index.get_level_values(0)
+    d3_mask = meds.str.contains('(\s|^)d3|vitamin d(\s|$)', case = False)
+    d3_idx = meds[d3_mask].index.get_level_values(0)
     patient_feature_df.loc[d3_idx, 'vitamin d and analogues'] = 1
 
     # manual corrections for statin answers not in the drug dictionary
-    statin_mask = mapper.meds_cleaned.str.contains('(\s|^)statin(s|\s|$)', case = False)
-    statin_idx = mapper.meds_cleaned[statin_mask].index.get_level_values(0)
+    statin_mask = meds.str.contains('(\s|^)statin(s|\s|$)', case = False)
+    statin_idx = meds[statin_mask].index.get_level_values(0)
     patient_feature_df.loc[statin_idx, 'statins'] = 1
 
     # manual corrections for steroid answers not in the drug dictionary
-    steroid_mask = mapper.meds_cleaned.str.contains('(\s|^)corticosteroid(s|\s|$)', case = False)
-    steroid_idx = mapper.meds_cleaned[steroid_mask].index.get_level_values(0)
+    steroid_mask = meds.str.contains('(\s|^)corticosteroid(s|\s|$)', case = False)
+    steroid_idx = meds[steroid_mask].index.get_level_values(0)
     patient_feature_df.loc[steroid_idx, 'corticosteroids'] = 1
 
     patient_feature_df['Systemic immunosuppressants'] = np.where((patient_feature_df['tnf-a inhibitors'] == 1) |
@@ -244,5 +280,75 @@ if __name__ == '__main__':
                                                               (patient_feature_df['serotonin and noradrenaline re-uptake inhibitors'] == 1),
                                                               1, 0)
 
-    # save the drug class data as a csv file
-    patient_feature_df.to_csv('{}_Drug_Classes.csv'.format(filename), index = False)
\ No newline at end of file
+    return patient_feature_df
+
+# if run from the command line, output a CSV file with answer mappings
+if __name__ == '__main__':
+
+    warnings.simplefilter('ignore')
+
+    # file path and question column name arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
+    parser.add_argument('-q', '--questions', default = ['q1421', 'q1431', 'q1432', 'q1442'], nargs = 4, type = str,
+                        help = 'Column names for medication, dosage, unit, and route of administration questions')
+    parser.add_argument('-id', '--patient_id', default='uid', type=str, help='Column name for unique patient identifiers')
+    parser.add_argument('--chunksize', default=None, type=int,
+                        help='Number of survey rows to read at a time, to limit memory use for large survey files')
+    parser.add_argument('-c', '--cache', default='data/answer_mapping_cache.db', type=str,
+                        help='Path to the cache of answer mappings from previous runs')
+    parser.add_argument('--no_cache', action='store_true', help='Map all answers without reading or writing the cache')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recompute respondents whose answers changed since the last run, patching the output file')
+    parser.add_argument('-s', '--state', default='data/incremental_state.db', type=str,
+                        help='Path to the state file of incremental runs')
+    args = parser.parse_args()
+
+    # get the filename prefix from the filepath, for output file
+    filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
+
+    # import the drug dictionary
+    drug_dictionary = get_drug_dictionary()
+
+    # create instance of answer mapper class with the survey file path
+    mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q = args.questions[0],
+                          dosage_q = args.questions[1], units_q = args.questions[2], RoAs_q = args.questions[3],
+                          drug_dict_filepath = DRUG_DICTIONARY_FILEPATH, id_column = args.patient_id,
+                          chunksize = args.chunksize)
+
+    # call map answers
+    cache = None if args.no_cache else MappingCache(args.cache, drug_dictionary_filepath=DRUG_DICTIONARY_FILEPATH,
+                                                    manual_corrections_filepath='data/answer_mappings_complete.csv')
+    mapper.map_answers(cache = cache)
+
+    # update drug dictionary with manual corrections file
+    mapper.update_drug_dictionary(manual_corrections_filepath='data/answer_mappings_complete.csv')
+
+    output_filepath = '{}_Drug_Classes.csv'.format(filename)
+
+    # in incremental mode, compare the answers of each respondent to the last run
+    if args.incremental:
+        state = IncrementalState(args.state, output_filepath, key = get_state_key([BNF_CLASSES_FILEPATH], args.questions))
+        fingerprints = fingerprint_respondents(mapper, args.patient_id)
+        changed, removed = state.get_changes(fingerprints)
+
+    # if there is a previous run, only recompute the changed respondents and patch them into the output file
+    if args.incremental and state.valid:
+        changed_rows = mapper.survey_data.index[mapper.survey_data[args.patient_id].astype(str).isin(changed)]
+        answer_mask = mapper.meds_cleaned.index.get_level_values(0).isin(changed_rows)
+        patient_feature_df = get_patient_features(mapper.survey_data.loc[changed_rows], mapper.meds_cleaned[answer_mask],
+                                                  mapper.RoAs[answer_mask], mapper.drug_dictionary, args.patient_id)
+        patch_output(output_filepath, patient_feature_df, args.patient_id, mapper.survey_data[args.patient_id], changed, removed)
+        print('{} respondents updated, {} removed'.format(len(changed), len(removed)))
+
+    # otherwise make a data frame of the patient features for every respondent
+    else:
+        patient_feature_df = get_patient_features(mapper.survey_data, mapper.meds_cleaned, mapper.RoAs, mapper.drug_dictionary,
+                                                  args.patient_id)
+
+        # save the drug class data as a csv file
+        patient_feature_df.to_csv(output_filepath, index = False)
+
+    if args.incremental:
+        state.save(fingerprints)
+        state.close()
\ No newline at end of file
@@ -1,48 +1,48 @@
-from urllib.request import urlopen
 from urllib.parse import quote
 from bs4 import BeautifulSoup as bs
 import pandas as pd
+import os
 import re
+import argparse
 
-# if running the file, pull new data
-if __name__ == '__main__':
-
-    bnf_drug_url = urlopen('https://bnf.nice.org.uk/drug/')
-
-    bnf_drugs_html = bs(bnf_drug_url, 'html.parser')
+from utils.http_cache import CachedFetcher, Checkpoint
 
+# get the names of the drugs listed on the BNF drug index page
+def get_drug_names(bnf_drugs_html):
     # drug names are kept as a 'span' html object
     drug_html_data = bnf_drugs_html.find_all('span')
-
     # clean the text
     drug_names = [elem.text.lower().strip() for elem in drug_html_data if elem.text]
     # remove last element, which does not correspond to a drug
     drug_names.pop()
+    return drug_names
 
-    # dictionary for storing the BNF classification for each drug
-    drug_classifications = {}
-
-    # loop through drugs, access url, and get the classification for each
-    for drug in drug_names:
-        drug_name_for_url = re.sub('[\s,]+', '-', drug)
-        drug_name_for_url = re.sub('[^\w-]', '', drug_name_for_url)
-        drug_name_for_url = quote(drug_name_for_url)
-        drug_url = urlopen('https://bnf.nice.org.uk/drug/{}.html'.format(drug_name_for_url))
-        drug_html = bs(drug_url, 'html.parser')
-        primary_classification_html_obj = drug_html.find_all('a', {'class': 'classification primary-classification'})
-        secondary_classification_html_obj = drug_html.find_all('a', {'class': 'classification secondary-classification'})
-        # return the list of primary classifications if it exists, else 'None'
-        if len(primary_classification_html_obj) > 0:
-            primary_classification = [elem.text.strip() for elem in primary_classification_html_obj]
-        # save None as a list so we can use str.join later
-        else:
-            primary_classification = ['None']
-        # same with secondary classification
-        if len(secondary_classification_html_obj) > 0:
-            secondary_classification = [elem.text.strip() for elem in secondary_classification_html_obj]
-        else:
-            secondary_classification = ['None']
-        drug_classifications[drug] = [primary_classification, secondary_classification]
+# get the url of the BNF page of a drug
+def get_drug_url(drug, base_url):
+    drug_name_for_url = re.sub('[\s,]+', '-', drug)
+    drug_name_for_url = re.sub('[^\w-]', '', drug_name_for_url)
+    drug_name_for_url = quote(drug_name_for_url)
+    return '{}/drug/{}.html'.format(base_url, drug_name_for_url)
+
+# get the primary and secondary classifications listed on the BNF page of a drug
+def get_classifications(drug_html):
+    primary_classification_html_obj = drug_html.find_all('a', {'class': 'classification primary-classification'})
+    secondary_classification_html_obj = drug_html.find_all('a', {'class': 'classification secondary-classification'})
+    # return the list of primary classifications if it exists, else 'None'
+    if len(primary_classification_html_obj) > 0:
+        primary_classification = [elem.text.strip() for elem in primary_classification_html_obj]
+    # save None as a list so we can use str.join later
+    else:
+        primary_classification = ['None']
+    # same with secondary classification
+    if len(secondary_classification_html_obj) > 0:
+        secondary_classification = [elem.text.strip() for elem in secondary_classification_html_obj]
+    else:
+        secondary_classification = ['None']
+    return [primary_classification, secondary_classification]
+
+# build the BNF classes data frame from a dictionary of drugs mapped to their classifications
+def get_bnf_classes(drug_classifications):
 
     bnf_classes = pd.DataFrame(drug_classifications).T
     bnf_classes.columns = ['primary', 'secondary']
@@ -57,4 +57,92 @@ if __name__ == '__main__':
     bnf_classes['primary'] = bnf_classes['primary'].str.join('; ')
     bnf_classes['secondary'] = bnf_classes['secondary'].str.join('; ')
 
-    bnf_classes.to_csv('data/bnf_drug_classifications.csv', index_label='entry')
\ No newline at end of file
+    return bnf_classes
+
+# compare two versions of the BNF classes data frame, returning the drugs that were added, removed or reclassified
+def diff_bnf_classes(old_classes, new_classes):
+    '''
+    Entries are matched on the drugs column. The returned data frame has a row for each changed entry, with the
+    type of change and the old and new primary and secondary classifications (missing for added and removed entries).
+    '''
+    old_classes = old_classes.drop_duplicates('drugs').set_index('drugs')[['primary', 'secondary']]
+    new_classes = new_classes.drop_duplicates('drugs').set_index('drugs')[['primary', 'secondary']]
+
+    common = new_classes.index.intersection(old_classes.index)
+    reclassified_mask = (old_classes.loc[common] != new_classes.loc[common]).any(axis = 1).to_numpy()
+    changes = pd.concat([pd.Series('added', index = new_classes.index.difference(old_classes.index)),
+                         pd.Series('removed', index = old_classes.index.difference(new_classes.index)),
+                         pd.Series('reclassified', index = common[reclassified_mask])])
+
+    diff = pd.DataFrame({'change': changes})
+    diff = diff.join(old_classes.add_prefix('old_')).join(new_classes.add_prefix('new_'))
+    return diff.rename_axis('drugs').reset_index()
+
+# get the classifications of each drug from its BNF page, keyed by drug name
+def get_drug_classifications(drug_names, base_url, fetcher, parsed_pages, refresh = False):
+    '''
+    The classifications parsed from each page are saved in parsed_pages (a Checkpoint keyed by url). In refresh mode,
+    pages that did not change since they were parsed (answered with 304, or with the same body) are not parsed again.
+    '''
+
+    # get the classifications of a drug, parsing its page only if it changed (in refresh mode)
+    def get_classifications_of_drug(drug):
+        drug_url = get_drug_url(drug, base_url)
+        drug_page, changed = fetcher.fetch_with_status(drug_url)
+        if refresh and not changed and drug_url in parsed_pages:
+            return parsed_pages.get(drug_url)
+        classifications = get_classifications(bs(drug_page, 'html.parser'))
+        parsed_pages.set(drug_url, classifications)
+        return classifications
+
+    # dictionary for storing the BNF classification for each drug
+    drug_classifications = dict(zip(drug_names, fetcher.map(get_classifications_of_drug, drug_names)))
+    parsed_pages.save()
+
+    return drug_classifications
+
+# pull the BNF classes and save them to a CSV, in refresh mode also saving a diff against the existing CSV
+def pull_bnf_classes(output_filepath, base_url, fetcher, parsed_pages, refresh = False, diff_filepath = None):
+
+    bnf_drugs_html = bs(fetcher.fetch('{}/drug/'.format(base_url)), 'html.parser')
+    drug_names = get_drug_names(bnf_drugs_html)
+
+    drug_classifications = get_drug_classifications(drug_names, base_url, fetcher, parsed_pages, refresh)
+
+    bnf_classes = get_bnf_classes(drug_classifications)
+
+    if refresh and os.path.exists(output_filepath):
+        diff = diff_bnf_classes(pd.read_csv(output_filepath), bnf_classes)
+        diff.to_csv(diff_filepath, index = False)
+        print('{} drugs added, {} removed and {} reclassified, diff saved to {}'.format(
+            *[(diff['change'] == change).sum() for change in ['added', 'removed', 'reclassified']], diff_filepath))
+
+    bnf_classes.to_csv(output_filepath, index_label='entry')
+
+    return bnf_classes
+
+# if running the file, pull new data
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Pull the BNF drug classifications')
+    parser.add_argument('--refresh', action = 'store_true',
+                        help = 'Only re-parse the drug pages that changed since the last run, and save a diff against the existing CSV')
+    parser.add_argument('-o', '--output', type = str, default = 'data/bnf_drug_classifications.csv',
+                        help = 'Path to the BNF drug classifications CSV')
+    parser.add_argument('-d', '--diff', type = str, default = 'data/bnf_drug_classifications_diff.csv',
+                        help = 'Path for the diff of added, removed and reclassified drugs, saved in refresh mode')
+    parser.add_argument('--base_url', type = str, default = 'https://bnf.nice.org.uk',
+                        help = 'Base url of the BNF website, e.g. a local server serving recorded pages')
+    parser.add_argument('--workers', type = int, default = 8, help = 'Number of pages fetched at the same time')
+    parser.add_argument('--rate', type = float, default = 5,
+                        help = 'Maximum number of requests per second, 0 for no limit')
+    parser.add_argument('--cache_dir', type = str, default = 'data/bnf_cache', help = 'Directory for cached BNF pages')
+    args = parser.parse_args()
+
+    # pages are always revalidated, so that changes on the BNF website are picked up
+    fetcher = CachedFetcher(args.cache_dir, max_workers = args.workers, requests_per_second = args.rate, max_age = 0)
+    # classifications parsed from each drug page, keyed by url
+    parsed_pages = Checkpoint(os.path.join(args.cache_dir, 'classifications.json'))
+
+    pull_bnf_classes(args.output, args.base_url.rstrip('/'), fetcher, parsed_pages, refresh = args.refresh,
+                     diff_filepath = args.diff)
@@ -1,22 +1,24 @@
-from urllib.request import Request, urlopen
 from bs4 import BeautifulSoup as bs
 import re
+import os
+import argparse
 from string import ascii_uppercase
 from math import ceil
 import pickle
 
-# get the DrugBank drug dictionary
-from utils.parse_db import drug_dictionary
-
-print('DrugBank XML tree parsed, pulling compounds from EMC...')
+from utils.http_cache import CachedFetcher, Checkpoint
+from utils.parse_db import build_drug_dictionary
+from utils.phonetic_index import build_phonetic_index
+from utils.drug_dictionary import build_compiled_dictionary
 
 ## functions for parsing html data from EMC ##
 
-# get the html data from a url
-def get_html(url):
-    req = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    webpage = urlopen(req).read()
-    html = bs(webpage, 'html.parser')
+# base url of the EMC website, used unless another is given on the command line
+base_url = 'https://www.medicines.org.uk'
+
+# get the html data from a url with a fetcher
+def get_html(url, fetcher):
+    html = bs(fetcher.fetch(url), 'html.parser')
     return html
 
 # regex pattern for the number of drug results under a certain letter
@@ -28,8 +30,8 @@ def get_n_results(html):
     return n_results
 
 # get drugs and corresponding links
-def get_links_on_page(url):
-    html = get_html(url)
+def get_links_on_page(url, fetcher, drug_dictionary):
+    html = get_html(url, fetcher)
     drugs = [elem.find('h2').text.strip('\n').lower() for elem in html.find_all('div', {'class': 'row data-row'})]
     links = [elem.find('h2').find('a').get('href') for elem in html.find_all('div', {'class': 'row data-row'})]
     # only save keys corresponding to the lowercase first word of every entry
@@ -41,37 +43,37 @@ def get_links_on_page(url):
 
 
 # get the active ingredients from the link to a drug on EMC
-def get_active_ingredients(link):
-    drug_url = 'https://www.medicines.org.uk' + link
+def get_active_ingredients(link, base_url, fetcher):
+    drug_url = base_url + link
     try:
-        drug_html = get_html(drug_url)
+        drug_html = get_html(drug_url, fetcher)
         active_ingredients = [elem.text.strip().lower() for elem in drug_html.find('div', {'class': 'col-xs-12 col-sm-6'}).find_all('li')]
         # split individual ingredient listings containing semi-colons
         active_ingredients = [ingr for ingrs in active_ingredients for ingr in ingrs.split('; ')]
-    # return none if an error is thrown
-    except:
+    # return none if the page could not be fetched (after retries) or does not list active ingredients
+    except (OSError, AttributeError):
         print('Error on {}'.format(link))
         active_ingredients = None
     return active_ingredients
 
-if __name__ == '__main__':
+# get the number of result pages under a letter
+def get_n_pages(letter, base_url, fetcher):
+    html = get_html('{}/emc/browse-medicines/{}'.format(base_url, letter), fetcher)
+    return ceil(get_n_results(html)/200)
+
+# get the links to the drugs listed on EMC whose first word is not in the drug dictionary, keyed by drug name
+def get_drug_links(drug_dictionary, base_url, fetcher):
 
     # list for all urls we need to pull active ingredients from
     all_urls = []
 
-    # loop through letters and get the drug names under each letter
-    for letter in ascii_uppercase:
-        # get the number of pages under each letter
-        url = 'https://www.medicines.org.uk/emc/browse-medicines/{}'.format(letter)
-        html = get_html(url)
-        n_results = get_n_results(html)
-        n_pages = ceil(n_results/200)
-        # get the all the drug pages for the letter and append to list
-        letter_urls = ['https://www.medicines.org.uk/emc/browse-medicines?prefix={}&offset={}&limit=200'.format(letter, (i*200)+1) for i in range(n_pages)]
+    # get the number of pages under each letter, then all the drug pages for each letter
+    n_pages_per_letter = fetcher.map(lambda letter: get_n_pages(letter, base_url, fetcher), ascii_uppercase)
+    for letter, n_pages in zip(ascii_uppercase, n_pages_per_letter):
+        letter_urls = ['{}/emc/browse-medicines?prefix={}&offset={}&limit=200'.format(base_url, letter, (i*200)+1) for i in range(n_pages)]
         all_urls.extend(letter_urls)
 
-
-    drug_links = map(get_links_on_page, all_urls)
+    drug_links = fetcher.map(lambda url: get_links_on_page(url, fetcher, drug_dictionary), all_urls)
 
     # dictionary for saving drug links
     all_drug_links = {}
@@ -80,27 +82,46 @@ if __name__ == '__main__':
     for link_dict in drug_links:
         all_drug_links.update(link_dict)
 
-    print('Links for unmapped compounds added, getting active ingredients...')
-
-    # dictionary for storing active ingredients
+    return all_drug_links
+
+# get the active ingredients of each drug from its link, keyed by drug name
+def get_all_active_ingredients(drug_links, drug_dictionary, base_url, fetcher, checkpoint):
+    '''
+    Active ingredients are saved to the checkpoint as they are pulled, and links already in the checkpoint (from an
+    interrupted crawl) are not requested again.
+    '''
+
+    # get the active ingredients from a link, saving them to the checkpoint
+    def get_checkpointed_ingredients(link):
+        if link in checkpoint:
+            return checkpoint.get(link)
+        active_ingredients = get_active_ingredients(link, base_url, fetcher)
+        # failed pages are not saved, so they are tried again when the crawl is resumed
+        if active_ingredients is not None:
+            checkpoint.set(link, active_ingredients)
+        return active_ingredients
+
+    # get the active ingredients of all drug links - failed requests are retried by the fetcher
+    ingredient_lists = fetcher.map(get_checkpointed_ingredients, list(drug_links.values()))
+    checkpoint.save()
+
+    # dictionary for storing active ingredients, filtering drugs that returned None
     all_active_ingredients = {}
+    for drug, active_ingredients in zip(drug_links, ingredient_lists):
+        if active_ingredients:
+            # for active ingredients not in the drug dictionary, take the first word only
+            all_active_ingredients[drug] = [ingr if ingr in drug_dictionary else re.sub('\s+.*$', '', ingr) for ingr in active_ingredients]
+
+    return all_active_ingredients
 
-    # loop through drug links and get active ingredients
-    for drug, link in all_drug_links.items():
-        active_ingredients = get_active_ingredients(link)
-        # for active ingredients not in the drug dictionary, take the first word only
-        active_ingredients = [ingr if ingr in drug_dictionary else re.sub('\s+.*$', '', ingr) for ingr in active_ingredients]
-        all_active_ingredients[drug] = active_ingredients
+# add the drugs listed on EMC to the drug dictionary, under their shortened names, mapped to the ids of their active ingredients
+def add_emc_drugs(drug_dictionary, base_url, fetcher, checkpoint):
 
-    # dictionary drug links where get_active_ingredients() returned None
-    unmapped = {drug: link for drug, link in all_drug_links.items() if all_active_ingredients[drug] is None}
+    all_drug_links = get_drug_links(drug_dictionary, base_url, fetcher)
 
-    # map the unmapped drugs
-    for drug, link in unmapped.items():
-        all_active_ingredients[drug] = get_active_ingredients(link)
+    print('Links for unmapped compounds added, getting active ingredients...')
 
-    # filter drugs that returned None
-    all_active_ingredients = {drug: ingrs for drug, ingrs in all_active_ingredients.items() if ingrs}
+    all_active_ingredients = get_all_active_ingredients(all_drug_links, drug_dictionary, base_url, fetcher, checkpoint)
 
     print('Active ingredients pulled, adding to drug dictionary...')
 
@@ -132,5 +153,44 @@ if __name__ == '__main__':
         if alias_drugbank_IDs[drug]:
             drug_dictionary[drug] = alias_drugbank_IDs[drug]
 
+    return drug_dictionary
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Build the drug dictionary from DrugBank and add the brand names listed on EMC')
+    parser.add_argument('--base_url', type = str, default = base_url,
+                        help = 'Base url of the EMC website, e.g. a local server serving recorded pages')
+    parser.add_argument('--workers', type = int, default = 8, help = 'Number of pages fetched at the same time')
+    parser.add_argument('--rate', type = float, default = 5,
+                        help = 'Maximum number of requests per second, 0 for no limit')
+    parser.add_argument('--max_age', type = float, default = 86400,
+                        help = 'Age in seconds after which cached pages are revalidated with the server')
+    parser.add_argument('--cache_dir', type = str, default = 'data/emc_cache', help = 'Directory for cached EMC pages')
+    parser.add_argument('--checkpoint', type = str, default = 'data/emc_checkpoint.json',
+                        help = 'Path to the checkpoint file used to resume an interrupted crawl')
+    args = parser.parse_args()
+
+    fetcher = CachedFetcher(args.cache_dir, max_workers = args.workers, requests_per_second = args.rate, max_age = args.max_age)
+
+    # get the DrugBank drug dictionary
+    drug_dictionary = build_drug_dictionary()
+
+    print('DrugBank XML tree parsed, pulling compounds from EMC...')
+
+    # active ingredients already pulled by an interrupted crawl, keyed by link
+    checkpoint = Checkpoint(args.checkpoint)
+
+    drug_dictionary = add_emc_drugs(drug_dictionary, args.base_url.rstrip('/'), fetcher, checkpoint)
+
     # save the dictionary to a pickle
-    pickle.dump(drug_dictionary, open('data/drug_dictionary.p', 'wb'))
\ No newline at end of file
+    pickle.dump(drug_dictionary, open('data/drug_dictionary.p', 'wb'))
+
+    # the crawl is complete, so the next run starts from scratch (unchanged pages are still served from the cache)
+    os.remove(args.checkpoint)
+
+    # compile the dictionary into the memory-mapped format loaded by the annotation scripts
+    build_compiled_dictionary('data/drug_dictionary.p', drug_dictionary)
+
+    # build the phonetic index of the dictionary used for mapping survey answers, saved next to the pickle (and keyed
+    # by the dictionary hash stored in the compiled file)
+    build_phonetic_index('data/drug_dictionary.p', drug_dictionary)
\ No newline at end of file
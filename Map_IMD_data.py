@@ -3,32 +3,37 @@ import numpy as np
 import argparse
 import re
 from bs4 import BeautifulSoup as bs
-from urllib.request import Request, urlopen
-from sys import exit
-
-# function for getting the IMD decile from a rank
-def get_decile(rank, deciles):
-    if rank:
-        decile = np.count_nonzero(deciles < int(rank))
-        return int(decile)
-    else:
-        return None
+
+from utils.http_cache import Fetcher
+from utils.postcode_ranks import PostcodeRankCache, read_NI_rank_table, get_offline_postcode_ranks
+from utils.postcode_store import load_postcode_store
+from utils.imd_lookup import load_imd_lookup
+
+# function for getting the IMD deciles of a series of ranks, i.e. the number of decile boundaries below each rank
+# (with NaN for missing ranks)
+def get_deciles(ranks, deciles):
+    ranks = pd.to_numeric(ranks)
+    decile_values = np.searchsorted(deciles, ranks.fillna(0), side = 'left')
+    return pd.Series(decile_values, index = ranks.index).where(ranks.notna())
 
 # mapping northern ireland postcodes to IMDs - have to pull from the web
-def get_html(url):
-    req = Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-    webpage = urlopen(req).read()
+# function for getting the html of a lookup tool page with a fetcher
+def get_html(url, fetcher):
+    webpage = fetcher.fetch(url)
     html = bs(webpage, 'html.parser')
     return html
 
 # url for the northern irish IMD postcode lookup tool
 base_url = 'https://deprivation.nisra.gov.uk/MDM/Details?Id='
 
-# function for getting the postcode rank of a northern-irish postcode
-def get_postcode_rank(postcode):
+# decile boundaries of the 890 northern irish IMD ranks
+NI_imd_deciles = np.array([np.percentile(np.linspace(0, 890, 890), i) for i in range(0, 100, 10)])
+
+# function for getting the postcode rank of a northern-irish postcode from the lookup tool at a url
+def get_postcode_rank(postcode, base_url, fetcher):
     postcode_for_url = postcode.replace(' ', '+')
     url = base_url + postcode_for_url
-    html = get_html(url)
+    html = get_html(url, fetcher)
     try:
         rank_text = html.find('h3').find('strong').text
         rank_search = re.search('- rank (\d+) out of 890', rank_text)
@@ -36,11 +41,49 @@ def get_postcode_rank(postcode):
             imd_rank = rank_search.group(1)
         else:
             imd_rank = None
-    except:
+    # pages without a rank heading (e.g. for postcodes the tool does not recognise)
+    except AttributeError:
         imd_rank = None
     return imd_rank
 
-if __name__ == '__main__':
+# function for getting the ranks of northern-irish postcodes, only pulling the postcodes missing from the cache
+def get_postcode_ranks(postcodes, cache, base_url, fetcher, batch_size = 50):
+    '''
+    Pulled ranks are added to the cache in batches of batch_size as they arrive, so the ranks pulled before an
+    interruption are not requested again on the next run.
+    '''
+
+    postcode_ranks = cache.get(postcodes)
+    missing_postcodes = list(dict.fromkeys(postcode for postcode in postcodes if postcode not in postcode_ranks))
+
+    # get the rank of a postcode, returning False if the request failed (after retries)
+    def try_get_postcode_rank(postcode):
+        try:
+            return get_postcode_rank(postcode, base_url, fetcher)
+        except OSError:
+            return False
+
+    # failed requests are not cached, and are saved without a rank
+    n_failed = 0
+    pulled_ranks = {}
+    for postcode, rank in fetcher.map_as_completed(try_get_postcode_rank, missing_postcodes):
+        if rank is False:
+            n_failed += 1
+            postcode_ranks[postcode] = None
+        else:
+            postcode_ranks[postcode] = pulled_ranks[postcode] = rank
+        if len(pulled_ranks) >= batch_size:
+            cache.update(pulled_ranks)
+            pulled_ranks = {}
+    cache.update(pulled_ranks)
+
+    if n_failed:
+        print('Failed to get the IMD rank of {} postcodes, they will be requested again on the next run'.format(n_failed))
+
+    return {postcode: postcode_ranks[postcode] for postcode in postcodes}
+
+# function for getting the parser of the command line arguments
+def get_parser():
 
     # file path argument
     parser = argparse.ArgumentParser()
@@ -48,56 +91,115 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--postcode_column', type=str, default='pcode', help='Name of the column containing postcodes in the answer CSV file')
     parser.add_argument('-g', '--generate_files_only', action='store_true',
                         help='Only generate postcode files for use with the england IMD web API')
-    args = parser.parse_args()
+    parser.add_argument('-c', '--correct_postcodes', action='store_true',
+                        help='Correct postcodes that do not match the postcode data set if they are one typo away from a single postcode')
+    parser.add_argument('--nisra_url', type=str, default=base_url,
+                        help='Url of the northern irish IMD postcode lookup tool, up to the postcode')
+    parser.add_argument('--workers', type=int, default=4, help='Number of northern irish postcodes looked up at the same time')
+    parser.add_argument('--rate', type=float, default=2,
+                        help='Maximum number of requests per second to the northern irish lookup tool, 0 for no limit')
+    parser.add_argument('--rank_cache', type=str, default='data/NI_postcode_rank_cache.db',
+                        help='Path to the sqlite cache of northern irish postcode ranks')
+    parser.add_argument('--NI_postcode_lookup', type=str, default=None,
+                        help='Path to a local CSV of northern irish postcodes and their super output areas (Postcode and SOA2001 columns)')
+    parser.add_argument('--NI_SOA_ranks', type=str, default=None,
+                        help='Path to a local CSV of NIMDM ranks of super output areas (SOA2001 and MDM_rank columns)')
+    return parser
+
+# function for cleaning survey postcodes before they are mapped, removing trailing whitespace and punctuation
+def clean_survey_postcodes(postcodes):
+    return postcodes.str.strip().str.replace('[^\w\s]', '')
+
+# function for mapping survey postcodes to entries of the postcode store, returning an array of entry positions (-1 for
+# postcodes that could not be mapped), the candidate postcodes of postcodes with several possible corrections (indexed
+# like the survey postcodes) and the number of corrected postcodes
+def get_postcode_entries(postcodes, postcode_store, correct_postcodes = False):
+
+    # map survey postcodes to the postcode data set - postcodes that do not match exactly are mapped if there is a
+    # single possibility for the space-removed postcode
+    postcode_entries = postcode_store.resolve(postcodes)
+    ambiguous_candidates = pd.Series([], dtype = object)
+    n_corrected = 0
+
+    # correct postcodes that could not be mapped (e.g. with a mistyped character), if requested
+    if correct_postcodes:
+        unmapped_pcode_idx = np.flatnonzero((postcode_entries < 0) & postcodes.notna().to_numpy())
+        corrected_entries, candidate_entries = postcode_store.correct(postcodes.iloc[unmapped_pcode_idx])
+        postcode_entries[unmapped_pcode_idx] = corrected_entries
+        n_corrected = np.count_nonzero(corrected_entries >= 0)
+
+        # the postcodes with several possible corrections, along with the candidates, for manual review
+        ambiguous = [i for i, candidates in enumerate(candidate_entries) if len(candidates) > 1]
+        ambiguous_candidates = pd.Series(['; '.join(postcode_store.get_postcodes(candidate_entries[i])) for i in ambiguous],
+                                         index = postcodes.index[unmapped_pcode_idx[ambiguous]], dtype = object)
+
+    return postcode_entries, ambiguous_candidates, n_corrected
+
+# function for replacing the survey postcodes that were mapped with their postcode in the postcode data set, returning
+# the distinct mapped postcodes and their countries as a data frame with Postcode and Country columns
+def get_mapped_postcodes(survey_postcodes, postcode_column, postcode_entries, postcode_store):
+
+    mappable_pcode_mask = postcode_entries >= 0
+    survey_postcodes.loc[mappable_pcode_mask, postcode_column] = postcode_store.get_postcodes(postcode_entries[mappable_pcode_mask])
+
+    # mapped postcodes and their countries
+    mapped_entries = np.unique(postcode_entries[mappable_pcode_mask])
+    return pd.DataFrame({'Postcode': postcode_store.get_postcodes(mapped_entries),
+                         'Country': postcode_store.get_countries(mapped_entries)})
+
+# function for joining survey postcodes (replaced by the mapped postcodes) to their IMD ranks and deciles, taken from
+# the IMD lookup or, for northern irish postcodes, from a dictionary of postcodes mapped to ranks
+def join_imd_data(survey_postcodes, postcode_column, survey_postcodes_mapped, imd_lookup, NI_postcode_imd_ranks):
+
+    postcode_imds = imd_lookup.get_imds(survey_postcodes_mapped['Postcode'])
+    NI_postcodes = survey_postcodes_mapped.loc[survey_postcodes_mapped['Country'] == 'Northern Ireland', 'Postcode']
+
+    # put into data frame
+    NI_postcode_imds = pd.DataFrame({'Postcode': NI_postcodes.to_numpy(),
+                                     'IMD rank': [NI_postcode_imd_ranks[postcode] for postcode in NI_postcodes]},
+                                    columns = ['Postcode', 'IMD rank'])
+
+    # get deciles for each IMD rank
+    NI_postcode_imds['IMD decile'] = get_deciles(NI_postcode_imds['IMD rank'], NI_imd_deciles)
+
+    # northern irish postcodes are not in the spreadsheet, so their IMDs are taken from the northern irish ranks
+    postcode_imds.loc[NI_postcodes.index, 'IMD rank'] = pd.to_numeric(NI_postcode_imds['IMD rank']).astype('Int64').to_numpy()
+    postcode_imds.loc[NI_postcodes.index, 'IMD decile'] = NI_postcode_imds['IMD decile'].to_numpy()
+
+    # merge all countries imd data into a single data frame
+    survey_imd_data = survey_postcodes.merge(postcode_imds, how = 'left', left_on = postcode_column, right_on = 'Postcode')
+
+    # remove extra column
+    survey_imd_data.drop('Postcode', axis = 1, inplace = True)
+    return survey_imd_data
+
+# function for mapping the postcodes in a survey answer file to IMD ranks and deciles, saved as a CSV file
+def map_imd_data(args):
 
     # get the filename prefix from the filepath, for output file
     filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
 
-    # import postcode data set
-    postcode_data = pd.read_csv('data/postcode_data.csv', usecols = ['Postcode', 'In Use?', 'Country'])
-    postcodes = postcode_data['Postcode']
+    # load the compiled postcode data set, compiling it on the first run
+    postcode_store = load_postcode_store('data/postcode_data.csv')
 
     # import postcodes from COVIDENCE survey
     survey_postcodes = pd.read_csv(args.filepath)
-    # remove trailing whitespaces
-    survey_postcodes[args.postcode_column] = survey_postcodes[args.postcode_column].str.strip()
-    # remove punctuation from the postcodes
-    survey_postcodes[args.postcode_column] = survey_postcodes[args.postcode_column].str.replace('[^\w\s]', '')
-
-    # dictionary for storing postcodes without spaces
-    postcodes_space_removed = {}
-    for postcode in postcodes:
-        # remove spaces from the postcode
-        postcode_joined = postcode.replace(' ', '')
-        # if the postcode without spaces is not in the dictionary, add it
-        if postcode_joined not in postcodes_space_removed:
-            postcodes_space_removed[postcode_joined] = [postcode]
-        # otherwise append it
-        else:
-            postcodes_space_removed[postcode_joined].append(postcode)
-
-    # isolate survey postcodes that do not map to the postcode data set
-    unmapped_postcodes = survey_postcodes.loc[~survey_postcodes[args.postcode_column].isin(postcodes), args.postcode_column]
-    # remove spaces
-    unmapped_postcodes_space_removed = unmapped_postcodes.str.replace(' ', '')
-
-    # go through unmapped postcodes and map to the postcode dictionary
-    postcode_mappings = {}
-    for postcode in unmapped_postcodes_space_removed:
-        if postcodes_space_removed.get(postcode):
-            # only map if there is a single possibility for the space-removed postcode
-            if len(postcodes_space_removed[postcode]) == 1:
-                postcode_mappings[postcode] = postcodes_space_removed[postcode][0]
-
-    # indices and masks for postcodes mappable with the dictionary
-    mappable_pcode_mask = unmapped_postcodes_space_removed.apply(lambda postcode: postcode in postcode_mappings)
-    mappable_pcode_idx = mappable_pcode_mask.index[mappable_pcode_mask].values
-    unmappable_pcode_idx = mappable_pcode_mask.index[~mappable_pcode_mask].values
-
-    # map the postcodes using the mapping dictionary
-    mapped_postcodes = unmapped_postcodes_space_removed[mappable_pcode_mask].apply(lambda pcode: postcode_mappings[pcode])
-    survey_postcodes.loc[mappable_pcode_idx, args.postcode_column] = mapped_postcodes
-    survey_postcodes_mapped = postcode_data[postcode_data['Postcode'].isin(survey_postcodes[args.postcode_column])]
+    survey_postcodes[args.postcode_column] = clean_survey_postcodes(survey_postcodes[args.postcode_column])
+
+    # map survey postcodes to the postcode data set, correcting those that could not be mapped if requested
+    postcode_entries, ambiguous_candidates, n_corrected = get_postcode_entries(survey_postcodes[args.postcode_column],
+                                                                               postcode_store, args.correct_postcodes)
+
+    # save the postcodes with several possible corrections, along with the candidates, for manual review
+    if args.correct_postcodes:
+        ambiguous_postcodes = survey_postcodes.loc[ambiguous_candidates.index].copy()
+        ambiguous_postcodes['candidates'] = ambiguous_candidates
+        ambiguous_postcodes.to_csv('{}_ambiguous_postcodes.csv'.format(filename), index = False)
+        print('{} postcodes corrected, {} with several possible corrections saved to {}_ambiguous_postcodes.csv'.format(
+            n_corrected, len(ambiguous_postcodes), filename))
+
+    # mapped postcodes and their countries
+    survey_postcodes_mapped = get_mapped_postcodes(survey_postcodes, args.postcode_column, postcode_entries, postcode_store)
     england_postcodes = survey_postcodes_mapped.loc[survey_postcodes_mapped['Country'] == 'England', 'Postcode']
     scotland_postcodes = survey_postcodes_mapped.loc[survey_postcodes_mapped['Country'] == 'Scotland', 'Postcode']
     wales_postcodes = survey_postcodes_mapped.loc[survey_postcodes_mapped['Country'] == 'Wales', 'Postcode']
@@ -112,66 +214,37 @@ if __name__ == '__main__':
         df.to_csv(f'data/england_postcodes_{int((i/10000)+1)}.csv', header = False, index = False)
 
     if args.generate_files_only:
-        exit('Postcode files generated.')
-
-    # load in the data generated from the English IMD web api
-    england_imd_data = pd.read_excel('data/UK_postcode_IMDs.xlsx', sheet_name = 'english_postcode_IMDs')
-
-    # function for standardising IMD column names
-    def rename_imd_cols(df, imd_rank_col, imd_decile_col):
-        renamed = df.rename({imd_rank_col: 'IMD rank', imd_decile_col: 'IMD decile'}, axis = 1)
-        return renamed
-
-    # filter for IMD columns
-    england_imd_columns = ['Index of Multiple Deprivation Rank', 'Index of Multiple Deprivation Decile']
-    english_postcode_imds = england_imd_data[['Postcode'] + england_imd_columns]
-    english_postcode_imds = rename_imd_cols(english_postcode_imds, *england_imd_columns)
-
-    # load in scotland IMD data and change column names
-    scotland_imd_data = pd.read_excel('data/UK_postcode_IMDs.xlsx', sheet_name = 'scottish_postcode_IMDs')
-    scotland_imd_columns = ['SIMD2020v2_Rank', 'SIMD2020v2_Decile']
-    scottish_postcode_imds = scotland_imd_data.loc[scotland_imd_data['Postcode'].isin(scotland_postcodes), ['Postcode'] + scotland_imd_columns]
-    scottish_postcode_imds = rename_imd_cols(scottish_postcode_imds, *scotland_imd_columns)
-
-    # load in wales IMD data and change column names
-    wales_imd_data = pd.read_excel('data/UK_postcode_IMDs.xlsx', sheet_name = 'welsh_postcode_IMDs')
-    wales_imd_columns = ['WIMD 2019 LSOA Rank', 'WIMD 2019 Overall Decile']
-    welsh_postcode_imds = wales_imd_data.loc[wales_imd_data['Welsh Postcode '].isin(wales_postcodes.str.replace(' ', '')), ['Welsh Postcode '] + wales_imd_columns]
-    welsh_postcode_imds = rename_imd_cols(welsh_postcode_imds, *wales_imd_columns)
-    welsh_postcode_imds.rename({'Welsh Postcode ': 'Postcode'}, axis = 1, inplace = True)
-    welsh_postcode_imds.set_index('Postcode', inplace = True)
-
-    # new df for joining postcodes without spacing to postcodes with spaces
-    wales_postcode_df = pd.DataFrame(wales_postcodes)
-    # set index to be postcode values without spaces
-    wales_postcodes_no_spaces = wales_postcodes.str.replace(' ', '')
-    wales_postcode_df.set_index(wales_postcodes_no_spaces.values, inplace = True)
-    # join on the left index
-    wales_postcode_df = wales_postcode_df.merge(welsh_postcode_imds, how = 'left', left_index = True, right_on = 'Postcode')
-    # reset index
-    welsh_postcode_imds = wales_postcode_df.reset_index(drop = True)
-
-    # loop through northern irish postcodes and get IMD ranks using the get_postcode_rank() function
-    NI_postcode_imd_ranks = {postcode: get_postcode_rank(postcode) for postcode in NI_postcodes}
+        print('Postcode files generated.')
+        return
+
+    # load the compiled IMD ranks and deciles of english, scottish and welsh postcodes (including the english postcode
+    # IMDs generated from the web api), compiling them from the spreadsheet on the first run or when it changes
+    imd_lookup = load_imd_lookup('data/UK_postcode_IMDs.xlsx')
+
+    # get IMD ranks of the northern irish postcodes, from the local tables if given
+    if args.NI_postcode_lookup is not None:
+        NI_rank_table = read_NI_rank_table(args.NI_postcode_lookup, args.NI_SOA_ranks)
+        NI_postcode_imd_ranks = get_offline_postcode_ranks(NI_postcodes, NI_rank_table)
+    # otherwise from the cache or using the get_postcode_rank() function
+    else:
+        fetcher = Fetcher(max_workers = args.workers, requests_per_second = args.rate)
+        rank_cache = PostcodeRankCache(args.rank_cache, args.nisra_url)
+        NI_postcode_imd_ranks = get_postcode_ranks(NI_postcodes, rank_cache, args.nisra_url, fetcher)
+        rank_cache.close()
 
-    # put into data frame
-    NI_postcode_imds = pd.DataFrame([(k, v) for k, v in NI_postcode_imd_ranks.items()], columns = ['Postcode', 'IMD rank'])
+    survey_imd_data = join_imd_data(survey_postcodes, args.postcode_column, survey_postcodes_mapped, imd_lookup,
+                                    NI_postcode_imd_ranks)
 
-    # get deciles for each IMD rank
-    NI_imd_deciles = np.array([np.percentile(np.linspace(0, 890, 890), i) for i in range(0, 100, 10)])
-    NI_postcode_imds['IMD decile'] = NI_postcode_imds['IMD rank'].apply(
-        lambda rank: get_decile(rank, NI_imd_deciles) if not pd.isnull(rank) else np.nan)
+    # save as csv
+    survey_imd_data.to_csv('{}_IMD.csv'.format(filename), index = False)
 
-    # concatenate all the imd data
-    imd_data_concatenated = pd.concat([english_postcode_imds, scottish_postcode_imds, welsh_postcode_imds, NI_postcode_imds])
+if __name__ == '__main__':
 
-    # merge all countries imd data into a single data frame
-    survey_imd_data = survey_postcodes.merge(imd_data_concatenated, how = 'left', left_on = args.postcode_column, right_on = 'Postcode')
-    # standardise NA values
-    survey_imd_data.loc[survey_imd_data['IMD rank'].isna(), 'IMD rank'] = np.nan
-    survey_imd_data.loc[survey_imd_data['IMD decile'].isna(), 'IMD decile'] = np.nan
+    parser = get_parser()
+    args = parser.parse_args()
 
-    # remove extra column
-    survey_imd_data.drop('Postcode', axis = 1, inplace = True)
-    # save as csv
-    survey_imd_data.to_csv('{}_IMD.csv'.format(filename), index = False)
\ No newline at end of file
+    # northern irish postcodes are resolved offline if both local tables are given
+    if (args.NI_postcode_lookup is None) != (args.NI_SOA_ranks is None):
+        parser.error('--NI_postcode_lookup and --NI_SOA_ranks must be given together')
+
+    map_imd_data(args)
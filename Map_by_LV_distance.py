@@ -1,27 +1,55 @@
-from abydos.distance import Levenshtein
 import numpy as np
 import pandas as pd
-import pickle
 import argparse
+from multiprocessing import Pool
+
+# index of drug dictionary aliases, set once in each process by init_worker()
+lv_index = None
+
+# function for sharing the alias index with a worker process
+def init_worker(index):
+    global lv_index
+    lv_index = index
+
+# function for getting the drug dictionary aliases closest to an unmapped answer, within the maximum distance of the index
+def get_closest_aliases(answer):
+
+    # only check for answers greater than 3 letters, and do not map answers that are longer than one word
+    if len(answer) <= 3 or len(answer.split(' ')) > 1:
+        return []
+
+    # get all drugs within the maximum distance, and keep those closest to the answer
+    distances = dict(lv_index.search(answer))
+    closest_distance = min(distances.values(), default = None)
+    return [alias for alias, distance in distances.items() if distance == closest_distance]
 
 if __name__ == '__main__':
 
     # command line input for answer file
     parser = argparse.ArgumentParser()
     parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
-    parser.add_argument('-q', '--questions', default=['q1421', 'q1431', 'q1432'], nargs=3, type=str,
-                        help='Column names for medication, dosage, and unit questions')
+    parser.add_argument('-q', '--questions', default=['q1421', 'q1431', 'q1432', 'q1442'], nargs=4, type=str,
+                        help='Column names for medication, dosage, unit, and route of administration questions')
+    parser.add_argument('-d', '--max_distance', default=1, type=int,
+                        help='Maximum edit distance between an unmapped answer and a drug dictionary alias')
+    parser.add_argument('-w', '--workers', default=1, type=int,
+                        help='Number of processes to split the unmapped answers across')
+    parser.add_argument('--chunksize', default=None, type=int,
+                        help='Number of survey rows to read at a time, to limit memory use for large survey files')
     args = parser.parse_args()
 
     # import unmapped answers
     from utils.answer_mapping import AnswerMapper
+    from utils.edit_distance_index import DeletionIndex
+    from utils.resources import get_drug_dictionary, DRUG_DICTIONARY_FILEPATH
 
     # load in drug dictionary
-    drug_dictionary = pickle.load(open('data/drug_dictionary.p', 'rb'))
+    drug_dictionary = get_drug_dictionary()
 
     # create instance of answer mapper class with the right survey file path
     mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q=args.questions[0],
-                          dosage_q=args.questions[1], units_q=args.questions[2])
+                          dosage_q=args.questions[1], units_q=args.questions[2], RoAs_q=args.questions[3],
+                          drug_dict_filepath=DRUG_DICTIONARY_FILEPATH, chunksize=args.chunksize)
 
     # call map answers
     mapper.map_answers()
@@ -29,39 +57,35 @@ if __name__ == '__main__':
     # set drug dictionary as the updated drug dictionary
     drug_dictionary = mapper.drug_dictionary
 
-    # getting all drugs in the drug dictionary that are levenshtein distance of 1 from each unmapped answer
-    lv = Levenshtein(mode = 'osa')
+    # index of all drugs in the drug dictionary, for getting those within a small levenshtein distance of each unmapped answer
+    index = DeletionIndex(drug_dictionary, max_distance = args.max_distance)
+
+    # sort the unmapped answers so the output is the same for any number of workers
+    unmapped_answers = sorted(set(mapper.unmapped_by_encoding))
+
+    # get the closest aliases for each answer, either in this process or split across a pool of processes
+    # the index is passed to each worker once when it starts, rather than with every answer
+    if args.workers > 1:
+        pool = Pool(args.workers, initializer = init_worker, initargs = (index,))
+        chunksize = max(1, len(unmapped_answers) // (args.workers * 16))
+        closest_aliases = pool.imap(get_closest_aliases, unmapped_answers, chunksize = chunksize)
+    else:
+        pool = None
+        init_worker(index)
+        closest_aliases = map(get_closest_aliases, unmapped_answers)
+
     mapped_by_lv_distance = {}
     unmapped_by_lv_distance = []
 
     # loop through unmapped answers
-    for i, answer in enumerate(set(mapper.unmapped_by_encoding)):
-
-        # only check for answers greater than 3 letters
-        if len(answer) > 3:
-
-            # do not map answers that are longer than one word
-            if len(answer.split(' ')) > 1:
-                unmapped_by_lv_distance.append(answer)
-                continue
-
-            # narrow down potential matches as those of similar length (plus or minus 3 characters) to speed up computation
-            longest_len = len(answer)+1
-            shortest_len = len(answer)-1
-            potential_matches = (alias for alias in drug_dictionary if len(alias) >= shortest_len and len(alias) <= longest_len)
-            # get distance with all potential matches
-            distances = {alias: lv.dist_abs(answer, alias) for alias in potential_matches}
-            # get matches that are a distance of 1 away
-            matches = [alias for alias, distance in distances.items() if distance == 1]
-
-            # if there are multiple matches that are a distance of 1 away, take the one that appears at the highest frequency
-            if matches:
-                best_match = max(matches, key = lambda alias: np.mean([mapper.drug_frequencies[db_id] for db_id in drug_dictionary[alias]]))
-                mapped_by_lv_distance[answer] = best_match
-
-            # if there are no matches 1 character away, save to the list
-            else:
-                unmapped_by_lv_distance.append(answer)
+    for i, (answer, matches) in enumerate(zip(unmapped_answers, closest_aliases)):
+
+        # if there are multiple closest matches, take the one that appears at the highest frequency
+        if matches:
+            best_match = max(matches, key = lambda alias: np.mean([mapper.drug_frequencies[db_id] for db_id in drug_dictionary[alias]]))
+            mapped_by_lv_distance[answer] = best_match
+
+        # if there are no matches within the maximum distance, save to the list
         else:
             unmapped_by_lv_distance.append(answer)
 
@@ -69,8 +93,12 @@ if __name__ == '__main__':
         if i % 100 == 0:
             print('Answer number {} completed'.format(i))
 
+    if pool is not None:
+        pool.close()
+        pool.join()
+
     # dump data frame of unmapped answers for manual annotation
     mapped_answer_df = pd.DataFrame([(answer, mapping) for answer, mapping in mapped_by_lv_distance.items()], columns = ['answer', 'correction'])
     unmapped_answer_df = pd.DataFrame([(answer, 0) for answer in unmapped_by_lv_distance], columns = ['answer', 'correction'])
     full_mapping_df = pd.concat([mapped_answer_df, unmapped_answer_df])
-    full_mapping_df.to_csv('data/answer_mappings.csv', index = False)
\ No newline at end of file
+    full_mapping_df.to_csv('data/answer_mappings.csv', index = False)
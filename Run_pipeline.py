@@ -0,0 +1,93 @@
+import warnings
+import re
+import argparse
+
+# import class for mapping survey answers
+from utils.answer_mapping import AnswerMapper
+from utils.mapping_cache import MappingCache
+from utils.pipeline_cache import MappedAnswers, PipelineCache, get_mapping_key
+from utils.resources import get_drug_dictionary, DRUG_DICTIONARY_FILEPATH
+
+# import the annotation steps of the individual scripts
+from Annotate_patients import get_patient_features
+from Annotate_patient_dosages import get_patient_dose_features
+import Map_IMD_data
+
+# file of manual corrections to answer mappings
+MANUAL_CORRECTIONS_FILEPATH = 'data/answer_mappings_complete.csv'
+
+# function for importing, cleaning and mapping the survey answers and applying the manual corrections
+def map_survey_answers(args):
+
+    # import the drug dictionary
+    drug_dictionary = get_drug_dictionary()
+
+    # create instance of answer mapper class with the survey file path
+    mapper = AnswerMapper(survey_filepath=args.filepath, drug_dict=drug_dictionary, meds_q = args.questions[0],
+                          dosage_q = args.questions[1], units_q = args.questions[2], RoAs_q = args.questions[3],
+                          drug_dict_filepath = DRUG_DICTIONARY_FILEPATH, id_column = args.patient_id,
+                          chunksize = args.chunksize)
+
+    # generate answer mappings
+    cache = None if args.no_cache else MappingCache(args.cache, drug_dictionary_filepath=DRUG_DICTIONARY_FILEPATH,
+                                                    manual_corrections_filepath=MANUAL_CORRECTIONS_FILEPATH)
+    mapper.map_answers(cache = cache)
+
+    # update drug dictionary with manual corrections file
+    mapper.update_drug_dictionary(manual_corrections_filepath=MANUAL_CORRECTIONS_FILEPATH)
+
+    return MappedAnswers.from_mapper(mapper)
+
+if __name__ == '__main__':
+
+    warnings.simplefilter('ignore')
+
+    parser = argparse.ArgumentParser(description = 'Run the medication annotation scripts (and optionally the IMD mapping) '
+                                                   'on a survey, mapping the answers only once')
+    parser.add_argument('filepath', type=str, help='Path to the medication survey answers file')
+    parser.add_argument('-q', '--questions', default = ['q1421', 'q1431', 'q1432', 'q1442'], nargs = 4, type = str,
+                        help = 'Column names for medication, dosage, unit, and route of administration questions')
+    parser.add_argument('-id', '--patient_id', default='uid', type=str, help='Column name for unique patient identifiers')
+    parser.add_argument('--chunksize', default=None, type=int,
+                        help='Number of survey rows to read at a time, to limit memory use for large survey files')
+    parser.add_argument('-c', '--cache', default='data/answer_mapping_cache.db', type=str,
+                        help='Path to the cache of answer mappings from previous runs')
+    parser.add_argument('--pipeline_cache', default='data/pipeline_cache', type=str,
+                        help='Directory for the mapped survey answers of the last run, reused while the survey, drug '
+                             'dictionary and manual corrections are unchanged')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Map all answers without reading or writing the answer mapping and pipeline caches')
+    parser.add_argument('--postcodes', default=None, type=str,
+                        help='Path to the postcodes survey answers file, to also map postcodes to IMD data')
+    parser.add_argument('-p', '--postcode_column', type=str, default='pcode',
+                        help='Name of the column containing postcodes in the postcode answer CSV file')
+    args = parser.parse_args()
+
+    # get the filename prefix from the filepath, for output files
+    filename = re.search('.+(?=_.*\.csv$)', args.filepath).group(0)
+
+    # get the mapped answers, from the pipeline cache if the inputs of the mapping have not changed since the last run
+    mapping_key = get_mapping_key(args.filepath, DRUG_DICTIONARY_FILEPATH, MANUAL_CORRECTIONS_FILEPATH,
+                                  [*args.questions, args.patient_id])
+    pipeline_cache = None if args.no_cache else PipelineCache(args.pipeline_cache)
+    mapped = pipeline_cache.get(mapping_key, get_drug_dictionary()) if pipeline_cache is not None else None
+    if mapped is None:
+        mapped = map_survey_answers(args)
+        if pipeline_cache is not None:
+            pipeline_cache.set(mapping_key, mapped)
+    else:
+        print('Survey answers unchanged since the last run, using the cached answer mappings')
+
+    # save the drug class features
+    patient_feature_df = get_patient_features(mapped.survey_data, mapped.meds_cleaned, mapped.RoAs, mapped.drug_dictionary,
+                                              args.patient_id)
+    patient_feature_df.to_csv('{}_Drug_Classes.csv'.format(filename), index = False)
+
+    # save the dosage features
+    patient_dose_feature_df, _ = get_patient_dose_features(mapped.survey_data, mapped.meds_cleaned, mapped.dosages,
+                                                           mapped.units, mapped.RoAs, mapped.drug_dictionary, args.patient_id)
+    patient_dose_feature_df.to_csv('{}_Drug_Dosages.csv'.format(filename), index = False)
+
+    # map the postcodes to IMD data, with the default settings of Map_IMD_data.py
+    if args.postcodes is not None:
+        Map_IMD_data.map_imd_data(Map_IMD_data.get_parser().parse_args([args.postcodes, '-p', args.postcode_column]))
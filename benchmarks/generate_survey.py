@@ -0,0 +1,198 @@
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+from utils.resources import get_drug_dictionary, get_bnf_classes
+
+# number of medication slots in the survey, each with a medication, dosage, unit and route of administration question
+N_SLOTS = 12
+
+# code for questions that were not applicable to a respondent, used to pad the slots after their medications
+NOT_APPLICABLE = -99
+
+# common strengths (in the dosage question) and unit (1: mg, 2: micrograms, 3: other) and route of administration
+# (1: oral, 2: inhaled, 3: other) answers, with the probabilities they are drawn with
+DOSES = ([0.5, 1, 2.5, 5, 10, 20, 25, 40, 50, 75, 100, 200, 250, 400, 500, 1000, NOT_APPLICABLE, np.nan],
+         [0.02, 0.04, 0.04, 0.1, 0.1, 0.1, 0.05, 0.06, 0.06, 0.05, 0.05, 0.03, 0.02, 0.02, 0.06, 0.02, 0.12, 0.06])
+UNITS = ([1, 2, 3, NOT_APPLICABLE, np.nan], [0.55, 0.1, 0.15, 0.1, 0.1])
+ROAS = ([1, 2, 3, NOT_APPLICABLE, np.nan], [0.6, 0.1, 0.1, 0.15, 0.05])
+
+# words respondents add to medication answers, which clean_meds() removes
+STRENGTHS = ['{:g}mg', '{:g} mg', '{:g}mcg', '({:g}mg)', '{:g}']
+FORMULATIONS = ['tablets', 'tablet', 'capsules', 'inhaler', 'cream', 'spray', 'drops', 'injection']
+FREQUENCIES = ['once daily', 'twice a day', '2x daily', 'weekly', 'three times a day']
+
+# answers that are not medications
+OTHER_ANSWERS = ['none', 'vitamins', "don't know", 'multivitamin', 'hrt', 'statins', 'inhalers', 'eye drops',
+                 'vitamin d3', 'cod liver oil', 'iron tablets', 'prescribed medication']
+
+# characters used for typos
+TYPO_CHARACTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+# function for adding a typo (a deleted, inserted, substituted or transposed character) to an answer
+def add_typo(answer, rng):
+    if len(answer) < 4:
+        return answer
+    i = rng.integers(1, len(answer) - 1)
+    typo = rng.integers(4)
+    if typo == 0:
+        return answer[:i] + answer[i+1:]
+    elif typo == 1:
+        return answer[:i] + rng.choice(list(TYPO_CHARACTERS)) + answer[i:]
+    elif typo == 2:
+        return answer[:i] + rng.choice(list(TYPO_CHARACTERS)) + answer[i+1:]
+    else:
+        return answer[:i] + answer[i+1] + answer[i] + answer[i+2:]
+
+# function for writing a medication as a respondent might, with typos, strengths, formulations and capitalisation
+def format_answer(drug, rng, typo_rate = 0.08):
+    answer = add_typo(drug, rng) if rng.random() < typo_rate else drug
+    if rng.random() < 0.25:
+        answer += ' ' + rng.choice(STRENGTHS).format(rng.choice(DOSES[0][:16]))
+    if rng.random() < 0.1:
+        answer += ' ' + rng.choice(FORMULATIONS)
+    if rng.random() < 0.05:
+        answer += ' ' + rng.choice(FREQUENCIES)
+    case = rng.random()
+    if case < 0.35:
+        answer = answer.capitalize()
+    elif case < 0.4:
+        answer = answer.upper()
+    return answer
+
+# function for getting the medications answers are drawn from - the drugs of the BNF classes found in the drug
+# dictionary (which respondents mostly take), along with a sample of other drug dictionary aliases (e.g. brand names)
+def get_medications(rng, n_other_aliases = 2000):
+    drug_dictionary = get_drug_dictionary()
+    bnf_drugs = get_bnf_classes()['drugs'].explode().dropna().unique()
+    bnf_drugs = [drug for drug in bnf_drugs if drug in drug_dictionary]
+    aliases = [alias for alias in drug_dictionary if 3 < len(alias) < 30]
+    other_aliases = rng.choice(aliases, size = min(n_other_aliases, len(aliases)), replace = False).tolist()
+    return bnf_drugs, other_aliases
+
+# function for getting the distinct answers of a survey, in decreasing order of frequency
+def get_answer_vocabulary(n_answers, rng, typo_rate = 0.08):
+    '''
+    The most frequent answers are the BNF drugs as written, in a random order. They are followed by the other answers,
+    and then by variants of the BNF drugs and other drug dictionary aliases (with typos, strengths, formulations and
+    capitalisation) which make up the long tail of rare answers.
+    '''
+    bnf_drugs, other_aliases = get_medications(rng)
+    vocabulary = rng.permutation(bnf_drugs).tolist() + OTHER_ANSWERS
+    drugs = bnf_drugs + other_aliases
+    while len(vocabulary) < n_answers:
+        vocabulary.append(format_answer(drugs[rng.integers(len(drugs))], rng, typo_rate))
+    return np.array(vocabulary[:n_answers], dtype = object)
+
+# function for getting a block of survey rows for a number of respondents, with answers drawn from a vocabulary
+# with a zipf-like distribution
+def get_survey_rows(n_respondents, first_uid, vocabulary, rng, mean_meds = 2.5, padding_rate = 0.7):
+
+    answer_probabilities = 1 / np.arange(1, len(vocabulary) + 1) ** 1.1
+    answer_probabilities /= answer_probabilities.sum()
+
+    # respondents answer for their medications in the first slots, and some pad the remaining slots with -99
+    n_meds = np.minimum(rng.poisson(mean_meds, n_respondents), N_SLOTS)
+    padded = rng.random(n_respondents) < padding_rate
+    slots = np.arange(N_SLOTS)
+    med_mask = slots < n_meds[:, None]
+    padding_mask = ~med_mask & padded[:, None]
+
+    shape = (n_respondents, N_SLOTS)
+    meds = vocabulary[rng.choice(len(vocabulary), size = shape, p = answer_probabilities)]
+    meds = np.where(med_mask, meds, np.where(padding_mask, str(NOT_APPLICABLE), None))
+    answers = {}
+    for question, (values, probabilities) in zip(['dose', 'unit', 'roa'], [DOSES, UNITS, ROAS]):
+        question_answers = rng.choice(np.array(values, dtype = float), size = shape, p = probabilities)
+        answers[question] = np.where(med_mask, question_answers, np.where(padding_mask, NOT_APPLICABLE, np.nan))
+
+    # unit and route of administration answers are integer codes, kept as integers (with missing values) so they are
+    # written as e.g. -99 rather than -99.0
+    survey_rows = {'uid': np.arange(first_uid, first_uid + n_respondents)}
+    for slot in range(N_SLOTS):
+        survey_rows['q1421_{}'.format(slot + 1)] = meds[:, slot]
+        survey_rows['q1431_{}_1'.format(slot + 1)] = answers['dose'][:, slot]
+        survey_rows['q1432_{}_1'.format(slot + 1)] = pd.array(answers['unit'][:, slot], dtype = 'Int64')
+        survey_rows['q1442_{}_1'.format(slot + 1)] = pd.array(answers['roa'][:, slot], dtype = 'Int64')
+
+    return pd.DataFrame(survey_rows)
+
+# function for getting random postcodes, in the format of UK postcodes (e.g. AB12 3CD)
+def get_random_postcodes(n_postcodes, rng):
+    letters = np.array(list('ABCDEFGHIJKLMNOPRSTUWYZ'))
+    area = pd.Series(letters[rng.integers(len(letters), size = n_postcodes)])
+    area = area.where(rng.random(n_postcodes) < 0.2, area + letters[rng.integers(len(letters), size = n_postcodes)])
+    district = pd.Series(rng.integers(1, 30, size = n_postcodes)).astype(str)
+    sector = pd.Series(rng.integers(10, size = n_postcodes)).astype(str)
+    unit = pd.Series(letters[rng.integers(len(letters), size = n_postcodes)]) + \
+        letters[rng.integers(len(letters), size = n_postcodes)]
+    return (area + district + ' ' + sector + unit).unique()
+
+# function for getting the postcodes the answers of a survey are drawn from, a tenth as many as the respondents
+def get_postcode_set(n_respondents, seed = 0):
+    return get_random_postcodes(max(n_respondents // 10, 100), np.random.default_rng(seed))
+
+# function for getting the path of the postcode answer file written along with a survey answer file
+def get_postcode_filepath(survey_filepath):
+    return re.sub('_meds\.csv$', '', survey_filepath) + '_postcodes.csv'
+
+# function for getting survey postcode answers drawn from a set of postcodes, written as respondents might
+# (lowercase, without a space or with extra whitespace), with a fraction missing or not in the set
+def get_survey_postcodes(uids, postcodes, rng, unknown_rate = 0.05, missing_rate = 0.02):
+    n_respondents = len(uids)
+    answers = pd.Series(postcodes[rng.integers(len(postcodes), size = n_respondents)])
+    unknown = rng.random(n_respondents) < unknown_rate
+    answers[unknown] = get_random_postcodes(2 * unknown.sum() + 10, rng)[:unknown.sum()]
+    style = rng.random(n_respondents)
+    answers = answers.where(style > 0.1, answers.str.lower())
+    answers = answers.where((style <= 0.1) | (style > 0.15), answers.str.replace(' ', ''))
+    answers = answers.where((style <= 0.15) | (style > 0.18), answers + ' ')
+    answers[rng.random(n_respondents) < missing_rate] = None
+    return pd.DataFrame({'uid': uids, 'pcode': answers})
+
+# function for writing a synthetic survey answer file, along with a postcode answer file if a path is given
+def generate_survey(filepath, n_respondents, seed = 0, postcode_filepath = None, n_answers = None, typo_rate = 0.08,
+                    chunksize = 100000):
+    '''
+    The number of distinct answers grows with the number of respondents (as new respondents bring new spellings),
+    unless it is given. The file is written in blocks of chunksize respondents, so memory use does not grow with the
+    number of respondents.
+    '''
+    rng = np.random.default_rng(seed)
+    if n_answers is None:
+        n_answers = int(np.clip(n_respondents / 4, 2000, 200000))
+    vocabulary = get_answer_vocabulary(n_answers, rng, typo_rate)
+    postcodes = get_postcode_set(n_respondents, seed) if postcode_filepath is not None else None
+
+    for first_row in range(0, n_respondents, chunksize):
+        n_chunk_respondents = min(chunksize, n_respondents - first_row)
+        survey_rows = get_survey_rows(n_chunk_respondents, 1000 + first_row, vocabulary, rng)
+        # doses are written without a trailing .0 for whole numbers (e.g. 500 and -99, but 2.5)
+        survey_rows.to_csv(filepath, index = False, mode = 'w' if first_row == 0 else 'a', header = first_row == 0,
+                           float_format = '%g')
+        if postcode_filepath is not None:
+            survey_postcodes = get_survey_postcodes(survey_rows['uid'].to_numpy(), postcodes, rng)
+            survey_postcodes.to_csv(postcode_filepath, index = False, mode = 'w' if first_row == 0 else 'a',
+                                    header = first_row == 0)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic medication survey answer file')
+    parser.add_argument('n_respondents', type=int, help='Number of survey respondents')
+    parser.add_argument('-o', '--output', default=None, type=str,
+                        help='Path to the output file, by default benchmarks/data/survey_<n_respondents>_meds.csv')
+    parser.add_argument('--postcodes', action='store_true',
+                        help='Also write a postcode answer file, with "_postcodes.csv" in place of "_meds.csv" in the output file name')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the random number generator')
+    parser.add_argument('--n_answers', default=None, type=int, help='Number of distinct medication answers')
+    parser.add_argument('--typo_rate', default=0.08, type=float, help='Fraction of answer variants with a typo')
+    args = parser.parse_args()
+
+    filepath = args.output or 'benchmarks/data/survey_{}_meds.csv'.format(args.n_respondents)
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok = True)
+
+    generate_survey(filepath, args.n_respondents, seed = args.seed,
+                    postcode_filepath = get_postcode_filepath(filepath) if args.postcodes else None,
+                    n_answers = args.n_answers, typo_rate = args.typo_rate)
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from utils.answer_mapping import AnswerMapper
+from utils.edit_distance_index import DeletionIndex
+from utils.imd_lookup import IMDLookup, IMD_SHEETS
+from utils.postcode_store import PostcodeStore
+from utils.postcode_ranks import read_NI_rank_table, get_offline_postcode_ranks
+from utils.resources import get_drug_dictionary, DRUG_DICTIONARY_FILEPATH
+from Annotate_patients import PatientAnnotator, drug_classes
+from Annotate_patient_dosages import DosageScaler
+import Map_by_LV_distance
+from Map_IMD_data import clean_survey_postcodes, get_postcode_entries, get_mapped_postcodes, join_imd_data
+from benchmarks.generate_survey import generate_survey, get_postcode_set, get_postcode_filepath, get_random_postcodes
+
+# stages of the pipeline that are benchmarked, in the order they are reported
+STAGES = ['import_data', 'clean_meds', 'map_answers', 'get_patients_in_class', 'get_class_doses', 'levenshtein', 'imd_join']
+
+# stages that need the survey answers to be imported, cleaned and mapped first
+MEDICATION_STAGES = STAGES[:-1]
+
+# number of postcodes added to the synthetic postcode data set and IMD lookup, on top of those the survey postcodes are
+# drawn from, so they are of a similar size to the real ones
+IMD_LOOKUP_POSTCODES = 1000000
+
+MANUAL_CORRECTIONS_FILEPATH = 'data/answer_mappings_complete.csv'
+
+# answer mapper that only imports and cleans the survey when run_import_data() and run_clean_meds() are called,
+# so that the two steps (which AnswerMapper runs on initialisation) can be measured on their own
+class StagedAnswerMapper(AnswerMapper):
+
+    def import_data(self, *args, **kwargs):
+        self.import_arguments = (args, kwargs)
+
+    def clean_meds(self):
+        pass
+
+    def run_import_data(self):
+        args, kwargs = self.import_arguments
+        super().import_data(*args, **kwargs)
+
+    def run_clean_meds(self):
+        super().clean_meds()
+
+# countries of the postcodes of the synthetic postcode data set, with the probabilities they are drawn with
+POSTCODE_COUNTRIES = (['England', 'Scotland', 'Wales', 'Northern Ireland'], [0.78, 0.12, 0.07, 0.03])
+
+# number of super output areas in the northern irish rank table
+N_NI_SOAS = 890
+
+# function for getting a synthetic postcode data set (with Postcode, In Use? and Country columns) of the postcodes a
+# synthetic survey's postcodes are drawn from, along with other random postcodes
+def get_synthetic_postcode_data(n_respondents, seed = 0, n_other_postcodes = IMD_LOOKUP_POSTCODES):
+    rng = np.random.default_rng(seed + 1)
+    postcodes = pd.unique(np.concatenate([get_postcode_set(n_respondents, seed),
+                                          get_random_postcodes(n_other_postcodes, rng)]))
+    countries = rng.choice(POSTCODE_COUNTRIES[0], size = len(postcodes), p = POSTCODE_COUNTRIES[1])
+    return pd.DataFrame({'Postcode': postcodes, 'In Use?': 'Yes', 'Country': countries})
+
+# function for building an IMD lookup of the english, scottish and welsh postcodes of a synthetic postcode data set
+def build_synthetic_imd_lookup(filepath, postcode_data, seed = 0):
+    rng = np.random.default_rng(seed + 2)
+
+    imd_sheets = {}
+    for sheet_name, (country, postcode_col, imd_rank_col, imd_decile_col) in IMD_SHEETS.items():
+        sheet_postcodes = postcode_data.loc[postcode_data['Country'] == country, 'Postcode'].reset_index(drop = True)
+        # the welsh sheet lists postcodes without a space
+        if country == 'Wales':
+            sheet_postcodes = sheet_postcodes.str.replace(' ', '')
+        sheet_ranks = rng.permutation(len(sheet_postcodes)) + 1
+        imd_sheets[sheet_name] = pd.DataFrame({postcode_col: sheet_postcodes, imd_rank_col: sheet_ranks,
+                                               imd_decile_col: sheet_ranks * 10 // (len(sheet_postcodes) + 1) + 1})
+
+    IMDLookup.compile(imd_sheets, filepath)
+    return IMDLookup(filepath)
+
+# function for writing the local northern irish tables (postcode -> super output area and super output area -> rank)
+# of the northern irish postcodes of a synthetic postcode data set, as read by read_NI_rank_table()
+def write_synthetic_NI_tables(postcode_soa_filepath, soa_rank_filepath, postcode_data, seed = 0):
+    rng = np.random.default_rng(seed + 3)
+    NI_postcodes = postcode_data.loc[postcode_data['Country'] == 'Northern Ireland', 'Postcode']
+    soas = np.array(['95{:06d}'.format(i) for i in range(N_NI_SOAS)])
+    pd.DataFrame({'Postcode': NI_postcodes, 'SOA2001': soas[rng.integers(N_NI_SOAS, size = len(NI_postcodes))]}) \
+        .to_csv(postcode_soa_filepath, index = False)
+    pd.DataFrame({'SOA2001': soas, 'MDM_rank': rng.permutation(N_NI_SOAS) + 1}).to_csv(soa_rank_filepath, index = False)
+
+# function for getting the synthetic postcode store, IMD lookup and northern irish tables of a survey size, as a
+# dictionary, building them in a data directory if they are missing
+def get_synthetic_imd_data(data_dir, n_respondents, seed = 0):
+    filepaths = {name: os.path.join(data_dir, '{}_{}_seed{}.{}'.format(name, n_respondents, seed, extension))
+                 for name, extension in [('postcode_store', 'bin'), ('imd_lookup', 'bin'), ('NI_postcode_lookup', 'csv'),
+                                         ('NI_SOA_ranks', 'csv')]}
+    if not all(os.path.exists(filepath) for filepath in filepaths.values()):
+        postcode_data = get_synthetic_postcode_data(n_respondents, seed)
+        PostcodeStore.compile(postcode_data, filepaths['postcode_store'])
+        build_synthetic_imd_lookup(filepaths['imd_lookup'], postcode_data, seed)
+        write_synthetic_NI_tables(filepaths['NI_postcode_lookup'], filepaths['NI_SOA_ranks'], postcode_data, seed)
+    return {'postcode_store': PostcodeStore(filepaths['postcode_store']), 'imd_lookup': IMDLookup(filepaths['imd_lookup']),
+            'NI_postcode_lookup': filepaths['NI_postcode_lookup'], 'NI_SOA_ranks': filepaths['NI_SOA_ranks']}
+
+# function for running a stage, recording either its run time (in seconds) or the peak memory allocated while it runs
+# (in megabytes) under the stage name in a dictionary of results
+def measure(stage, func, results, profile_memory = False):
+    if profile_memory:
+        tracemalloc.start()
+        func()
+        results[stage] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    else:
+        start = time.perf_counter()
+        func()
+        results[stage] = time.perf_counter() - start
+
+# function for running the benchmarked stages on a survey answer file and a postcode answer file (with the synthetic
+# data returned by get_synthetic_imd_data()), returning a dictionary of the run time or peak memory of each stage
+def run_stages(survey_filepath, postcode_filepath, imd_data, stages = STAGES, profile_memory = False, max_distance = 1,
+               correct_postcodes = False):
+
+    results = {}
+
+    if any(stage in stages for stage in MEDICATION_STAGES):
+
+        mapper = StagedAnswerMapper(survey_filepath=survey_filepath, drug_dict=get_drug_dictionary(), meds_q='q1421',
+                                    dosage_q='q1431', units_q='q1432', RoAs_q='q1442',
+                                    drug_dict_filepath=DRUG_DICTIONARY_FILEPATH)
+        measure('import_data', mapper.run_import_data, results, profile_memory)
+        measure('clean_meds', mapper.run_clean_meds, results, profile_memory)
+        measure('map_answers', mapper.map_answers, results, profile_memory)
+
+        # the levenshtein step of Map_by_LV_distance.py, run on the dictionary before the manual corrections as in the script
+        def map_by_lv_distance():
+            Map_by_LV_distance.init_worker(DeletionIndex(mapper.drug_dictionary, max_distance = max_distance))
+            for answer in sorted(set(mapper.unmapped_by_encoding)):
+                Map_by_LV_distance.get_closest_aliases(answer)
+        if 'levenshtein' in stages:
+            measure('levenshtein', map_by_lv_distance, results, profile_memory)
+
+        mapper.update_drug_dictionary(manual_corrections_filepath=MANUAL_CORRECTIONS_FILEPATH)
+
+        def get_patients_in_class():
+            annotator = PatientAnnotator(meds=mapper.meds_cleaned, RoAs=mapper.RoAs, drug_dict=mapper.drug_dictionary)
+            for drug_class in drug_classes:
+                annotator.get_patients_in_class(drug_class)
+        if 'get_patients_in_class' in stages:
+            measure('get_patients_in_class', get_patients_in_class, results, profile_memory)
+
+        def get_class_doses():
+            scaler = DosageScaler(survey_data=mapper.survey_data, meds=mapper.meds_cleaned, dosages=mapper.dosages,
+                                  units=mapper.units, RoAs=mapper.RoAs, drug_dict=mapper.drug_dictionary)
+            for drug_class in drug_classes:
+                scaler.get_class_doses(drug_class)
+        if 'get_class_doses' in stages:
+            measure('get_class_doses', get_class_doses, results, profile_memory)
+
+    # the mapping of the survey postcodes to the postcode data set (with the corrections, if requested) and their join
+    # to IMD ranks and deciles, with the northern irish ranks read from the local tables, as in Map_IMD_data.py
+    if 'imd_join' in stages:
+        survey_postcodes = pd.read_csv(postcode_filepath)
+        postcode_store = imd_data['postcode_store']
+
+        def map_imd_data():
+            mapped_survey_postcodes = survey_postcodes.copy()
+            mapped_survey_postcodes['pcode'] = clean_survey_postcodes(mapped_survey_postcodes['pcode'])
+            postcode_entries, _, _ = get_postcode_entries(mapped_survey_postcodes['pcode'], postcode_store, correct_postcodes)
+            survey_postcodes_mapped = get_mapped_postcodes(mapped_survey_postcodes, 'pcode', postcode_entries, postcode_store)
+            NI_postcodes = survey_postcodes_mapped.loc[survey_postcodes_mapped['Country'] == 'Northern Ireland', 'Postcode']
+            NI_rank_table = read_NI_rank_table(imd_data['NI_postcode_lookup'], imd_data['NI_SOA_ranks'])
+            NI_postcode_imd_ranks = get_offline_postcode_ranks(NI_postcodes, NI_rank_table)
+            join_imd_data(mapped_survey_postcodes, 'pcode', survey_postcodes_mapped, imd_data['imd_lookup'],
+                          NI_postcode_imd_ranks)
+        measure('imd_join', map_imd_data, results, profile_memory)
+
+    return {stage: results[stage] for stage in STAGES if stage in results and stage in stages}
+
+# function for getting the current commit, and whether the working tree has uncommitted changes
+def get_commit():
+    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True).stdout.strip()
+    changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output = True, text = True).stdout
+    return commit, bool(changes.strip())
+
+# function for getting the path of the results file of a commit (or the path itself, if given the path to a results file)
+def get_results_filepath(results_dir, commit, dirty = False):
+    if os.path.exists(commit):
+        return commit
+    commit = subprocess.run(['git', 'rev-parse', commit], capture_output = True, text = True).stdout.strip() or commit
+    return os.path.join(results_dir, '{}{}.json'.format(commit[:12], '-dirty' if dirty else ''))
+
+# function for printing the results of two runs side by side, with the ratio of the new to the old result
+def compare_results(old_results, new_results):
+    print('{:>10} {:<22} {:>10} {:>10} {:>7} {:>10} {:>10} {:>7}'.format('size', 'stage', 'old s', 'new s', 'ratio',
+                                                                        'old MB', 'new MB', 'ratio'))
+    for size in sorted(set(old_results['results']) & set(new_results['results']), key = int):
+        old_stages, new_stages = old_results['results'][size], new_results['results'][size]
+        for stage in STAGES:
+            if stage in old_stages and stage in new_stages:
+                old, new = old_stages[stage], new_stages[stage]
+                print('{:>10} {:<22} {:>10.3f} {:>10.3f} {:>7.2f} {:>10.1f} {:>10.1f} {:>7.2f}'.format(
+                    size, stage, old['seconds'], new['seconds'], new['seconds'] / old['seconds'],
+                    old['peak_memory_mb'], new['peak_memory_mb'], new['peak_memory_mb'] / max(old['peak_memory_mb'], 1e-6)))
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Time and memory-profile the stages of the pipeline on synthetic surveys')
+    parser.add_argument('-n', '--respondents', default=[1000, 10000], nargs='+', type=int,
+                        help='Numbers of respondents of the synthetic surveys to benchmark')
+    parser.add_argument('-s', '--stages', default=STAGES, nargs='+', choices=STAGES, help='Stages to benchmark')
+    parser.add_argument('-r', '--repeat', default=3, type=int,
+                        help='Number of timed runs of each survey, of which the fastest time of each stage is kept')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic surveys')
+    parser.add_argument('-d', '--data_dir', default='benchmarks/data', type=str,
+                        help='Directory of the synthetic surveys, which are generated if they are missing')
+    parser.add_argument('-o', '--results_dir', default='benchmarks/results', type=str,
+                        help='Directory of the results, saved in a file named after the current commit')
+    parser.add_argument('--correct_postcodes', action='store_true',
+                        help='Correct the survey postcodes that do not match the postcode data set in the IMD join stage')
+    parser.add_argument('-c', '--compare', default=None, nargs='+', type=str,
+                        help='Commit (or results file) to compare the results of this run to - with two commits, '
+                             'their stored results are compared without running the benchmarks')
+    args = parser.parse_args()
+
+    if args.compare is not None and len(args.compare) == 2:
+        with open(get_results_filepath(args.results_dir, args.compare[0])) as file:
+            old_results = json.load(file)
+        with open(get_results_filepath(args.results_dir, args.compare[1])) as file:
+            new_results = json.load(file)
+        compare_results(old_results, new_results)
+        parser.exit()
+
+    os.makedirs(args.data_dir, exist_ok = True)
+    os.makedirs(args.results_dir, exist_ok = True)
+
+    # results are saved by commit, adding to the results of earlier runs of the same commit (e.g. with other sizes)
+    commit, dirty = get_commit()
+    results_filepath = get_results_filepath(args.results_dir, commit, dirty)
+    if os.path.exists(results_filepath):
+        with open(results_filepath) as file:
+            run_results = json.load(file)
+    else:
+        run_results = {'commit': commit, 'dirty': dirty, 'results': {}}
+    run_results.update({'date': datetime.now().isoformat(timespec = 'seconds'), 'python': platform.python_version(),
+                        'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+                        'repeat': args.repeat, 'seed': args.seed, 'correct_postcodes': args.correct_postcodes})
+
+    for n_respondents in args.respondents:
+
+        survey_filepath = os.path.join(args.data_dir, 'survey_{}_seed{}_meds.csv'.format(n_respondents, args.seed))
+        postcode_filepath = get_postcode_filepath(survey_filepath)
+        if not (os.path.exists(survey_filepath) and os.path.exists(postcode_filepath)):
+            print('Generating a survey of {} respondents'.format(n_respondents))
+            generate_survey(survey_filepath, n_respondents, seed = args.seed, postcode_filepath = postcode_filepath)
+
+        imd_data = get_synthetic_imd_data(args.data_dir, n_respondents, args.seed) if 'imd_join' in args.stages else None
+
+        # the fastest of the timed runs, and the peak memory of a separate run (as tracing memory slows the stages down)
+        times = [run_stages(survey_filepath, postcode_filepath, imd_data, args.stages,
+                            correct_postcodes = args.correct_postcodes) for _ in range(args.repeat)]
+        peak_memory = run_stages(survey_filepath, postcode_filepath, imd_data, args.stages, profile_memory = True,
+                                 correct_postcodes = args.correct_postcodes)
+        size_results = {stage: {'seconds': min(run[stage] for run in times), 'peak_memory_mb': peak_memory[stage]}
+                        for stage in peak_memory}
+        run_results['results'].setdefault(str(n_respondents), {}).update(size_results)
+
+        for stage, stage_results in size_results.items():
+            print('{:>10} {:<22} {:>10.3f} s {:>10.1f} MB'.format(n_respondents, stage, stage_results['seconds'],
+                                                                 stage_results['peak_memory_mb']))
+
+    with open(results_filepath, 'w') as file:
+        json.dump(run_results, file, indent = 2)
+    print('Results saved to {}'.format(results_filepath))
+
+    if args.compare is not None:
+        with open(get_results_filepath(args.results_dir, args.compare[0])) as file:
+            compare_results(json.load(file), run_results)
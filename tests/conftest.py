@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# function for reading a recorded page from the test data directory
+def read_page(*path):
+    with open(os.path.join(DATA_DIR, *path), 'rb') as file:
+        return file.read()
+
+# class for a local server serving recorded pages, keyed by path (with the query string), and recording the requests
+class RecordedServer(ThreadingHTTPServer):
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), RecordedPageHandler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        self.pages = {}
+        self.n_changes = 0
+        self.requests = []
+        # servers without validators send every page in full, without ETag and Last-Modified headers
+        self.validators = True
+        self.lock = threading.Lock()
+
+    # function for setting the body of a page, with a new Last-Modified time if the body changed
+    def set_page(self, path, body):
+        if path not in self.pages or self.pages[path][0] != body:
+            self.n_changes += 1
+            self.pages[path] = (body, formatdate(1600000000 + 60 * self.n_changes, usegmt = True))
+
+    # function for getting the requested paths (without the server url), optionally only those answered with a status
+    def get_requests(self, status = None):
+        return [path for path, request_status, _ in self.requests if status is None or request_status == status]
+
+class RecordedPageHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        page = self.server.pages.get(self.path)
+        if page is None:
+            status = 404
+        else:
+            body, last_modified = page
+            etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:16])
+            status = 304 if self.server.validators and self.headers.get('If-None-Match') == etag else 200
+        with self.server.lock:
+            self.server.requests.append((self.path, status, dict(self.headers)))
+        self.send_response(status)
+        if page is not None and self.server.validators:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+        if status == 200:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status == 200:
+            self.wfile.write(body)
+
+# fixture for a local server of recorded pages, running for the duration of a test
+@pytest.fixture
+def recorded_server():
+    server = RecordedServer()
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
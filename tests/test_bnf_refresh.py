@@ -0,0 +1,62 @@
+import os
+
+import pandas as pd
+import pytest
+
+import Get_BNF_classes
+from conftest import read_page
+from utils.http_cache import CachedFetcher, Checkpoint
+
+# drug pages of the first and second runs, keyed by drug name (the drug index lists the drugs of each run)
+FIRST_PAGES = {'codeine phosphate with paracetamol': 'codeine-phosphate-with-paracetamol.html',
+               'ibuprofen': 'ibuprofen.html', 'omeprazole': 'omeprazole.html', 'paracetamol': 'paracetamol.html'}
+SECOND_PAGES = dict({drug: page for drug, page in FIRST_PAGES.items() if drug != 'omeprazole'},
+                    ibuprofen = 'ibuprofen_updated.html', lansoprazole = 'lansoprazole.html')
+
+# function for serving the recorded drug index and drug pages of a run
+def serve_bnf_pages(server, index_page, drug_pages):
+    server.set_page('/drug/', read_page('bnf', index_page))
+    for drug, page in drug_pages.items():
+        server.set_page('/drug/{}.html'.format(drug.replace(' ', '-')), read_page('bnf', page))
+
+# the refresh should only parse the drug pages that changed, and save a diff of the changed drugs
+@pytest.mark.parametrize('validators', [True, False])
+def test_refresh_only_parses_changed_pages(recorded_server, tmp_path, monkeypatch, validators):
+    recorded_server.validators = validators
+    output_filepath, diff_filepath = str(tmp_path / 'bnf_classes.csv'), str(tmp_path / 'bnf_classes_diff.csv')
+    cache_dir = str(tmp_path / 'cache')
+
+    # record the drug pages that are parsed, by their heading
+    parsed = []
+    get_classifications = Get_BNF_classes.get_classifications
+    def get_recorded_classifications(drug_html):
+        parsed.append(drug_html.find('h1').text.lower())
+        return get_classifications(drug_html)
+    monkeypatch.setattr(Get_BNF_classes, 'get_classifications', get_recorded_classifications)
+
+    # function for running the refresh as the script does, with pages always revalidated
+    def refresh():
+        fetcher = CachedFetcher(cache_dir, max_workers = 2, requests_per_second = 0, max_age = 0)
+        parsed_pages = Checkpoint(os.path.join(cache_dir, 'classifications.json'))
+        return Get_BNF_classes.pull_bnf_classes(output_filepath, recorded_server.url, fetcher, parsed_pages,
+                                                refresh = True, diff_filepath = diff_filepath)
+
+    serve_bnf_pages(recorded_server, 'index.html', FIRST_PAGES)
+    refresh()
+    assert sorted(parsed) == sorted(FIRST_PAGES)
+    assert not os.path.exists(diff_filepath)
+
+    parsed.clear()
+    serve_bnf_pages(recorded_server, 'index_updated.html', SECOND_PAGES)
+    bnf_classes = refresh()
+    assert sorted(parsed) == ['ibuprofen', 'lansoprazole']
+    if validators:
+        assert sorted(path for path in recorded_server.get_requests(304)) == \
+            ['/drug/codeine-phosphate-with-paracetamol.html', '/drug/paracetamol.html']
+
+    diff = pd.read_csv(diff_filepath).set_index('drugs')
+    assert diff['change'].to_dict() == {'lansoprazole': 'added', 'omeprazole': 'removed', 'ibuprofen': 'reclassified'}
+    assert diff.loc['ibuprofen', ['old_secondary', 'new_secondary']].tolist() == ['None', 'Analgesics']
+
+    # the unchanged drugs keep the classifications parsed in the first run
+    assert bnf_classes.set_index('drugs').loc['codeine phosphate; paracetamol', 'secondary'] == 'Non-opioid analgesics'
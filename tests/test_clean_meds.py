@@ -0,0 +1,33 @@
+import os
+import pandas as pd
+
+from utils.answer_mapping import AnswerMapper
+
+DATA_DIRPATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+FIXTURE_FILEPATH = os.path.join(DATA_DIRPATH, 'clean_meds_fixture.csv')
+CORRECTIONS_FILEPATH = os.path.join(DATA_DIRPATH, 'answer_mappings_complete.csv')
+
+# the cleaned answers should match the output recorded in the regression fixture
+def test_clean_answers_matches_fixture():
+    fixture = pd.read_csv(FIXTURE_FILEPATH, dtype = str, keep_default_na = False)
+    cleaned = AnswerMapper.clean_answers(fixture['answer'])
+    mismatches = fixture.assign(result = cleaned)[cleaned != fixture['cleaned']]
+    assert mismatches.empty, mismatches.to_string()
+
+# words removed by adjacent patterns should all be removed, and answers made up only of removed words should be kept
+def test_clean_answers_adjacent_and_empty_matches():
+    answers = pd.Series(['eye drops', 'paracetamol 500mg x2 as needed', 'cod liver oil capsules', '30mg lansoprazole'])
+    assert AnswerMapper.clean_answers(answers).tolist() == ['eye drops', 'paracetamol', 'cod liver oil', 'lansoprazole']
+
+# raw answers that had manual corrections before answers were cleaned should still get the same correction once cleaned
+def test_cleaned_answers_keep_manual_corrections():
+    corrections = pd.read_csv(CORRECTIONS_FILEPATH).astype(str)
+    corrections = corrections.apply(lambda col: col.str.strip(), axis=0)
+    corrections = dict(zip(corrections['answer'], corrections['correction']))
+    expected = {'statin 20 mg': 'statins', 'statin 40 mg': 'statins', 'oestrogen patch': 'estradiol',
+                'oestrogen cream': 'estradiol', 'oestrogen gel': 'estradiol', 'steroid inhaler': 'corticosteroids',
+                'belometasone, 2 puffs twice a day': 'beclometasone'}
+    cleaned = AnswerMapper.clean_answers(pd.Series(list(expected)))
+    assert {answer: corrections.get(key) for answer, key in zip(expected, cleaned)} == expected
+    # the corrected statin answers are picked up by the manual statin flag
+    assert pd.Series(['statins']).str.contains('(\\s|^)statin(s|\\s|$)').all()
@@ -0,0 +1,92 @@
+import os
+import pickle
+
+import utils.drug_dictionary
+from utils.drug_dictionary import load_drug_dictionary, get_compiled_dictionary_filepath, get_dictionary_source
+from utils.mapping_cache import MappingCache
+from utils.phonetic_index import load_phonetic_index, get_phonetic_index_filepath
+
+DRUG_DICTIONARY = {'paracetamol': {'DB00316'}, 'panadol': {'DB00316'}, 'co-codamol': {'DB00316', 'DB00318'},
+                   'omeprazole': {'DB00338'}, 'losec': {'DB00338'}, 'aspirin': {'DB00945'}}
+
+# function for writing the test drug dictionary pickle and loading its compiled version
+def load_test_dictionary(tmp_path):
+    drug_dict_filepath = str(tmp_path / 'drug_dictionary.p')
+    with open(drug_dict_filepath, 'wb') as file:
+        pickle.dump(DRUG_DICTIONARY, file)
+    return drug_dict_filepath, load_drug_dictionary(drug_dict_filepath)
+
+# the length and set of ids of the compiled dictionary should match a plain dictionary with the same changes
+def test_len_and_all_db_ids_follow_changes(tmp_path):
+    _, compiled = load_test_dictionary(tmp_path)
+    plain = dict(DRUG_DICTIONARY)
+    changes = [('set', 'losec', {'DB00338', 'DB01234'}), ('del', 'aspirin', None), ('set', 'ibuprofen', {'DB01050'}),
+               ('del', 'losec', None), ('set', 'aspirin', {'DB00945'}), ('del', 'ibuprofen', None),
+               ('del', 'co-codamol', None)]
+    assert len(compiled) == len(plain) and compiled.all_db_ids() == set().union(*plain.values())
+    for change, alias, db_ids in changes:
+        for drug_dictionary in (compiled, plain):
+            if change == 'set':
+                drug_dictionary[alias] = db_ids
+            else:
+                del drug_dictionary[alias]
+        assert len(compiled) == len(plain) == len(list(compiled))
+        assert compiled.all_db_ids() == set().union(*plain.values())
+        assert len(compiled.copy()) == len(plain)
+
+# the compiled file should be kept when the pickle is touched without changes, and rebuilt when it changes
+def test_load_checks_pickle_changes(tmp_path):
+    drug_dict_filepath, _ = load_test_dictionary(tmp_path)
+    compiled_filepath = get_compiled_dictionary_filepath(drug_dict_filepath)
+    compiled_time = os.stat(compiled_filepath).st_mtime_ns
+
+    os.utime(drug_dict_filepath, ns = (compiled_time + 10 ** 9, compiled_time + 10 ** 9))
+    touched = load_drug_dictionary(drug_dict_filepath)
+    assert set(touched) == set(DRUG_DICTIONARY)
+    assert touched.metadata['dictionary_source'] == get_dictionary_source(drug_dict_filepath)
+
+    with open(drug_dict_filepath, 'wb') as file:
+        pickle.dump(dict(DRUG_DICTIONARY, ibuprofen = {'DB01050'}), file)
+    assert 'ibuprofen' in load_drug_dictionary(drug_dict_filepath)
+
+# the mapping cache and phonetic index should use the hash stored in the compiled file when the pickle is not available
+def test_compiled_file_used_without_pickle(tmp_path):
+    drug_dict_filepath, _ = load_test_dictionary(tmp_path)
+    corrections_filepath = str(tmp_path / 'answer_mappings.csv')
+    with open(corrections_filepath, 'w') as file:
+        file.write('answer,correction\nlosek,losec\n')
+    cache = MappingCache(str(tmp_path / 'cache.db'), drug_dict_filepath, corrections_filepath)
+    cache_key = cache.key
+    cache.close()
+    encodings = load_phonetic_index(drug_dict_filepath).encodings
+
+    os.remove(drug_dict_filepath)
+    cache = MappingCache(str(tmp_path / 'cache.db'), drug_dict_filepath, corrections_filepath)
+    assert cache.key == cache_key
+    cache.close()
+    assert load_phonetic_index(drug_dict_filepath).encodings == encodings
+    # a missing index is rebuilt from the compiled file
+    os.remove(get_phonetic_index_filepath(drug_dict_filepath))
+    assert load_phonetic_index(drug_dict_filepath).encodings == encodings
+
+# the phonetic index should only check the dictionary hash when the size or modification time of the pickle changes
+def test_phonetic_index_checks_pickle_stat(tmp_path, monkeypatch):
+    drug_dict_filepath, _ = load_test_dictionary(tmp_path)
+    load_phonetic_index(drug_dict_filepath)
+
+    def fail_hash(*filepaths):
+        raise AssertionError('the drug dictionary was hashed')
+    with monkeypatch.context() as patch:
+        patch.setattr(utils.drug_dictionary, 'hash_files', fail_hash)
+        load_phonetic_index(drug_dict_filepath)
+
+    compiled_time = os.stat(get_compiled_dictionary_filepath(drug_dict_filepath)).st_mtime_ns
+    os.utime(drug_dict_filepath, ns = (compiled_time + 10 ** 9, compiled_time + 10 ** 9))
+    load_phonetic_index(drug_dict_filepath)
+    with open(get_phonetic_index_filepath(drug_dict_filepath), 'rb') as file:
+        assert pickle.load(file)['dictionary_source'] == get_dictionary_source(drug_dict_filepath)
+
+    with open(drug_dict_filepath, 'wb') as file:
+        pickle.dump(dict(DRUG_DICTIONARY, ibuprofen = {'DB01050'}), file)
+    index = load_phonetic_index(drug_dict_filepath)
+    assert index.get(index.encode('ibuprofen')) == {'DB01050'}
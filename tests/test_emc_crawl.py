@@ -0,0 +1,83 @@
+import json
+from string import ascii_uppercase
+
+import pytest
+
+from conftest import read_page
+from Get_EMC_drugs import add_emc_drugs
+from utils.http_cache import CachedFetcher, Checkpoint
+
+DRUG_DICTIONARY = {'aspirin': {'DB00945'}, 'paracetamol': {'DB00316'}, 'caffeine': {'DB00201'},
+                   'ibuprofen': {'DB01050'}, 'codeine': {'DB00318'}}
+
+# links of the recorded product pages, in the order they are listed
+PRODUCT_LINKS = ['/emc/product/1234/smpc', '/emc/product/3261/smpc', '/emc/product/2170/smpc', '/emc/product/6734/smpc']
+
+# function for serving the recorded EMC browse and product pages
+def serve_emc_pages(server):
+    for letter in ascii_uppercase:
+        recorded = letter in 'ABC'
+        server.set_page('/emc/browse-medicines/{}'.format(letter),
+                        read_page('emc', 'browse_{}.html'.format(letter if recorded else 'empty')))
+        if recorded:
+            server.set_page('/emc/browse-medicines?prefix={}&offset=1&limit=200'.format(letter),
+                            read_page('emc', 'list_{}.html'.format(letter)))
+    for link in PRODUCT_LINKS:
+        server.set_page(link, read_page('emc', 'product_{}.html'.format(link.split('/')[3])))
+
+# fetcher that is interrupted (e.g. by the user) after fetching a number of product pages
+class InterruptedFetcher(CachedFetcher):
+
+    def __init__(self, cache_dir, n_products):
+        super().__init__(cache_dir, max_workers = 1, requests_per_second = 0)
+        self.n_products = n_products
+
+    def fetch(self, url):
+        if '/emc/product/' in url:
+            if self.n_products == 0:
+                raise KeyboardInterrupt
+            self.n_products -= 1
+        return super().fetch(url)
+
+# an interrupted crawl should be resumed from the checkpoint, without requesting the pages it already pulled
+def test_interrupted_crawl_resumes_from_checkpoint(recorded_server, tmp_path):
+    serve_emc_pages(recorded_server)
+    checkpoint_filepath = str(tmp_path / 'checkpoint.json')
+
+    with pytest.raises(KeyboardInterrupt):
+        add_emc_drugs(dict(DRUG_DICTIONARY), recorded_server.url, InterruptedFetcher(str(tmp_path / 'cache_1'), 2),
+                      Checkpoint(checkpoint_filepath, save_every = 1))
+    with open(checkpoint_filepath) as file:
+        assert list(json.load(file)) == PRODUCT_LINKS[:2]
+
+    # the resumed crawl uses a separate response cache, so only the checkpoint can spare it requests
+    recorded_server.requests.clear()
+    fetcher = CachedFetcher(str(tmp_path / 'cache_2'), max_workers = 2, requests_per_second = 0)
+    drug_dictionary = add_emc_drugs(dict(DRUG_DICTIONARY), recorded_server.url, fetcher, Checkpoint(checkpoint_filepath))
+
+    assert sorted(path for path in recorded_server.get_requests() if path.startswith('/emc/product/')) == \
+        sorted(PRODUCT_LINKS[2:])
+    # the aspirin product is skipped as its first word is already in the dictionary
+    assert drug_dictionary == dict(DRUG_DICTIONARY, anadin = {'DB00945', 'DB00316', 'DB00201'}, brufen = {'DB01050'},
+                                   calpol = {'DB00316'}, **{'co-codamol': {'DB00318', 'DB00316'}})
+
+# stale cached pages should be revalidated with conditional requests, and reused if the server reports no change
+def test_cached_fetcher_revalidates_stale_pages(recorded_server, tmp_path):
+    serve_emc_pages(recorded_server)
+    url = recorded_server.url + PRODUCT_LINKS[0]
+    fetcher = CachedFetcher(str(tmp_path / 'cache'), requests_per_second = 0, max_age = 0)
+
+    assert fetcher.fetch_with_status(url) == (read_page('emc', 'product_1234.html'), True)
+    assert fetcher.fetch_with_status(url) == (read_page('emc', 'product_1234.html'), False)
+    headers = recorded_server.requests[-1][2]
+    assert headers['If-None-Match'] and headers['If-Modified-Since'] == recorded_server.pages[PRODUCT_LINKS[0]][1]
+    assert [status for _, status, _ in recorded_server.requests] == [200, 304]
+
+    # a changed page is downloaded again
+    recorded_server.set_page(PRODUCT_LINKS[0], read_page('emc', 'product_3261.html'))
+    assert fetcher.fetch_with_status(url) == (read_page('emc', 'product_3261.html'), True)
+
+    # fresh pages are served from the cache without a request
+    fetcher.max_age = 3600
+    assert fetcher.fetch_with_status(url) == (read_page('emc', 'product_3261.html'), False)
+    assert len(recorded_server.requests) == 3
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import read_page
+from Map_IMD_data import get_postcode_ranks, get_deciles, NI_imd_deciles
+from utils.http_cache import Fetcher
+from utils.postcode_ranks import PostcodeRankCache
+
+POSTCODES = ['BT1 1AA', 'BT2 7BG', 'BT3 9DT', 'BT4 3SR', 'BT5 6QX']
+
+# fetcher that is interrupted (e.g. by the user) after a number of requests
+class InterruptedFetcher(Fetcher):
+
+    def __init__(self, n_requests):
+        super().__init__(max_workers = 1, requests_per_second = 0)
+        self.n_requests = n_requests
+
+    def fetch(self, url):
+        if self.n_requests == 0:
+            raise KeyboardInterrupt
+        self.n_requests -= 1
+        return super().fetch(url)
+
+# ranks should be written to the cache as they arrive, so an interrupted lookup does not request them again
+def test_ranks_are_cached_as_they_arrive(recorded_server, tmp_path):
+    for postcode in POSTCODES:
+        page = 'not_found.html' if postcode == 'BT4 3SR' else 'ranked.html'
+        recorded_server.set_page('/MDM/Details?Id={}'.format(postcode.replace(' ', '+')), read_page('nisra', page))
+    base_url = recorded_server.url + '/MDM/Details?Id='
+    cache = PostcodeRankCache(str(tmp_path / 'ranks.db'), base_url)
+
+    with pytest.raises(KeyboardInterrupt):
+        get_postcode_ranks(POSTCODES, cache, base_url, InterruptedFetcher(3), batch_size = 1)
+    assert cache.get(POSTCODES) == {postcode: '213' for postcode in POSTCODES[:3]}
+
+    recorded_server.requests.clear()
+    ranks = get_postcode_ranks(POSTCODES, cache, base_url, Fetcher(max_workers = 2, requests_per_second = 0))
+    assert sorted(recorded_server.get_requests()) == ['/MDM/Details?Id=BT4+3SR', '/MDM/Details?Id=BT5+6QX']
+    assert ranks == {'BT1 1AA': '213', 'BT2 7BG': '213', 'BT3 9DT': '213', 'BT4 3SR': None, 'BT5 6QX': '213'}
+    cache.close()
+
+# ranks on and either side of the decile boundaries should get the number of boundaries below them, and missing ranks NaN
+def test_deciles_of_boundary_ranks():
+    ranks = pd.Series(['1', '89', '90', '890', None], index = [3, 5, 7, 9, 11])
+    deciles = get_deciles(ranks, NI_imd_deciles)
+    assert deciles.index.tolist() == ranks.index.tolist()
+    np.testing.assert_array_equal(deciles.to_numpy(), [1, 1, 2, 10, np.nan])
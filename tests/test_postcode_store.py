@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from utils.binary_store import update_metadata
+from utils.postcode_store import load_postcode_store, STORE_VERSION
+
+POSTCODE_DATA = pd.DataFrame({'Postcode': ['AB1 0AA', 'BT1 1AA', 'CF10 1AA', 'EH1 1AA', 'GY1 1AA', 'SW1A 1AA'],
+                              'In Use?': ['Yes', 'Yes', 'Yes', 'Yes', 'Yes', 'No'],
+                              'Country': ['Scotland', 'Northern Ireland', 'Wales', 'Scotland', np.nan, 'England']})
+
+# function for compiling the test postcode data set and loading the store
+def get_test_store(tmp_path, postcode_data = POSTCODE_DATA):
+    postcode_data.to_csv(tmp_path / 'postcode_data.csv', index = False)
+    return load_postcode_store(str(tmp_path / 'postcode_data.csv'))
+
+# postcodes without a country should get an unknown country, rather than the last country of the data set
+def test_postcodes_without_country_are_unknown(tmp_path):
+    store = get_test_store(tmp_path)
+    entries = store.resolve(POSTCODE_DATA['Postcode'])
+    assert store.get_countries(entries).tolist() == \
+        ['Scotland', 'Northern Ireland', 'Wales', 'Scotland', 'Unknown', 'England']
+
+# stores compiled by an older version should be recompiled, even if the data set has not changed
+def test_old_store_versions_are_recompiled(tmp_path):
+    store = get_test_store(tmp_path)
+    # a store written before versioning, when postcodes without a country were given the last country
+    countries = [country for country in store.metadata['countries'] if country != 'Unknown']
+    update_metadata(store.filepath, {'countries': countries, 'source': store.metadata['source']})
+    store = load_postcode_store(str(tmp_path / 'postcode_data.csv'))
+    assert store.metadata['version'] == STORE_VERSION and 'Unknown' in store.countries
+
+# postcodes should be corrected if their variants match a single entry, and left uncorrected if they match several
+def test_correct(tmp_path):
+    postcode_data = pd.DataFrame({'Postcode': ['SO1 0AA', 'M1 1AE', 'M1 1AF', 'EC1A 1BB', 'W1A 1AA'],
+                                  'In Use?': 'Yes', 'Country': 'England'})
+    store = get_test_store(tmp_path, postcode_data)
+
+    entries, candidates = store.correct(pd.Series([], dtype = object))
+    assert len(entries) == 0 and candidates == []
+
+    # a unique O/0 swap, a single edit (a missing character), an edit away from two postcodes, and no match
+    entries, candidates = store.correct(pd.Series(['s01 oaa', 'EC1A1B', 'M1 1AG', 'ZZ9 9ZZ', None]))
+    assert store.get_postcodes(entries[:2]).tolist() == ['SO1 0AA', 'EC1A 1BB']
+    assert entries[2:].tolist() == [-1, -1, -1]
+    assert sorted(store.get_postcodes(candidates[2])) == ['M1 1AE', 'M1 1AF']
+    assert [len(postcode_candidates) for postcode_candidates in candidates[3:]] == [0, 0]
@@ -1,124 +1,116 @@
 import pandas as pd
 import re
-from abydos.phonetic import Metaphone
+
+from utils.phonetic_index import PhoneticIndex, load_phonetic_index
 
 # class for mapping survey answers
 class AnswerMapper:
 
     # initialise with a drug dictionary and a filepath to the survey data frame
-    def __init__(self, survey_filepath, drug_dict, meds_q, dosage_q, units_q, RoAs_q):
+    # if the path to the drug dictionary pickle is provided, its prebuilt phonetic index is used for mapping
+    # if a chunksize is provided, the survey file is read in chunks of that many rows
+    def __init__(self, survey_filepath, drug_dict, meds_q, dosage_q, units_q, RoAs_q, drug_dict_filepath = None,
+                 id_column = 'uid', chunksize = None):
         self.drug_dictionary = drug_dict
-        self.all_db_ids = set().union(*self.drug_dictionary.values())
+        self.drug_dict_filepath = drug_dict_filepath
+        self._phonetic_index = None
+        # a compiled drug dictionary reads the ids straight from its id table
+        self.all_db_ids = self.drug_dictionary.all_db_ids() if hasattr(self.drug_dictionary, 'all_db_ids') \
+            else set().union(*self.drug_dictionary.values())
         self.drug_frequencies = {db_id: 0 for db_id in self.all_db_ids}
-        self.import_data(survey_filepath, meds_q=meds_q, dosage_q=dosage_q, units_q=units_q, RoAs_q=RoAs_q)
+        self.import_data(survey_filepath, meds_q=meds_q, dosage_q=dosage_q, units_q=units_q, RoAs_q=RoAs_q,
+                         id_column=id_column, chunksize=chunksize)
         self.clean_meds()
 
-    # function to import and clean the survey answers
-    def import_data(self, survey_filepath, meds_q, dosage_q, units_q, RoAs_q):
-
-        # import the survey data csv file
-        self.survey_data = pd.read_csv(survey_filepath, engine = 'python')
-
-        # filter for medication question
-        meds = self.survey_data.loc[:, self.survey_data.columns.str.contains(meds_q)]
-        # mask for rows (participants) that provided no medication answers
-        no_med_answer_mask = meds.apply(lambda row: row.isna().all(), axis=1)
-
-        # filter participants that provided no answer and flatten the array
-        meds = meds[~no_med_answer_mask].stack()
+    # function to import the survey answers and align them into a long-format answer table
+    def import_data(self, survey_filepath, meds_q, dosage_q, units_q, RoAs_q, id_column = 'uid', chunksize = None):
+        '''
+        Only the patient id column and the columns of the four questions are read from the survey file, with the
+        medication answers read as strings and the dosage, unit and RoA answers converted to numbers (any non-numeric
+        answers to these questions are treated as missing).
+
+        With a chunksize, the file is streamed in chunks of that many rows and each chunk is aligned into the long-format
+        answer table on its own, so only the answer table and the patient id column are held in memory.
+        The survey_data attribute keeps the patient id column, indexed by row number as in the full survey file.
+        '''
+        # read the header to find the columns for each question
+        columns = pd.read_csv(survey_filepath, nrows = 0).columns
+        question_columns = {question: [col for col in columns if question in col] for question in [meds_q, dosage_q, units_q, RoAs_q]}
+        usecols = [col for col in columns if col == id_column or any(col in cols for cols in question_columns.values())]
+
+        # read all question columns as strings, converting the numeric answers once each chunk is read
+        survey_chunks = pd.read_csv(survey_filepath, usecols = usecols, dtype = {col: str for col in usecols if col != id_column},
+                                    chunksize = chunksize)
+        if chunksize is None:
+            survey_chunks = [survey_chunks]
+
+        numeric_columns = question_columns[dosage_q] + question_columns[units_q] + question_columns[RoAs_q]
+        survey_data = []
+        answers = []
+        for survey_chunk in survey_chunks:
+            survey_chunk[numeric_columns] = survey_chunk[numeric_columns].apply(pd.to_numeric, errors = 'coerce')
+
+            # align the answers to all four questions on their (patient, slot) keys
+            answers.append(AnswerMapper.align_answers(survey_chunk, meds_q=meds_q, dosage_q=dosage_q,
+                                                      units_q=units_q, RoAs_q=RoAs_q))
+            survey_data.append(survey_chunk.loc[:, survey_chunk.columns == id_column])
+
+        self.survey_data = pd.concat(survey_data)
+        self.answers = pd.concat(answers)
+
+        # set attributes, with the question identifiers restored in the second index level
+        self.meds = AnswerMapper.get_question_answers(self.answers, 'med', meds_q)
+        self.dosages = AnswerMapper.get_question_answers(self.answers, 'dose', dosage_q)
+        self.units = AnswerMapper.get_question_answers(self.answers, 'unit', units_q)
+        self.RoAs = AnswerMapper.get_question_answers(self.answers, 'roa', RoAs_q)
+
+    # function for flattening the answers to a single question into a series indexed by (patient, slot)
+    @staticmethod
+    def stack_answers(survey_data, question):
+
+        # filter for the question columns and flatten the array, dropping NA values
+        answers = survey_data.loc[:, survey_data.columns.str.contains(question)].stack()
+
+        # trim the question indices and remove the question prefix, leaving a slot key shared by all questions
+        question_ids = answers.index.get_level_values(1)
+        slots = question_ids.str.replace('(?<=_\\d)_1', '', regex = True).str.replace(question, '', regex = False)
+        answers.index = pd.MultiIndex.from_arrays([answers.index.get_level_values(0), slots], names = ['uid', 'slot'])
+
+        return answers
+
+    # function for building a long-format table of (uid, slot, med, dose, unit, roa) from the survey data
+    @staticmethod
+    def align_answers(survey_data, meds_q, dosage_q, units_q, RoAs_q):
+
+        meds = AnswerMapper.stack_answers(survey_data, meds_q)
         # filter NAs or -99s
         meds = meds[(meds != '-99') & (meds != -99) & (~meds.isna())]
         # basic preprocessing
         meds = meds.str.strip()
         meds = meds.str.lower()
 
-        # filter for dosage question
-        dosages = self.survey_data.loc[:, self.survey_data.columns.str.contains(dosage_q)]
-        no_dosage_answer_mask = dosages.apply(lambda row: row.isna().all(), axis=1)
-        dosages = dosages[~no_dosage_answer_mask].stack()
-
-        # filter for units question
-        units = self.survey_data.loc[:, self.survey_data.columns.str.contains(units_q)]
-        no_units_answer_mask = units.apply(lambda row: row.isna().all(), axis=1)
-        units = units[~no_units_answer_mask].stack()
-
-        # filter for roa question
-        RoAs = self.survey_data.loc[:, self.survey_data.columns.str.contains(RoAs_q)]
-        no_RoA_answer_mask = RoAs.apply(lambda row: row.isna().all(), axis=1)
-        RoAs = RoAs[~no_RoA_answer_mask].stack()
-
-        # trim the question indices for all questions
-        meds_idx_levels = meds.index.get_level_values(1).unique()
-        meds_idx_level_mapping = {level: re.sub('(?<=_\d)_1', '', level) for level in meds_idx_levels}
-        meds.rename(meds_idx_level_mapping, level=1, inplace=True)
-
-        dosage_idx_levels = dosages.index.get_level_values(1).unique()
-        dosage_idx_level_mapping = {level: re.sub('(?<=_\d)_1', '', level) for level in dosage_idx_levels}
-        dosages.rename(dosage_idx_level_mapping, level=1, inplace=True)
-
-        unit_idx_levels = units.index.get_level_values(1).unique()
-        unit_idx_level_mapping = {level: re.sub('(?<=_\d)_1', '', level) for level in unit_idx_levels}
-        units.rename(unit_idx_level_mapping, level=1, inplace=True)
-
-        RoA_idx_levels = RoAs.index.get_level_values(1).unique()
-        RoA_idx_level_mapping = {level: re.sub('(?<=_\d)_1', '', level) for level in RoA_idx_levels}
-        RoAs.rename(RoA_idx_level_mapping, level=1, inplace=True)
-
-        # add dosage answers for patients that provided medication answers but are missing in the dosage answers
-        for patient, question in meds.index:
-            # get question index values for the dosage/units questions
-            dosage_question = question.replace(meds_q, dosage_q)
-            units_question = question.replace(meds_q, units_q)
-            RoAs_question = question.replace(meds_q, RoAs_q)
-            # add missing patient/question combinations to the series
-            if (patient, dosage_question) not in dosages.index:
-                dosages[(patient, dosage_question)] = -99
-                dosages = dosages.sort_index()
-            if (patient, units_question) not in units.index:
-                units[(patient, units_question)] = -99
-                units = units.sort_index()
-            if (patient, RoAs_question) not in RoAs.index:
-                RoAs[(patient, RoAs_question)] = -99
-                RoAs = RoAs.sort_index()
-
-        # generator to avoid modifying the global object
-        dosage_generator = ((patient, dosage_question) for patient, dosage_question in dosages.index)
-        # for patients/questions that are in the dosage answer series but not the medication answer series, just drop them
-        for patient, dosage_question in dosage_generator:
-            meds_question = dosage_question.replace(dosage_q, meds_q)
-            units_question = dosage_question.replace(dosage_q, units_q)
-            RoAs_question = dosage_question.replace(dosage_q, RoAs_q)
-            if (patient, meds_question) not in meds.index or (patient, units_question) \
-                    not in units.index or (patient, RoAs_question) not in RoAs.index:
-                dosages = dosages.drop((patient, dosage_question))
-
-        # generator to avoid modifying the global object
-        units_generator = ((patient, units_question) for patient, units_question in units.index)
-        # same for patients/questions in the dosage unit question
-        for patient, units_question in units_generator:
-            meds_question = units_question.replace(units_q, meds_q)
-            dosage_question = units_question.replace(units_q, dosage_q)
-            RoAs_question = units_question.replace(units_q, RoAs_q)
-            if (patient, meds_question) not in meds.index or (patient, dosage_question) \
-                    not in dosages.index or (patient, RoAs_question) not in RoAs.index:
-                units = units.drop((patient, units_question))
-
-        # generator to avoid modifying the global object
-        RoAs_generator = ((patient, units_question) for patient, units_question in RoAs.index)
-        # same for patients/questions in the dosage unit question
-        for patient, RoAs_question in RoAs_generator:
-            meds_question = RoAs_question.replace(RoAs_q, meds_q)
-            units_question = RoAs_question.replace(RoAs_q, units_q)
-            dosage_question = RoAs_question.replace(RoAs_q, dosage_q)
-            if (patient, meds_question) not in meds.index or (patient, dosage_question) \
-                    not in dosages.index or (patient, units_question) not in units.index:
-                RoAs = RoAs.drop((patient, RoAs_question))
-
-        # set attributes
-        self.meds = meds
-        self.dosages = dosages
-        self.units = units
-        self.RoAs = RoAs
+        other_answers = {'dose': AnswerMapper.stack_answers(survey_data, dosage_q),
+                         'unit': AnswerMapper.stack_answers(survey_data, units_q),
+                         'roa': AnswerMapper.stack_answers(survey_data, RoAs_q)}
+
+        # outer join of all questions on the slot key
+        answers = pd.concat([meds.rename('med')] + [series.rename(col) for col, series in other_answers.items()],
+                            axis = 1, join = 'outer')
+
+        # only keep slots with a medication answer (in the order they were given) and fill missing answers with -99
+        answers = answers.reindex(meds.index)
+        answers[list(other_answers)] = answers[list(other_answers)].fillna(-99)
+        # restore the original data types, which are lost in the join if any answers are missing
+        answers = answers.astype({col: series.dtype for col, series in other_answers.items()})
+
+        return answers
+
+    # function for getting the answers to one question from the answer table, indexed by (patient, question_number)
+    @staticmethod
+    def get_question_answers(answers, column, question):
+        patients = answers.index.get_level_values(0)
+        question_ids = question + answers.index.get_level_values(1)
+        return pd.Series(answers[column].values, index = pd.MultiIndex.from_arrays([patients, question_ids]))
 
     # function for cleaning imported medication aswers
     def clean_meds(self):
@@ -126,6 +118,17 @@ class AnswerMapper:
         if not hasattr(self, 'meds'):
             raise AttributeError('Instance has no attribute "meds". Please call import_data() first, with the filepath to a survey answer dataframe.')
 
+        # encode the answers as a categorical, so that each distinct answer string is only cleaned once
+        meds_categorical = pd.Categorical(self.meds)
+        categories_cleaned = AnswerMapper.clean_answers(pd.Series(meds_categorical.categories))
+
+        # broadcast the cleaned strings back to every answer through the categorical codes
+        self.meds_cleaned = pd.Series(categories_cleaned.values[meds_categorical.codes], index = self.meds.index)
+
+    # function for cleaning a series of medication answer strings
+    @staticmethod
+    def clean_answers(answers):
+
         ## regex patterns for cleaning medication answers ##
 
         # pattern for drug weights (e.g. milligrams)
@@ -135,50 +138,78 @@ class AnswerMapper:
         # weight and volume patterns combined
         dose_units = '(({weight}|{volume}|%|unit|i\.*u\.*)s*)'.format(weight=weights, volume=volumes)
         # units pattern compiled into a regex pattern for dosages
-        dosage_pattern = '([\d.]+/)*([\d.]+\s*|\s+){units}((/|{units})|\s+|$)|(\s+[\d.x]+\s*/\s*[\d.]+(\s+|$))'.format(units=dose_units)
+        dosage_pattern = '([\d.]+/)*([\d.]+\s*|\s+){units}(/|(?!\S))|(\s+[\d.x]+\s*/\s*[\d.]+(?!\S))'.format(units=dose_units)
         dosage_regex = re.compile(dosage_pattern)
 
+        # pattern for numbers of doses taken at a time (e.g. x2, 2 puffs)
+        dose_count_regex = re.compile('(?<!\S)(x\s*\d+|\d+\s*x|\d+\s*puffs?)(?!\S)')
+
         # pattern for different drug formulations
-        formulation_pattern = '(^|\s+)(capsule|drop|cream|ointment|tab(let)*|lotion|pill|spray|shampoo|patch(e)*|inhaler|gel|injection|pump|pen|solution|aqueous|oil|app(lication)*|implant|foam)s*(\s+|$)'
+        formulation_pattern = '(?<!\S)(capsule|drop|cream|ointment|tab(let)*|lotion|pill|spray|shampoo|patch(e)*|inhaler|gel|injection|pump|pen|solution|aqueous|app(lication)*|implant|foam)s*(?!\S)'
         formulation_regex = re.compile(formulation_pattern)
 
-        # pattern for different routes of administration
-        routes_of_admin_pattern = '(^|\s+)((oral|nasal|ocular|auricular|topical)(ly)?|mouth|eye|nose|ear|skin|scalp)(\s+|$)'
+        # pattern for different routes of administration, along with a preceding preposition (e.g. 'to skin', 'by mouth')
+        routes_of_admin_pattern = '(?<!\S)((to|on|in|into|onto|via|by)\s+(the\s+)?)?((oral|nasal|ocular|auricular|topical)(ly)?|mouth|eye|nose|ear|skin|scalp)(?!\S)'
         RoA_regex = re.compile(routes_of_admin_pattern)
 
         # pattern for numbers
         numbers_pattern = '(once|one|1)|(twice|two|2)|(three|3)|(four|4)|(five|5)|(six|6)|(seven|7)|(eight|8)|(nine|9)'
         # pattern for frequency of taking drugs (e.g. 2x a day)
-        frequency_pattern = '({numbers})?\s*(times|x)?\s*(a|per|every|each)?\s*({numbers})?\s*(da(y|ily)|(week|month)(ly)?)'.format(numbers=numbers_pattern)
+        frequency_pattern = '(?<!\S)({numbers})?\s*(times|x)?\s*(a|per|every|each)?\s*({numbers})?\s*(da(y|ily)|(week|month)(ly)?)(?!\S)'.format(numbers=numbers_pattern)
         frequency_regex = re.compile(frequency_pattern)
 
+        # pattern for drugs taken when needed
+        as_needed_regex = re.compile('(?<!\S)((as|when) (needed|required)|prn)(?!\S)')
+
         # pattern for parenthetical qualifiers
         qualifier_regex = re.compile('\(+.*\)+')
 
-        all_patterns = [frequency_regex, dosage_regex, formulation_regex, RoA_regex, qualifier_regex]
+        all_patterns = [frequency_regex, dosage_regex, dose_count_regex, formulation_regex, RoA_regex, as_needed_regex,
+                        qualifier_regex]
 
-        # loop through regex patterns and filter each one from the answers
+        # loop through regex patterns and filter each one from the answers in turn
+        # matches are replaced with a space - the patterns only match whole words (looking at the whitespace either side
+        # of a match without consuming it), so adjacent words (e.g. 'cream tablets') are all removed
+        answers_cleaned = answers
         for pattern in all_patterns:
-            meds = self.meds.str.replace(pattern, '')
+            answers_cleaned = answers_cleaned.str.replace(pattern, ' ', regex = True)
 
         # remove anything coming after a forward slash if more than two alphanumeric characters are detected
-        meds_cleaned = meds.str.replace('/\w{2,}.*$', '')
+        answers_cleaned = answers_cleaned.str.replace('/\w{2,}.*$', '', regex = True)
 
         # text cleaning
-        meds_cleaned = meds_cleaned.str.strip()
-        meds_cleaned = meds_cleaned.str.lower()
+        answers_cleaned = AnswerMapper.clean_text(answers_cleaned)
+
+        # answers made up entirely of removed words (e.g. 'eye drops') are kept with only the text cleaning
+        return answers_cleaned.where(answers_cleaned != '', AnswerMapper.clean_text(answers))
+
+    # function for collapsing whitespace and lowercasing a series of answer strings
+    @staticmethod
+    def clean_text(answers):
+        return answers.str.replace('\s+', ' ', regex = True).str.strip().str.lower()
+
+    # phonetic index of the drug dictionary, loaded (or built) the first time it is needed
+    @property
+    def phonetic_index(self):
+        if self._phonetic_index is None:
+            if self.drug_dict_filepath is not None:
+                self._phonetic_index = load_phonetic_index(self.drug_dict_filepath)
+            else:
+                self._phonetic_index = PhoneticIndex.from_drug_dictionary(self.drug_dictionary)
+        return self._phonetic_index
 
-        self.meds_cleaned = meds_cleaned
+    # function for mapping the cleaned answers to drugbank ids, optionally with a MappingCache of previous runs
+    def map_answers(self, cache = None):
 
-    def map_answers(self):
+        # dictionary of distinct answers mapped to the stage that resolved them and their drugbank ids
+        answer_mappings = cache.get(self.meds_cleaned.unique()) if cache is not None else {}
+        new_answer_mappings = {}
 
-        # lists for mapped answers in different categories
-        self.mapped_survey_answers = []
-        self.first_name_mapped_survey_answers = []
-        self.unmapped_survey_answers = []
+        # loop through answers that were not found in the cache and map them
+        for answer in self.meds_cleaned.unique():
 
-        # loop through answers and map them
-        for answer in self.meds_cleaned:
+            if answer in answer_mappings:
+                continue
 
             # try to get the drugbank ids for the whole answer
             db_ids = self.drug_dictionary.get(answer)
@@ -187,58 +218,76 @@ class AnswerMapper:
             first_word = re.sub('[^\w]+.*$', '', answer)
             first_word_db_ids = self.drug_dictionary.get(first_word)
 
-            # if the name is already in the drug dictionary add to the mapped list
+            # if the name is already in the drug dictionary it is mapped
             if db_ids:
-                self.mapped_survey_answers.append(answer)
-                mapped_db_ids = db_ids
-
-            # if its first name is in the bnf add it to the first name mapped list and add answer to the drug dictionary
+                new_answer_mappings[answer] = ('exact', db_ids)
+            # if its first name is in the drug dictionary it is mapped by its first name
             elif first_word_db_ids:
-                self.drug_dictionary[answer] = self.drug_dictionary[first_word]
-                self.first_name_mapped_survey_answers.append(answer)
-                mapped_db_ids = first_word_db_ids
+                new_answer_mappings[answer] = ('first_word', first_word_db_ids)
+            # otherwise it is left for the phonetic encoding
+            else:
+                new_answer_mappings[answer] = ('unmapped', set())
+
+        answer_mappings.update(new_answer_mappings)
+
+        # add answers mapped by their first name to the drug dictionary
+        for answer, (stage, db_ids) in answer_mappings.items():
+            if stage == 'first_word':
+                self.drug_dictionary[answer] = db_ids
 
-            # otherwise add it to the unmapped list
+        # answers mapped by first name go to the first name mapped list the first time they appear
+        # and to the mapped list afterwards, once they have been added to the drug dictionary
+        self.mapped_survey_answers = []
+        self.first_name_mapped_survey_answers = []
+        self.unmapped_survey_answers = []
+        for answer, first_occurrence in zip(self.meds_cleaned, ~self.meds_cleaned.duplicated()):
+            stage = answer_mappings[answer][0]
+            if stage == 'exact' or (stage == 'first_word' and not first_occurrence):
+                self.mapped_survey_answers.append(answer)
+            elif stage == 'first_word':
+                self.first_name_mapped_survey_answers.append(answer)
             else:
                 self.unmapped_survey_answers.append(answer)
-                mapped_db_ids = set()
-            # for each of the drugbank ids, update the frequency dictionary
-            for db_id in mapped_db_ids:
-                self.drug_frequencies[db_id] += 1
 
-        ## use metaphone to map phonetic encodings to drugbank ids in the drug dictionaries ##
+        # for each of the drugbank ids of mapped answers, update the frequency dictionary
+        for answer, count in self.meds_cleaned.value_counts().items():
+            stage, db_ids = answer_mappings[answer]
+            if stage in ('exact', 'first_word'):
+                for db_id in db_ids:
+                    self.drug_frequencies[db_id] += count
 
-        mp = Metaphone()
-        # dictionary for storing encodings mapped to drugbank ids
-        encoded_drug_dict = {}
-        # list for ambigious encodings (distinct phonetically-identical drugs) - these will be removed from the dictionary
-        ambiguous_encodings = []
+        ## use metaphone to map phonetic encodings to drugbank ids in the drug dictionaries ##
 
-        # loop through the drug dictionary and encode every entry, saving the corresponding drugbank ids under the encoding
-        for drug in self.drug_dictionary:
+        # answers left for the phonetic encoding (which is not cached, as it depends on the first word mappings of this run)
+        unresolved_answers = [answer for answer, (stage, _) in new_answer_mappings.items() if stage == 'unmapped']
 
-            # save the encoding for each drug
-            encoding = mp.encode(drug)
+        if unresolved_answers:
 
-            # if the encoding is not in the encoding dictionary, add it
-            if encoding not in encoded_drug_dict:
-                encoded_drug_dict[encoding] = self.drug_dictionary[drug]
+            # add the answers mapped by their first name, which are not in the prebuilt index
+            phonetic_index = self.phonetic_index.copy()
+            for answer, (stage, db_ids) in answer_mappings.items():
+                if stage == 'first_word':
+                    phonetic_index.add(answer, db_ids)
 
-            # if the encoding is already in the dictionary and there exists different ids for the same encoding, save it
-            elif self.drug_dictionary[drug] != encoded_drug_dict[encoding]:
-                ambiguous_encodings.append(encoding)
+            # save the drugbank ids of answers whose encodings are valid
+            for answer in unresolved_answers:
+                encoded_db_ids = phonetic_index.get(phonetic_index.encode(answer))
+                if encoded_db_ids:
+                    new_answer_mappings[answer] = ('encoding', encoded_db_ids)
+                    answer_mappings[answer] = new_answer_mappings[answer]
 
-        # filter for encodings with only one match in the drugbank
-        encoded_drug_dict = {key: val for key, val in encoded_drug_dict.items() if key not in ambiguous_encodings}
+        # add answers mapped by encoding to the drug dictionary under the encoding's drugbank ids
+        for answer, (stage, db_ids) in answer_mappings.items():
+            if stage == 'encoding':
+                self.drug_dictionary[answer] = db_ids
 
-        # get survey answers whose encodings are valid
-        self.mapped_by_encoding = [answer for answer in self.unmapped_survey_answers if mp.encode(answer) in encoded_drug_dict]
-        # add answers to the drug dictionary under the encoding's drugbank ids
-        for answer in self.mapped_by_encoding:
-            self.drug_dictionary[answer] = encoded_drug_dict[mp.encode(answer)]
+        # get survey answers mapped by encoding, and those still unmapped
+        self.mapped_by_encoding = [answer for answer in self.unmapped_survey_answers if answer_mappings[answer][0] == 'encoding']
+        self.unmapped_by_encoding = [answer for answer in self.unmapped_survey_answers if answer_mappings[answer][0] == 'unmapped']
 
-        # list for drugs still unmapped by phonetic encoding
-        self.unmapped_by_encoding = [answer for answer in self.unmapped_survey_answers if answer not in self.mapped_by_encoding]
+        # save the newly resolved answers for future runs
+        if cache is not None:
+            cache.update(new_answer_mappings)
 
     def update_drug_dictionary(self, manual_corrections_filepath):
 
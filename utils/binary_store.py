@@ -0,0 +1,64 @@
+import os
+import json
+import struct
+import numpy as np
+
+# magic bytes at the start of every binary store file, followed by the length of the json header
+MAGIC = b'COVSTORE'
+HEADER_FORMAT = '<8sQ'
+ALIGNMENT = 8
+
+# function for writing a dictionary of named numpy arrays (and json-serialisable metadata) to a single binary file
+def write_arrays(filepath, arrays, metadata = None):
+    '''
+    The file consists of a fixed-size prefix, a json header describing the dtype, shape and byte offset of each array,
+    then the raw array data, each array aligned to 8 bytes so it can be memory-mapped in place by read_arrays().
+    '''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # lay out the arrays after the header, which is padded so the data section starts on an aligned offset
+    array_info = {}
+    offset = 0
+    for name, array in arrays.items():
+        array_info[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header = json.dumps({'metadata': metadata or {}, 'arrays': array_info}).encode('utf-8')
+    data_start = struct.calcsize(HEADER_FORMAT) + len(header)
+    header += b' ' * (-data_start % ALIGNMENT)
+
+    with open(filepath, 'wb') as file:
+        file.write(struct.pack(HEADER_FORMAT, MAGIC, len(header)))
+        file.write(header)
+        for name, array in arrays.items():
+            file.write(array.tobytes())
+            file.write(b'\0' * (-array.nbytes % ALIGNMENT))
+
+# function for reading the metadata and memory-mapped arrays from a file written by write_arrays()
+def read_arrays(filepath):
+    with open(filepath, 'rb') as file:
+        magic, header_length = struct.unpack(HEADER_FORMAT, file.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC:
+            raise ValueError('{} is not a binary store file'.format(filepath))
+        header = json.loads(file.read(header_length).decode('utf-8'))
+
+    data_start = struct.calcsize(HEADER_FORMAT) + header_length
+    arrays = {}
+    for name, info in header['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        # np.memmap cannot map zero-length arrays
+        if np.prod(shape, dtype = np.int64) == 0:
+            arrays[name] = np.empty(shape, dtype = dtype)
+        else:
+            arrays[name] = np.memmap(filepath, dtype = dtype, mode = 'r', offset = data_start + info['offset'], shape = shape)
+
+    return header['metadata'], arrays
+
+# function for replacing the metadata of a file written by write_arrays(), keeping its arrays
+def update_metadata(filepath, metadata):
+    _, arrays = read_arrays(filepath)
+    # the arrays are memory-mapped from the old file, so the new file is written alongside it and moved into place
+    temp_filepath = filepath + '.tmp'
+    write_arrays(temp_filepath, arrays, metadata)
+    os.replace(temp_filepath, filepath)
@@ -0,0 +1,222 @@
+import os
+import pickle
+import re
+from collections.abc import MutableMapping
+from copy import copy
+import numpy as np
+
+from utils.binary_store import write_arrays, read_arrays, update_metadata
+from utils.mapping_cache import hash_files
+
+# function for encoding a list of strings as a single utf-8 byte array with offsets
+def encode_strings(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(string) for string in encoded])
+    return np.frombuffer(b''.join(encoded), dtype = np.uint8), offsets
+
+# class for reading a compiled drug dictionary, which acts as a dictionary of aliases mapped to sets of drugbank ids
+class CompiledDrugDictionary(MutableMapping):
+
+    # initialise with the path to a compiled drug dictionary file
+    def __init__(self, filepath):
+        '''
+        The compiled file stores the aliases as a sorted string table (along with their original order), the drugbank ids
+        as integer codes into a table of id names, and each distinct set of ids once, as a slice of the code array (CSR
+        offsets) - aliases with the same ids (e.g. brand names of one compound) point to the same set.
+        All arrays are memory-mapped, so loading is immediate and only the pages needed for lookups are read (and shared
+        between processes).
+
+        Aliases added or changed after loading (e.g. by AnswerMapper) are kept in memory and never written to the file.
+        '''
+        self.filepath = filepath
+        self.metadata, arrays = read_arrays(filepath)
+        self.alias_data = arrays['alias_data']
+        self.alias_offsets = arrays['alias_offsets']
+        self.alias_order = arrays['alias_order']
+        self.alias_sets = arrays['alias_sets']
+        self.id_codes = arrays['id_codes']
+        self.id_offsets = arrays['id_offsets']
+        self.db_ids = [bytes(name).decode('utf-8') for name in np.split(arrays['db_id_data'], arrays['db_id_offsets'][1:-1])] \
+            if len(arrays['db_id_offsets']) > 1 else []
+        self.n_compiled = len(self.alias_offsets) - 1
+
+        # in-memory changes on top of the compiled aliases, and the number of compiled aliases they hide
+        # (compiled aliases that were removed or replaced)
+        self._added = {}
+        self._removed = set()
+        self._n_hidden = 0
+
+    # function for writing a drug dictionary to a compiled file
+    @staticmethod
+    def compile(drug_dictionary, filepath, dictionary_hash = None, dictionary_source = None):
+
+        # aliases are sorted by their utf-8 bytes so they can be binary searched without decoding the whole table
+        aliases = sorted(drug_dictionary, key = lambda alias: alias.encode('utf-8'))
+        # positions of the sorted aliases in the original order, so iteration matches the source dictionary
+        alias_positions = {alias: i for i, alias in enumerate(aliases)}
+        alias_order = np.array([alias_positions[alias] for alias in drug_dictionary], dtype = np.int64)
+        db_ids = sorted(set().union(*drug_dictionary.values()))
+        db_id_codes = {db_id: i for i, db_id in enumerate(db_ids)}
+
+        alias_data, alias_offsets = encode_strings(aliases)
+        db_id_data, db_id_offsets = encode_strings(db_ids)
+
+        # each distinct set of ids is stored once, as sorted integer codes
+        set_codes = {}
+        for alias in aliases:
+            set_codes.setdefault(frozenset(drug_dictionary[alias]), len(set_codes))
+        alias_sets = np.array([set_codes[frozenset(drug_dictionary[alias])] for alias in aliases], dtype = np.int32)
+        id_codes = np.array([db_id_codes[db_id] for ids in set_codes for db_id in sorted(ids)], dtype = np.int32)
+        id_offsets = np.zeros(len(set_codes) + 1, dtype = np.int64)
+        id_offsets[1:] = np.cumsum([len(ids) for ids in set_codes])
+
+        write_arrays(filepath, {'alias_data': alias_data, 'alias_offsets': alias_offsets, 'alias_order': alias_order,
+                                'alias_sets': alias_sets, 'id_codes': id_codes, 'id_offsets': id_offsets,
+                                'db_id_data': db_id_data, 'db_id_offsets': db_id_offsets},
+                     metadata = {'dictionary_hash': dictionary_hash, 'dictionary_source': dictionary_source})
+
+    # function for copying the dictionary, sharing the memory-mapped arrays but not the in-memory changes
+    def copy(self):
+        drug_dictionary = copy(self)
+        drug_dictionary._added = dict(self._added)
+        drug_dictionary._removed = set(self._removed)
+        drug_dictionary._n_hidden = self._n_hidden
+        return drug_dictionary
+
+    # function for getting the in-memory changes on top of the compiled aliases, as (added aliases, removed aliases)
+    def get_changes(self):
+        return dict(self._added), set(self._removed)
+
+    # function for replacing the in-memory changes with changes returned by get_changes()
+    def set_changes(self, added, removed):
+        self._added = dict(added)
+        self._removed = set(removed)
+        self._n_hidden = len(self._hidden_positions())
+
+    # function for getting the positions in the compiled alias table of the compiled aliases hidden by in-memory changes
+    def _hidden_positions(self):
+        positions = (self._find(alias) for alias in set(self._added) | self._removed)
+        return [i for i in positions if i >= 0]
+
+    # function for getting the set of all drugbank ids in the dictionary, taken from the compiled id table rather than
+    # by looking up every alias
+    def all_db_ids(self):
+        # sets of ids still used by a compiled alias
+        visible = np.ones(self.n_compiled, dtype = bool)
+        visible[self._hidden_positions()] = False
+        used_sets = np.zeros(len(self.id_offsets) - 1, dtype = bool)
+        used_sets[self.alias_sets[visible]] = True
+        # the set of each position of the id code array
+        code_sets = np.repeat(np.arange(len(used_sets)), np.diff(self.id_offsets))
+        used_codes = np.unique(self.id_codes[used_sets[code_sets]])
+        return {self.db_ids[code] for code in used_codes}.union(*self._added.values())
+
+    # function for getting the encoded alias at a position in the compiled alias table
+    def _alias_bytes(self, i):
+        return self.alias_data[self.alias_offsets[i]:self.alias_offsets[i+1]].tobytes()
+
+    # function for finding the position of an alias in the compiled alias table, returning -1 if it is missing
+    def _find(self, alias):
+        if not isinstance(alias, str):
+            return -1
+        target = alias.encode('utf-8')
+        low, high = 0, self.n_compiled
+        while low < high:
+            mid = (low + high) // 2
+            if self._alias_bytes(mid) < target:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.n_compiled and self._alias_bytes(low) == target:
+            return low
+        return -1
+
+    def __getitem__(self, alias):
+        if alias in self._added:
+            return self._added[alias]
+        if alias not in self._removed:
+            i = self._find(alias)
+            if i >= 0:
+                j = self.alias_sets[i]
+                return {self.db_ids[code] for code in self.id_codes[self.id_offsets[j]:self.id_offsets[j+1]]}
+        raise KeyError(alias)
+
+    def __setitem__(self, alias, db_ids):
+        if alias not in self._added and alias not in self._removed and self._find(alias) >= 0:
+            self._n_hidden += 1
+        self._added[alias] = db_ids
+        self._removed.discard(alias)
+
+    def __delitem__(self, alias):
+        if alias in self._added:
+            del self._added[alias]
+            # a replaced compiled alias stays hidden
+            if self._find(alias) >= 0:
+                self._removed.add(alias)
+        elif alias in self._removed or self._find(alias) < 0:
+            raise KeyError(alias)
+        else:
+            self._removed.add(alias)
+            self._n_hidden += 1
+
+    def __contains__(self, alias):
+        if alias in self._added:
+            return True
+        return alias not in self._removed and self._find(alias) >= 0
+
+    def __iter__(self):
+        for i in self.alias_order:
+            alias = self._alias_bytes(i).decode('utf-8')
+            if alias not in self._added and alias not in self._removed:
+                yield alias
+        yield from self._added
+
+    def __len__(self):
+        return self.n_compiled - self._n_hidden + len(self._added)
+
+# function for getting the path of the compiled drug dictionary stored next to a drug dictionary pickle
+def get_compiled_dictionary_filepath(drug_dict_filepath):
+    return re.sub('\.p$', '', drug_dict_filepath) + '.bin'
+
+# function for getting the size and modification time of a drug dictionary pickle, to check whether it has changed
+# without hashing it
+def get_dictionary_source(drug_dict_filepath):
+    stat = os.stat(drug_dict_filepath)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+# function for compiling a drug dictionary pickle and saving it next to the pickle
+def build_compiled_dictionary(drug_dict_filepath, drug_dictionary = None):
+    if drug_dictionary is None:
+        with open(drug_dict_filepath, 'rb') as file:
+            drug_dictionary = pickle.load(file)
+    compiled_filepath = get_compiled_dictionary_filepath(drug_dict_filepath)
+    CompiledDrugDictionary.compile(drug_dictionary, compiled_filepath, hash_files(drug_dict_filepath),
+                                   get_dictionary_source(drug_dict_filepath))
+    return CompiledDrugDictionary(compiled_filepath)
+
+# function for loading the compiled version of a drug dictionary pickle, recompiling it if it is missing or out of date
+def load_drug_dictionary(drug_dict_filepath):
+
+    compiled_filepath = get_compiled_dictionary_filepath(drug_dict_filepath)
+
+    if os.path.exists(compiled_filepath):
+        drug_dictionary = CompiledDrugDictionary(compiled_filepath)
+        # the compiled file is used on its own if the pickle is not available
+        if not os.path.exists(drug_dict_filepath):
+            return drug_dictionary
+        # the pickle is only hashed if its size or modification time has changed since it was compiled
+        dictionary_source = get_dictionary_source(drug_dict_filepath)
+        if drug_dictionary.metadata.get('dictionary_source') == dictionary_source:
+            return drug_dictionary
+        if drug_dictionary.metadata['dictionary_hash'] == hash_files(drug_dict_filepath):
+            # the pickle was touched but not changed, so the compiled file is kept with the new size and time
+            update_metadata(compiled_filepath, dict(drug_dictionary.metadata, dictionary_source = dictionary_source))
+            return CompiledDrugDictionary(compiled_filepath)
+
+    return build_compiled_dictionary(drug_dict_filepath)
+
+# function for getting the hash of a drug dictionary pickle, which is stored in its compiled file so the pickle is only
+# hashed again when it changes (and the stored hash is used if the pickle is not available)
+def get_dictionary_hash(drug_dict_filepath):
+    return load_drug_dictionary(drug_dict_filepath).metadata['dictionary_hash']
@@ -0,0 +1,60 @@
+# class for finding all terms within a small edit distance of a query, using a symmetric deletion index
+class DeletionIndex:
+
+    # initialise with an iterable of terms (e.g. drug dictionary aliases) and the maximum distance to support
+    def __init__(self, terms, max_distance = 1, prefix_length = 7):
+        '''
+        Every term is indexed under all strings obtained by deleting up to max_distance characters from its prefix.
+        Two strings within an edit distance of d share at least one such deletion, so a query only needs to generate
+        its own deletions and look them up to find every candidate, instead of comparing against every term.
+
+        Only the first prefix_length characters of each term are used to generate deletions, which keeps the index small
+        for long aliases - the candidates are always verified with the full optimal string alignment distance.
+        '''
+        from abydos.distance import Levenshtein
+        self.terms = list(terms)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.lv = Levenshtein(mode = 'osa')
+
+        # dictionary of deletion strings mapped to the positions of the terms they were generated from
+        self.deletions = {}
+        for i, term in enumerate(self.terms):
+            for deletion in DeletionIndex.get_deletions(term[:prefix_length], max_distance):
+                self.deletions.setdefault(deletion, []).append(i)
+
+    # function for getting all strings formed by deleting up to max_distance characters from a string
+    @staticmethod
+    def get_deletions(string, max_distance):
+        deletions = {string}
+        current_deletions = {string}
+        for _ in range(max_distance):
+            current_deletions = {deletion[:i] + deletion[i+1:] for deletion in current_deletions for i in range(len(deletion))}
+            deletions.update(current_deletions)
+        return deletions
+
+    # function for getting the terms within max_distance of a query as a list of (term, distance) tuples
+    # terms are returned in the order they were provided to the index
+    def search(self, query, max_distance = None):
+
+        if max_distance is None:
+            max_distance = self.max_distance
+        elif max_distance > self.max_distance:
+            raise ValueError('Index was built for a maximum distance of {}'.format(self.max_distance))
+
+        # collect candidate terms that share a deletion with the query
+        candidates = set()
+        for deletion in DeletionIndex.get_deletions(query[:self.prefix_length], max_distance):
+            candidates.update(self.deletions.get(deletion, []))
+
+        # verify candidates with the full distance, skipping any whose length rules them out
+        matches = []
+        for i in sorted(candidates):
+            term = self.terms[i]
+            if abs(len(term) - len(query)) > max_distance:
+                continue
+            distance = self.lv.dist_abs(query, term)
+            if distance <= max_distance:
+                matches.append((term, distance))
+
+        return matches
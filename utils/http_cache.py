@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+# function for writing a file in a single step, so an interrupted write never leaves a partial file
+def write_atomic(filepath, data):
+    temp_filepath = '{}.{}.tmp'.format(filepath, threading.get_ident())
+    with open(temp_filepath, 'wb') as file:
+        file.write(data)
+    os.replace(temp_filepath, filepath)
+
+# class for limiting the rate of requests shared by several threads
+class RateLimiter:
+
+    def __init__(self, requests_per_second):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    # function for blocking until the next request is allowed
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+# class for fetching web pages concurrently, with a rate limit shared by all threads
+class Fetcher:
+
+    # initialise with the number of concurrent requests and the maximum request rate (0 for no limit)
+    def __init__(self, max_workers = 8, requests_per_second = 5, retries = 3, user_agent = 'Mozilla/5.0'):
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.retries = retries
+        self.user_agent = user_agent
+
+    # function for sending a request, retrying failures that may be temporary (connection errors, 429 and 5xx responses)
+    def request(self, url, headers = None):
+        headers = dict(headers or {}, **{'User-Agent': self.user_agent})
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            try:
+                with urlopen(Request(url, headers = headers)) as response:
+                    return response.status, response.read(), response.headers
+            except HTTPError as error:
+                # a conditional request for an unchanged page is answered with 304
+                if error.code == 304:
+                    return error.code, None, error.headers
+                if (error.code != 429 and error.code < 500) or attempt == self.retries:
+                    raise
+            except URLError:
+                if attempt == self.retries:
+                    raise
+            time.sleep(2 ** attempt)
+
+    # function for getting the body of a url
+    def fetch(self, url):
+        return self.request(url)[1]
+
+    # function for applying a function to each item of a list with a pool of threads, returning the results in order
+    def map(self, func, items):
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            return list(executor.map(func, items))
+
+    # function for applying a function to each item of a list with a pool of threads, yielding (item, result) pairs
+    # as the results arrive, so they can be saved before the slowest items finish
+    def map_as_completed(self, func, items):
+        with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+            futures = {executor.submit(func, item): item for item in items}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            # if the caller stops (e.g. on an error), the items that have not started are not run
+            finally:
+                for future in futures:
+                    future.cancel()
+
+# class for fetching web pages concurrently, with a rate limit and an on-disk response cache
+class CachedFetcher(Fetcher):
+
+    # initialise with the directory for cached responses, the number of concurrent requests and the maximum request rate
+    def __init__(self, cache_dir, max_workers = 8, requests_per_second = 5, max_age = 86400, retries = 3,
+                 user_agent = 'Mozilla/5.0'):
+        '''
+        Each response is saved in the cache directory along with its ETag and Last-Modified headers. Cached responses
+        younger than max_age seconds are used without a request; older ones are revalidated with a conditional request,
+        and only downloaded again if the server reports that they changed. With max_age = None, the cache is always used.
+
+        Failed requests (connection errors, 429 and 5xx responses) are retried with exponential backoff.
+        '''
+        super().__init__(max_workers, requests_per_second, retries, user_agent)
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok = True)
+
+    # function for getting the paths of the cached body and metadata of a url
+    def get_cache_filepaths(self, url):
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, url_hash + '.body'), os.path.join(self.cache_dir, url_hash + '.json')
+
+    # function for reading the cached body and metadata of a url, returning (None, None) if it is not cached
+    def read_cache(self, url):
+        body_filepath, metadata_filepath = self.get_cache_filepaths(url)
+        if not (os.path.exists(body_filepath) and os.path.exists(metadata_filepath)):
+            return None, None
+        with open(metadata_filepath) as file:
+            metadata = json.load(file)
+        with open(body_filepath, 'rb') as file:
+            body = file.read()
+        return body, metadata
+
+    def write_cache(self, url, body, metadata):
+        body_filepath, metadata_filepath = self.get_cache_filepaths(url)
+        write_atomic(body_filepath, body)
+        write_atomic(metadata_filepath, json.dumps(metadata).encode('utf-8'))
+
+    # function for getting the body of a url, from the cache if it is fresh or unchanged
+    def fetch(self, url):
+        return self.fetch_with_status(url)[0]
+
+    # function for getting the body of a url along with whether it changed since it was cached
+    # (pages that were not cached before count as changed)
+    def fetch_with_status(self, url):
+
+        body, metadata = self.read_cache(url)
+        if body is not None and (self.max_age is None or time.time() - metadata['fetched'] < self.max_age):
+            return body, False
+
+        # revalidate the cached response if there is one
+        headers = {}
+        if metadata is not None:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+
+        status, new_body, response_headers = self.request(url, headers)
+        # servers without validators send the whole page again, so the body is compared as well
+        changed = status != 304 and new_body != body
+        if status != 304:
+            body = new_body
+            metadata = {'etag': response_headers.get('ETag'), 'last_modified': response_headers.get('Last-Modified')}
+        metadata['fetched'] = time.time()
+        self.write_cache(url, body, metadata)
+
+        return body, changed
+
+# class for saving the results of a long-running job as they are produced, so an interrupted job can be resumed
+class Checkpoint:
+
+    # initialise with the path to the checkpoint file, saving it after every save_every new results
+    def __init__(self, filepath, save_every = 50):
+        self.filepath = filepath
+        self.save_every = save_every
+        self.lock = threading.RLock()
+        self.n_unsaved = 0
+        if os.path.exists(filepath):
+            with open(filepath) as file:
+                self.results = json.load(file)
+        else:
+            self.results = {}
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def get(self, key, default = None):
+        return self.results.get(key, default)
+
+    # function for adding a result, which must be json-serialisable
+    def set(self, key, value):
+        with self.lock:
+            self.results[key] = value
+            self.n_unsaved += 1
+            if self.n_unsaved >= self.save_every:
+                self.save()
+
+    def save(self):
+        with self.lock:
+            write_atomic(self.filepath, json.dumps(self.results).encode('utf-8'))
+            self.n_unsaved = 0
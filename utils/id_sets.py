@@ -0,0 +1,85 @@
+import numpy as np
+
+# class for interning drugbank ids as integers and storing each distinct set of ids once, as a bitset
+class IDSetTable:
+
+    # initialise with an optional iterable of drugbank ids to intern up front
+    def __init__(self, db_ids = ()):
+        '''
+        Each drugbank id is given a dense integer code (its bit position), and each distinct set of ids is stored once
+        as a row of a packed bitset matrix (sets x 64-bit words). Answers and aliases that share a set of ids share a
+        single row, and subset, equality and intersection tests of a query against every stored set are vectorised
+        bitwise operations on the matrix.
+        '''
+        self.db_ids = []
+        self.db_id_codes = {}
+        # sorted integer codes of each distinct set, and the index of each set keyed by its ids
+        self.sets = []
+        self.set_codes = {}
+        self._bits = None
+
+        for db_id in db_ids:
+            self.intern_id(db_id)
+
+    # function for getting the integer code of a drugbank id, assigning a new code if it has not been seen before
+    def intern_id(self, db_id):
+        code = self.db_id_codes.get(db_id)
+        if code is None:
+            code = self.db_id_codes[db_id] = len(self.db_ids)
+            self.db_ids.append(db_id)
+        return code
+
+    # function for getting the index of a set of drugbank ids, adding it to the table if it has not been seen before
+    def intern(self, db_ids):
+        key = frozenset(db_ids)
+        code = self.set_codes.get(key)
+        if code is None:
+            code = self.set_codes[key] = len(self.sets)
+            self.sets.append(np.array(sorted(self.intern_id(db_id) for db_id in key), dtype = np.int64))
+            self._bits = None
+        return code
+
+    # function for packing integer codes into a bitset of n_words 64-bit words
+    @staticmethod
+    def pack(codes, n_words):
+        codes = np.asarray(codes, dtype = np.int64)
+        bits = np.zeros(n_words, dtype = np.uint64)
+        np.bitwise_or.at(bits, codes // 64, np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+        return bits
+
+    # matrix of sets x 64-bit words, rebuilt after new sets are added
+    @property
+    def bits(self):
+        if self._bits is None:
+            n_words = max(1, -(-len(self.db_ids) // 64))
+            self._bits = np.zeros((len(self.sets), n_words), dtype = np.uint64)
+            for i, codes in enumerate(self.sets):
+                self._bits[i] = IDSetTable.pack(codes, n_words)
+        return self._bits
+
+    # function for getting the bitset of a query set of drugbank ids, returning None if it has an id missing from the table
+    def query_bits(self, db_ids):
+        codes = [self.db_id_codes.get(db_id) for db_id in db_ids]
+        if any(code is None for code in codes):
+            return None
+        return IDSetTable.pack(codes, self.bits.shape[1])
+
+    # function for getting a boolean mask of the stored sets that contain every id in a query
+    def contains(self, db_ids):
+        query = self.query_bits(db_ids)
+        if query is None:
+            return np.zeros(len(self.sets), dtype = bool)
+        return ((self.bits & query) == query).all(axis = 1)
+
+    # function for getting a boolean mask of the stored sets that are equal to a query
+    def equals(self, db_ids):
+        query = self.query_bits(db_ids)
+        if query is None:
+            return np.zeros(len(self.sets), dtype = bool)
+        return (self.bits == query).all(axis = 1)
+
+    # function for getting a boolean mask of the stored sets that share at least one id with a query
+    def intersects(self, db_ids):
+        # ids missing from the table cannot be shared with any set, so they are ignored
+        query = self.query_bits([db_id for db_id in db_ids if db_id in self.db_id_codes])
+        return (self.bits & query).any(axis = 1)
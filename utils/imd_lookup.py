@@ -0,0 +1,112 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from utils.binary_store import write_arrays, read_arrays
+from utils.mapping_cache import hash_files
+
+# sheets of the IMD spreadsheet, with the country and the postcode, IMD rank and IMD decile columns of each
+IMD_SHEETS = {'english_postcode_IMDs': ('England', 'Postcode', 'Index of Multiple Deprivation Rank',
+                                        'Index of Multiple Deprivation Decile'),
+              'scottish_postcode_IMDs': ('Scotland', 'Postcode', 'SIMD2020v2_Rank', 'SIMD2020v2_Decile'),
+              'welsh_postcode_IMDs': ('Wales', 'Welsh Postcode ', 'WIMD 2019 LSOA Rank', 'WIMD 2019 Overall Decile')}
+
+# function for getting the keys of postcodes in the IMD lookup (uppercase utf-8 bytes) - postcodes without a space
+# (as in the welsh sheet) have one inserted before the inward code, i.e. the last three characters
+def get_imd_keys(postcodes):
+    postcodes = pd.Series(postcodes, dtype = object)
+    keys = postcodes.where(postcodes.notna(), '').astype(str).str.strip().str.upper()
+    keys = keys.where(keys.str.contains(' ') | (keys.str.len() < 5), keys.str[:-3] + ' ' + keys.str[-3:])
+    return keys.str.encode('utf-8').to_numpy()
+
+# class for reading a compiled IMD lookup, which maps postcodes of all countries in the IMD spreadsheet to IMD ranks and deciles
+class IMDLookup:
+
+    # initialise with the path to a compiled IMD lookup file
+    def __init__(self, filepath):
+        '''
+        The compiled file stores the postcodes of all sheets as one sorted array of fixed-width keys, with a space added
+        to the welsh postcodes (which are listed without one) so all countries are looked up the same way, along with
+        the country code, IMD rank (-1 if missing) and IMD decile of each postcode.
+        '''
+        self.filepath = filepath
+        self.metadata, arrays = read_arrays(filepath)
+        self.keys = arrays['keys']
+        self.country_codes = arrays['country_codes']
+        self.ranks = arrays['ranks']
+        self.deciles = arrays['deciles']
+        self.countries = np.array(self.metadata['countries'], dtype = object)
+
+    # function for writing the sheets of the IMD spreadsheet (a dictionary of sheet names mapped to data frames) to a compiled file
+    @staticmethod
+    def compile(imd_sheets, filepath, spreadsheet_hash = None):
+
+        # standardise the columns of each sheet
+        country_imds = []
+        for sheet_name, (country, postcode_col, imd_rank_col, imd_decile_col) in IMD_SHEETS.items():
+            sheet = imd_sheets[sheet_name]
+            country_imds.append(pd.DataFrame({'key': get_imd_keys(sheet[postcode_col]),
+                                              'country': country,
+                                              'IMD rank': pd.to_numeric(sheet[imd_rank_col]).fillna(-1).astype(np.int64),
+                                              'IMD decile': pd.to_numeric(sheet[imd_decile_col]).astype(np.float64)}))
+        imds = pd.concat(country_imds, ignore_index = True)
+
+        # postcodes listed more than once keep their first entry
+        imds = imds[~imds['key'].duplicated()]
+        keys = imds['key'].to_numpy().astype(bytes)
+        order = np.argsort(keys, kind = 'stable')
+        countries = [country for country, *_ in IMD_SHEETS.values()]
+
+        write_arrays(filepath, {'keys': keys[order],
+                                'country_codes': imds['country'].map({country: i for i, country in enumerate(countries)}).to_numpy(np.int8)[order],
+                                'ranks': imds['IMD rank'].to_numpy()[order], 'deciles': imds['IMD decile'].to_numpy()[order]},
+                     metadata = {'countries': countries, 'spreadsheet_hash': spreadsheet_hash})
+
+    # function for getting the IMD ranks and deciles of postcodes, as a data frame with Postcode, IMD rank and IMD decile
+    # columns (with the index of the postcodes if they are a series) - postcodes missing from the lookup have missing values
+    def get_imds(self, postcodes):
+
+        postcodes = pd.Series(postcodes, dtype = object)
+        keys = get_imd_keys(postcodes)
+        # keys longer than the stored keys cannot match (and would be truncated by the fixed-width conversion)
+        too_long = np.array([len(key) > self.keys.dtype.itemsize for key in keys], dtype = bool)
+        keys = np.where(too_long, b'', keys).astype(self.keys.dtype)
+
+        positions = np.searchsorted(self.keys, keys)
+        found = ~too_long & postcodes.notna().to_numpy() & (positions < len(self.keys))
+        found[found] = self.keys[positions[found]] == keys[found]
+
+        ranks = np.full(len(keys), -1, dtype = np.int64)
+        ranks[found] = self.ranks[positions[found]]
+        deciles = np.full(len(keys), np.nan)
+        deciles[found] = self.deciles[positions[found]]
+        return pd.DataFrame({'Postcode': postcodes,
+                             'IMD rank': pd.Series(ranks, index = postcodes.index).astype('Int64').where(ranks >= 0),
+                             'IMD decile': deciles}, index = postcodes.index)
+
+# function for getting the path of the compiled IMD lookup stored next to the IMD spreadsheet
+def get_imd_lookup_filepath(imd_spreadsheet_filepath):
+    return re.sub('\.xlsx$', '', imd_spreadsheet_filepath) + '.bin'
+
+# function for compiling the IMD spreadsheet and saving it next to the spreadsheet
+def build_imd_lookup(imd_spreadsheet_filepath):
+    # all sheets are read in a single pass over the spreadsheet
+    imd_sheets = pd.read_excel(imd_spreadsheet_filepath, sheet_name = list(IMD_SHEETS))
+    lookup_filepath = get_imd_lookup_filepath(imd_spreadsheet_filepath)
+    IMDLookup.compile(imd_sheets, lookup_filepath, hash_files(imd_spreadsheet_filepath))
+    return IMDLookup(lookup_filepath)
+
+# function for loading the compiled IMD lookup, recompiling it if it is missing or the spreadsheet has changed
+def load_imd_lookup(imd_spreadsheet_filepath):
+
+    lookup_filepath = get_imd_lookup_filepath(imd_spreadsheet_filepath)
+
+    if os.path.exists(lookup_filepath):
+        imd_lookup = IMDLookup(lookup_filepath)
+        # the compiled file can be used on its own if the spreadsheet is not available
+        if not os.path.exists(imd_spreadsheet_filepath) or \
+                imd_lookup.metadata['spreadsheet_hash'] == hash_files(imd_spreadsheet_filepath):
+            return imd_lookup
+
+    return build_imd_lookup(imd_spreadsheet_filepath)
@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from utils.mapping_cache import hash_files
+
+# function for getting the key of the settings of an incremental run, from the data files and options it depends on
+def get_state_key(filepaths, options):
+    return ':'.join([hash_files(*filepaths)] + [str(option) for option in options])
+
+# function for getting a fingerprint of the answers of each respondent, as a series indexed by respondent id
+def fingerprint_respondents(mapper, id_column):
+    '''
+    Each answer is hashed from its slot, cleaned medication answer, the drugbank ids the answer maps to, and the dosage,
+    unit and RoA answers, and the hashes of each respondent's answers are summed into a single 64-bit fingerprint.
+    Including the drugbank ids means a respondent is also recomputed when a change to the drug dictionary, the manual
+    corrections or other respondents' answers changes how one of their answers is mapped.
+
+    The mapper should have mapped its answers and applied the manual corrections (i.e. update_drug_dictionary()).
+    Respondents without any medication answers have a fingerprint of 0.
+    '''
+    answer_table = pd.DataFrame({'slot': mapper.answers.index.get_level_values(1),
+                                 'med': mapper.meds_cleaned.to_numpy(),
+                                 'dose': mapper.dosages.to_numpy(),
+                                 'unit': mapper.units.to_numpy(),
+                                 'roa': mapper.RoAs.to_numpy()})
+    answer_table['db_ids'] = ['; '.join(sorted(mapper.drug_dictionary.get(answer) or set()))
+                              for answer in answer_table['med']]
+    answer_hashes = pd.util.hash_pandas_object(answer_table, index = False).to_numpy()
+
+    # sum the hashes of the answers given by each respondent, wrapping around at 2^64
+    respondent_codes, respondents = pd.factorize(mapper.survey_data[id_column])
+    answer_rows = mapper.survey_data.index.get_indexer(mapper.answers.index.get_level_values(0))
+    answer_respondents = respondent_codes[answer_rows]
+    fingerprints = np.zeros(len(respondents), dtype = np.uint64)
+    np.add.at(fingerprints, answer_respondents[answer_respondents >= 0], answer_hashes[answer_respondents >= 0])
+
+    return pd.Series(fingerprints, index = respondents)
+
+# class for storing the state of incremental runs of an annotation script, for one output file
+class IncrementalState:
+
+    # initialise with the path to the sqlite state file, the output file the state describes and a key for its settings
+    def __init__(self, state_filepath, output_filepath, key):
+        '''
+        The state holds the fingerprint of each respondent in the output file, and optionally the reference statistics
+        used to scale dosages. It is only valid for the output file it was saved with and for the same key (e.g. a hash of
+        the BNF classes and the questions used) - if the key changes or the output file is missing, everything is recomputed.
+        '''
+        self.output_filepath = output_filepath
+        self.key = key
+        self.connection = sqlite3.connect(state_filepath)
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outputs (output TEXT PRIMARY KEY, key TEXT NOT NULL, '
+                                    'n_reference INTEGER, n_changed INTEGER)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS fingerprints '
+                                    '(output TEXT, respondent TEXT, fingerprint TEXT, PRIMARY KEY (output, respondent))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS reference_stats (output TEXT, id_set TEXT, '
+                                    'q1 REAL, q3 REAL, mean REAL, std REAL, PRIMARY KEY (output, id_set))')
+
+        stored = self.connection.execute('SELECT key, n_reference, n_changed FROM outputs WHERE output = ?',
+                                         (output_filepath,)).fetchone()
+        self.valid = stored is not None and stored[0] == key and os.path.exists(output_filepath)
+        # number of respondents the reference statistics were taken from, and recomputed since then
+        self.n_reference, self.n_changed = (stored[1], stored[2]) if self.valid else (None, 0)
+
+    # function for getting the stored fingerprints, as a series indexed by respondent id (as a string)
+    def get_fingerprints(self):
+        rows = self.connection.execute('SELECT respondent, fingerprint FROM fingerprints WHERE output = ?',
+                                       (self.output_filepath,)).fetchall() if self.valid else []
+        return pd.Series([fingerprint for _, fingerprint in rows], index = [respondent for respondent, _ in rows], dtype = object)
+
+    # function for comparing fingerprints to the stored state, returning the respondents that are new or changed and
+    # the respondents that are no longer in the survey
+    def get_changes(self, fingerprints):
+        stored_fingerprints = self.get_fingerprints()
+        current_fingerprints = pd.Series(fingerprints.astype(str).to_numpy(), index = fingerprints.index.astype(str))
+        common = current_fingerprints.index.intersection(stored_fingerprints.index)
+        changed_mask = current_fingerprints[common] != stored_fingerprints[common]
+        changed = current_fingerprints.index.difference(stored_fingerprints.index).union(common[changed_mask.to_numpy()])
+        removed = stored_fingerprints.index.difference(current_fingerprints.index)
+        return changed, removed
+
+    # function for getting the stored reference statistics, as a dictionary of id sets mapped to (q1, q3, mean, std)
+    def get_reference_stats(self):
+        if not self.valid or self.n_reference is None:
+            return None
+        rows = self.connection.execute('SELECT id_set, q1, q3, mean, std FROM reference_stats WHERE output = ?',
+                                       (self.output_filepath,))
+        return {id_set: tuple(np.nan if value is None else value for value in stats) for id_set, *stats in rows}
+
+    # function for saving the state after the output file has been written
+    # if reference statistics are provided they replace the stored ones, otherwise n_changed is added to the count of
+    # respondents recomputed since the reference statistics were taken
+    def save(self, fingerprints, reference_stats = None, n_changed = 0):
+
+        if reference_stats is not None:
+            self.n_reference, self.n_changed = len(fingerprints), 0
+        else:
+            self.n_changed += n_changed
+
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                                    (self.output_filepath, self.key, self.n_reference, self.n_changed))
+            self.connection.execute('DELETE FROM fingerprints WHERE output = ?', (self.output_filepath,))
+            self.connection.executemany('INSERT INTO fingerprints VALUES (?, ?, ?)',
+                                        ((self.output_filepath, str(respondent), str(fingerprint))
+                                         for respondent, fingerprint in fingerprints.items()))
+            if reference_stats is not None:
+                self.connection.execute('DELETE FROM reference_stats WHERE output = ?', (self.output_filepath,))
+                self.connection.executemany('INSERT INTO reference_stats VALUES (?, ?, ?, ?, ?, ?)',
+                                            ((self.output_filepath, id_set, *(None if np.isnan(value) else float(value)
+                                                                              for value in stats))
+                                             for id_set, stats in reference_stats.items()))
+        self.valid = True
+
+    def close(self):
+        self.connection.close()
+
+# function for replacing the rows of changed and removed respondents in an output file with newly computed rows
+def patch_output(output_filepath, new_rows, id_column, respondents, changed, removed):
+    '''
+    Rows are matched on the id column (compared as strings), and the patched file keeps the rows in the order of
+    the respondents series (e.g. the id column of the survey). The file is replaced in a single step, so an interrupted
+    run leaves the previous output in place.
+    '''
+    # floats are parsed exactly, so the rows that are kept are written back unchanged
+    existing = pd.read_csv(output_filepath, float_precision = 'round_trip')
+    existing_ids = existing[id_column].astype(str)
+    kept = existing[~existing_ids.isin(changed.union(removed))]
+
+    patched = pd.concat([kept, new_rows], ignore_index = True)
+    respondent_ids = respondents.astype(str).drop_duplicates()
+    order = pd.Series(np.arange(len(respondent_ids)), index = respondent_ids.to_numpy())
+    patched = patched.iloc[np.argsort(order[patched[id_column].astype(str)].to_numpy(), kind = 'stable')]
+
+    temp_filepath = output_filepath + '.tmp'
+    patched.to_csv(temp_filepath, index = False)
+    os.replace(temp_filepath, output_filepath)
+
+    return patched
@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+
+# function for getting a content hash of one or more files
+def hash_files(*filepaths):
+    file_hash = hashlib.sha256()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+# class for storing answer -> drugbank id mappings between runs of AnswerMapper.map_answers()
+class MappingCache:
+
+    # mapping stages whose results are stored
+    cached_stages = ('exact', 'first_word')
+
+    # initialise with the path to the sqlite cache file and the files the mappings depend on
+    def __init__(self, cache_filepath, drug_dictionary_filepath, manual_corrections_filepath):
+        '''
+        Mappings are only valid for the drug dictionary and manual corrections they were generated with,
+        so the cache is keyed by a hash of both and is emptied whenever either of them changes.
+
+        Each cached answer stores the mapping stage that resolved it along with its drugbank ids, so map_answers() can
+        reproduce the side effects of each stage without repeating it. Only the stages that depend on the drug dictionary
+        alone ('exact' and 'first_word') are cached - the phonetic stage also depends on the answers mapped by their
+        first word in the same run, so answers left for it ('encoding' or 'unmapped') are mapped again on every run.
+        '''
+        # the drug dictionary is keyed by the hash stored in its compiled file, so the cache can be used without the pickle
+        from utils.drug_dictionary import get_dictionary_hash
+        self.key = hashlib.sha256(':'.join([get_dictionary_hash(drug_dictionary_filepath),
+                                            hash_files(manual_corrections_filepath)]).encode('utf-8')).hexdigest()
+        self.connection = sqlite3.connect(cache_filepath)
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS cache_key (key TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS answer_mappings '
+                                    '(answer TEXT PRIMARY KEY, stage TEXT NOT NULL, db_ids TEXT NOT NULL)')
+
+            # clear the cache if it was generated with different input files
+            stored_key = self.connection.execute('SELECT key FROM cache_key').fetchone()
+            if stored_key is None or stored_key[0] != self.key:
+                self.connection.execute('DELETE FROM answer_mappings')
+                self.connection.execute('DELETE FROM cache_key')
+                self.connection.execute('INSERT INTO cache_key VALUES (?)', (self.key,))
+
+    # function for getting the cached (stage, drugbank ids) mappings for a collection of answers
+    def get(self, answers):
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS query_answers (answer TEXT PRIMARY KEY)')
+        self.connection.execute('DELETE FROM query_answers')
+        self.connection.executemany('INSERT OR IGNORE INTO query_answers VALUES (?)', ((answer,) for answer in answers))
+        rows = self.connection.execute('SELECT answer_mappings.answer, stage, db_ids FROM answer_mappings '
+                                       'JOIN query_answers ON answer_mappings.answer = query_answers.answer '
+                                       'WHERE stage IN ({})'.format(', '.join('?' * len(self.cached_stages))),
+                                       self.cached_stages)
+        return {answer: (stage, set(db_ids.split('; ')) if db_ids else set()) for answer, stage, db_ids in rows}
+
+    # function for adding a dictionary of answers mapped to (stage, drugbank ids) to the cache, skipping the stages
+    # that are not cached
+    def update(self, answer_mappings):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO answer_mappings VALUES (?, ?, ?)',
+                                        ((answer, stage, '; '.join(sorted(db_ids)))
+                                         for answer, (stage, db_ids) in answer_mappings.items()
+                                         if stage in self.cached_stages))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,96 @@
+import os
+import pickle
+import re
+
+from utils.drug_dictionary import get_dictionary_hash, get_dictionary_source, load_drug_dictionary
+
+# class for looking up drugbank ids by the metaphone encoding of a drug name
+class PhoneticIndex:
+
+    # initialise with a dictionary of encodings mapped to drugbank ids and a set of ambiguous encodings
+    def __init__(self, encodings = None, ambiguous_encodings = None):
+        from abydos.phonetic import Metaphone
+        self.mp = Metaphone()
+        self.encodings = encodings if encodings is not None else {}
+        # encodings shared by drugs with different ids (distinct phonetically-identical drugs) - these are never matched
+        self.ambiguous_encodings = ambiguous_encodings if ambiguous_encodings is not None else set()
+
+    # function for building an index from every entry in a drug dictionary
+    @classmethod
+    def from_drug_dictionary(cls, drug_dictionary):
+        index = cls()
+        for drug, db_ids in drug_dictionary.items():
+            index.add(drug, db_ids)
+        return index
+
+    def encode(self, drug):
+        return self.mp.encode(drug)
+
+    # function for adding a drug name to the index, saving the corresponding drugbank ids under its encoding
+    def add(self, drug, db_ids):
+
+        encoding = self.encode(drug)
+
+        # if the encoding is not in the index, add it
+        if encoding not in self.encodings:
+            self.encodings[encoding] = db_ids
+
+        # if the encoding is already in the index under different ids, it is ambiguous
+        elif db_ids != self.encodings[encoding]:
+            self.ambiguous_encodings.add(encoding)
+
+    # function for getting the drugbank ids for an encoding, returning None if it is missing or ambiguous
+    def get(self, encoding):
+        if encoding in self.ambiguous_encodings:
+            return None
+        return self.encodings.get(encoding)
+
+    # function for copying the index, so a shared index is not modified when adding new names
+    def copy(self):
+        return PhoneticIndex(dict(self.encodings), set(self.ambiguous_encodings))
+
+    def save(self, filepath, dictionary_hash, dictionary_source = None):
+        index_data = {'dictionary_hash': dictionary_hash, 'dictionary_source': dictionary_source,
+                      'encodings': self.encodings, 'ambiguous_encodings': self.ambiguous_encodings}
+        with open(filepath, 'wb') as file:
+            pickle.dump(index_data, file)
+
+# function for getting the path of the phonetic index stored next to a drug dictionary pickle
+def get_phonetic_index_filepath(drug_dict_filepath):
+    return re.sub('\.p$', '', drug_dict_filepath) + '_metaphone.p'
+
+# function for building the phonetic index for a drug dictionary pickle and saving it next to the pickle
+def build_phonetic_index(drug_dict_filepath, drug_dictionary = None):
+    if drug_dictionary is None:
+        # the compiled drug dictionary is used if the pickle is not available
+        if os.path.exists(drug_dict_filepath):
+            with open(drug_dict_filepath, 'rb') as file:
+                drug_dictionary = pickle.load(file)
+        else:
+            drug_dictionary = load_drug_dictionary(drug_dict_filepath)
+    index = PhoneticIndex.from_drug_dictionary(drug_dictionary)
+    dictionary_source = get_dictionary_source(drug_dict_filepath) if os.path.exists(drug_dict_filepath) else None
+    index.save(get_phonetic_index_filepath(drug_dict_filepath), get_dictionary_hash(drug_dict_filepath), dictionary_source)
+    return index
+
+# function for loading the phonetic index of a drug dictionary pickle, rebuilding it if it is missing or out of date
+def load_phonetic_index(drug_dict_filepath):
+
+    index_filepath = get_phonetic_index_filepath(drug_dict_filepath)
+
+    if os.path.exists(index_filepath):
+        with open(index_filepath, 'rb') as file:
+            index_data = pickle.load(file)
+        index = PhoneticIndex(index_data['encodings'], index_data['ambiguous_encodings'])
+        # the dictionary hash is only checked if the size or modification time of the pickle has changed since the
+        # index was built (or the pickle is not available)
+        dictionary_source = get_dictionary_source(drug_dict_filepath) if os.path.exists(drug_dict_filepath) else None
+        if dictionary_source is not None and index_data.get('dictionary_source') == dictionary_source:
+            return index
+        if index_data['dictionary_hash'] == get_dictionary_hash(drug_dict_filepath):
+            # the pickle was touched but not changed, so the index is kept with the new size and time
+            if dictionary_source is not None:
+                index.save(index_filepath, index_data['dictionary_hash'], dictionary_source)
+            return index
+
+    return build_phonetic_index(drug_dict_filepath)
@@ -0,0 +1,72 @@
+import glob
+import hashlib
+import os
+import pickle
+
+from utils.drug_dictionary import get_dictionary_hash
+from utils.mapping_cache import hash_files
+
+# function for getting the key of the mapped answers of a survey, from the files and options the mapping depends on
+def get_mapping_key(survey_filepath, drug_dict_filepath, manual_corrections_filepath, options):
+    # the drug dictionary is keyed by the hash stored in its compiled file, so the pickle is not needed
+    file_hash = hash_files(survey_filepath, manual_corrections_filepath)
+    return hashlib.sha256(':'.join([file_hash, get_dictionary_hash(drug_dict_filepath)] +
+                                   [str(option) for option in options]).encode('utf-8')).hexdigest()
+
+# class for the answers of a survey after they have been imported, cleaned, mapped and corrected - i.e. the parts of an
+# AnswerMapper (after update_drug_dictionary()) used by the annotation scripts - which can be saved and reloaded
+class MappedAnswers:
+
+    def __init__(self, survey_data, meds_cleaned, dosages, units, RoAs, drug_dictionary):
+        self.survey_data = survey_data
+        self.meds_cleaned = meds_cleaned
+        self.dosages = dosages
+        self.units = units
+        self.RoAs = RoAs
+        self.drug_dictionary = drug_dictionary
+
+    @classmethod
+    def from_mapper(cls, mapper):
+        return cls(mapper.survey_data, mapper.meds_cleaned, mapper.dosages, mapper.units, mapper.RoAs, mapper.drug_dictionary)
+
+    # function for saving the mapped answers - only the changes made to the drug dictionary (e.g. aliases added by
+    # map_answers() and the manual corrections) are saved, not the compiled dictionary itself
+    def save(self, filepath):
+        mapped_answers = {'survey_data': self.survey_data, 'meds_cleaned': self.meds_cleaned, 'dosages': self.dosages,
+                          'units': self.units, 'RoAs': self.RoAs, 'drug_dictionary_changes': self.drug_dictionary.get_changes()}
+        temp_filepath = filepath + '.tmp'
+        with open(temp_filepath, 'wb') as file:
+            pickle.dump(mapped_answers, file)
+        os.replace(temp_filepath, filepath)
+
+    # function for loading saved mapped answers, applying the saved changes to a copy of the compiled drug dictionary
+    @classmethod
+    def load(cls, filepath, drug_dictionary):
+        with open(filepath, 'rb') as file:
+            mapped_answers = pickle.load(file)
+        drug_dictionary.set_changes(*mapped_answers.pop('drug_dictionary_changes'))
+        return cls(drug_dictionary = drug_dictionary, **mapped_answers)
+
+# class for storing the mapped answers of the latest run of the pipeline, keyed by the inputs of the mapping
+class PipelineCache:
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def get_filepath(self, key):
+        return os.path.join(self.cache_dir, 'mapped_answers_{}.p'.format(key))
+
+    # function for getting the mapped answers saved with a key, returning None if there are none
+    def get(self, key, drug_dictionary):
+        filepath = self.get_filepath(key)
+        return MappedAnswers.load(filepath, drug_dictionary) if os.path.exists(filepath) else None
+
+    # function for saving mapped answers with a key, removing the answers saved with other keys
+    # (they contain survey answers, so they are not kept once they are out of date)
+    def set(self, key, mapped_answers):
+        filepath = self.get_filepath(key)
+        mapped_answers.save(filepath)
+        for old_filepath in glob.glob(os.path.join(self.cache_dir, 'mapped_answers_*.p')):
+            if old_filepath != filepath:
+                os.remove(old_filepath)
@@ -0,0 +1,62 @@
+import sqlite3
+import pandas as pd
+
+# class for storing the IMD ranks of Northern Irish postcodes between runs of Map_IMD_data.py
+class PostcodeRankCache:
+
+    # initialise with the path to the sqlite cache file and the url of the lookup tool the ranks are pulled from
+    def __init__(self, cache_filepath, source_url):
+        '''
+        Ranks are only valid for the lookup tool they were pulled from, so the cache is keyed by its url and is
+        emptied whenever it changes. Postcodes the lookup tool has no rank for are stored with a null rank, so they
+        are not requested again either - only postcodes whose request failed are left out of the cache.
+        '''
+        self.key = source_url
+        self.connection = sqlite3.connect(cache_filepath)
+
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS cache_key (key TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS postcode_ranks (postcode TEXT PRIMARY KEY, rank TEXT)')
+
+            # clear the cache if it was generated with a different lookup tool
+            stored_key = self.connection.execute('SELECT key FROM cache_key').fetchone()
+            if stored_key is None or stored_key[0] != self.key:
+                self.connection.execute('DELETE FROM postcode_ranks')
+                self.connection.execute('DELETE FROM cache_key')
+                self.connection.execute('INSERT INTO cache_key VALUES (?)', (self.key,))
+
+    # function for getting the cached ranks (None for postcodes without a rank) for a collection of postcodes
+    def get(self, postcodes):
+        self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS query_postcodes (postcode TEXT PRIMARY KEY)')
+        self.connection.execute('DELETE FROM query_postcodes')
+        self.connection.executemany('INSERT OR IGNORE INTO query_postcodes VALUES (?)', ((postcode,) for postcode in postcodes))
+        rows = self.connection.execute('SELECT postcode_ranks.postcode, rank FROM postcode_ranks '
+                                       'JOIN query_postcodes ON postcode_ranks.postcode = query_postcodes.postcode')
+        return dict(rows.fetchall())
+
+    # function for adding a dictionary of postcodes mapped to ranks to the cache
+    def update(self, postcode_ranks):
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO postcode_ranks VALUES (?, ?)', postcode_ranks.items())
+
+    def close(self):
+        self.connection.close()
+
+# function for reading local northern irish postcode -> super output area and super output area -> NIMDM rank tables,
+# returning a series of ranks (as strings, like the lookup tool) indexed by postcode with spaces removed
+def read_NI_rank_table(postcode_soa_filepath, soa_rank_filepath, postcode_column = 'Postcode', soa_column = 'SOA2001',
+                       rank_column = 'MDM_rank'):
+    postcode_soas = pd.read_csv(postcode_soa_filepath, usecols = [postcode_column, soa_column], dtype = str)
+    soa_ranks = pd.read_csv(soa_rank_filepath, usecols = [soa_column, rank_column], dtype = str)
+    rank_table = postcode_soas.merge(soa_ranks, how = 'left', on = soa_column)
+    postcode_keys = rank_table[postcode_column].str.replace(' ', '').str.upper()
+    rank_table = pd.Series(rank_table[rank_column].to_numpy(), index = postcode_keys.to_numpy())
+    return rank_table[~rank_table.index.duplicated()]
+
+# function for getting the ranks of northern-irish postcodes from a local rank table, without any requests
+def get_offline_postcode_ranks(postcodes, rank_table):
+    postcodes = pd.Series(postcodes)
+    ranks = rank_table.reindex(postcodes.str.replace(' ', '').str.upper().to_numpy())
+    # postcodes missing from the table are given no rank, as with the lookup tool
+    ranks = ranks.astype(object).where(ranks.notna(), None)
+    return dict(zip(postcodes, ranks))
@@ -0,0 +1,199 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from utils.binary_store import write_arrays, read_arrays
+
+# function for getting the keys of postcodes in the postcode store (utf-8 bytes with spaces removed)
+def get_postcode_keys(postcodes):
+    postcodes = pd.Series(postcodes, dtype = object)
+    keys = postcodes.where(postcodes.notna(), '').astype(str).str.replace(' ', '')
+    return keys.str.encode('utf-8').to_numpy()
+
+# characters that postcodes are made of, and characters commonly confused with each other when typing or reading them
+POSTCODE_CHARACTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+CONFUSED_CHARACTERS = {'O': 'O0', '0': '0O', 'I': 'I1', '1': '1I'}
+
+# function for getting the variants of a postcode key with commonly confused characters swapped (including the key itself)
+def get_confusion_variants(key):
+    variants = ['']
+    for character in key:
+        variants = [variant + option for variant in variants for option in CONFUSED_CHARACTERS.get(character, character)]
+    return variants
+
+# function for getting the variants of a postcode key within one edit (a deletion, insertion or substitution of a
+# character, or a transposition of two adjacent characters)
+def get_edit_variants(key):
+    splits = [(key[:i], key[i:]) for i in range(len(key) + 1)]
+    deletions = [start + end[1:] for start, end in splits if end]
+    transpositions = [start + end[1] + end[0] + end[2:] for start, end in splits if len(end) > 1]
+    substitutions = [start + character + end[1:] for start, end in splits if end for character in POSTCODE_CHARACTERS]
+    insertions = [start + character + end for start, end in splits for character in POSTCODE_CHARACTERS]
+    return list(set(deletions + transpositions + substitutions + insertions) - {key})
+
+# version of the compiled postcode store format, stored in its metadata so files written by older versions are recompiled
+STORE_VERSION = 2
+
+# country recorded for postcodes without a country in the postcode data set
+UNKNOWN_COUNTRY = 'Unknown'
+
+# class for reading a compiled postcode store, which resolves postcodes to entries of the UK postcode data set
+class PostcodeStore:
+
+    # initialise with the path to a compiled postcode store file
+    def __init__(self, filepath):
+        '''
+        The compiled file stores the postcodes of the postcode data set as a sorted array of fixed-width keys with the
+        spaces removed, along with the original postcode, country code and in-use flag of each entry. Entries whose key
+        is shared with another postcode (e.g. "AB1 2CD" and "AB12 CD") are flagged as ambiguous.
+        All arrays are memory-mapped, so loading is immediate and only the pages needed for lookups are read.
+        '''
+        self.filepath = filepath
+        self.metadata, arrays = read_arrays(filepath)
+        self.keys = arrays['keys']
+        self.postcodes = arrays['postcodes']
+        self.country_codes = arrays['country_codes']
+        self.in_use = arrays['in_use']
+        self.ambiguous = arrays['ambiguous']
+        self.countries = np.array(self.metadata['countries'], dtype = object)
+
+    # function for writing the postcode data set (with Postcode, In Use? and Country columns) to a compiled file
+    @staticmethod
+    def compile(postcode_data, filepath, source = None):
+
+        keys = get_postcode_keys(postcode_data['Postcode']).astype(bytes)
+        order = np.argsort(keys, kind = 'stable')
+        keys = keys[order]
+        country_codes, countries = pd.factorize(postcode_data['Country'].to_numpy()[order])
+        # postcodes without a country are given -1, which would index the last country, so they get their own entry
+        countries = list(countries)
+        if (country_codes < 0).any():
+            country_codes = np.where(country_codes < 0, len(countries), country_codes)
+            countries.append(UNKNOWN_COUNTRY)
+
+        # keys shared by more than one postcode are adjacent once sorted
+        ambiguous = np.zeros(len(keys), dtype = bool)
+        if len(keys) > 1:
+            duplicate = keys[1:] == keys[:-1]
+            ambiguous[1:] |= duplicate
+            ambiguous[:-1] |= duplicate
+
+        write_arrays(filepath, {'keys': keys, 'postcodes': postcode_data['Postcode'].to_numpy()[order].astype(bytes),
+                                'country_codes': country_codes.astype(np.int8),
+                                'in_use': (postcode_data['In Use?'].to_numpy()[order] == 'Yes'), 'ambiguous': ambiguous},
+                     metadata = {'countries': countries, 'source': source, 'version': STORE_VERSION})
+
+    # function for resolving postcodes to entries of the store, returning an array of entry positions (-1 if unresolved)
+    def resolve(self, postcodes):
+        '''
+        A postcode resolves to the entry it matches exactly. Otherwise it resolves to the entry with the same key
+        (i.e. ignoring spaces) if there is only one, and is left unresolved if there are none or several.
+        '''
+        postcodes = pd.Series(postcodes, dtype = object)
+        keys = get_postcode_keys(postcodes)
+        # keys longer than the stored keys cannot match (and would be truncated by the fixed-width conversion)
+        too_long = np.array([len(key) > self.keys.dtype.itemsize for key in keys], dtype = bool)
+        keys = np.where(too_long, b'', keys).astype(self.keys.dtype)
+
+        starts = np.searchsorted(self.keys, keys, side = 'left')
+        ends = np.searchsorted(self.keys, keys, side = 'right')
+        n_matches = np.where(too_long | postcodes.isna().to_numpy(), 0, ends - starts)
+
+        entries = np.where(n_matches == 1, starts, -1)
+
+        # for ambiguous keys, look for the exact postcode among the entries sharing the key
+        ambiguous = np.flatnonzero(n_matches > 1)
+        if len(ambiguous):
+            exact_postcodes = postcodes.iloc[ambiguous].astype(str).str.encode('utf-8').to_numpy()
+            for offset in range(int(n_matches.max())):
+                candidates = np.minimum(starts[ambiguous] + offset, len(self.keys) - 1)
+                exact = (offset < n_matches[ambiguous]) & (self.postcodes[candidates] == exact_postcodes)
+                entries[ambiguous[exact]] = candidates[exact]
+
+        return entries
+
+    # function for finding the entries matching any of the variants of each postcode, returning a list with an array of
+    # entry positions for each postcode
+    def find_variants(self, variants):
+
+        if not len(variants):
+            return []
+
+        owners = np.repeat(np.arange(len(variants)), [len(postcode_variants) for postcode_variants in variants])
+        keys = np.array([variant.encode('utf-8') for postcode_variants in variants for variant in postcode_variants], dtype = object)
+        too_long = np.array([len(key) > self.keys.dtype.itemsize for key in keys], dtype = bool)
+        owners, keys = owners[~too_long], keys[~too_long].astype(self.keys.dtype)
+
+        starts = np.searchsorted(self.keys, keys, side = 'left')
+        ends = np.searchsorted(self.keys, keys, side = 'right')
+        n_matches = ends - starts
+
+        # expand the matching ranges into (postcode, entry) pairs
+        match_owners = np.repeat(owners, n_matches)
+        match_entries = np.repeat(starts - np.cumsum(n_matches) + n_matches, n_matches) + np.arange(n_matches.sum())
+        pairs = np.unique(np.stack([match_owners, match_entries], axis = 1), axis = 0) if len(match_owners) else \
+            np.zeros((0, 2), dtype = np.int64)
+
+        return np.split(pairs[:, 1], np.searchsorted(pairs[:, 0], np.arange(1, len(variants))))
+
+    # function for correcting postcodes that do not resolve to any entry, returning an array of entry positions
+    # (-1 if there is no unique correction) and a list with an array of the candidate entries for each postcode
+    def correct(self, postcodes):
+        '''
+        Postcodes are first compared ignoring case and spaces, and with the commonly confused characters O and 0, and
+        I and 1, swapped. If none of these variants matches, all variants within one edit of the (uppercase) postcode are
+        compared. A postcode is corrected if the first set of variants with any matches matches a single entry, and is
+        left uncorrected (with its candidates returned) if it matches several.
+        '''
+        keys = pd.Series(get_postcode_keys(postcodes)).str.decode('utf-8').str.upper()
+
+        candidates = self.find_variants([get_confusion_variants(key) if key else [] for key in keys])
+        # postcodes without any match are compared with the variants within one edit
+        unmatched = [i for i, key in enumerate(keys) if key and not len(candidates[i])]
+        for i, edit_candidates in zip(unmatched, self.find_variants([get_edit_variants(keys[i]) for i in unmatched])):
+            candidates[i] = edit_candidates
+
+        entries = np.array([postcode_candidates[0] if len(postcode_candidates) == 1 else -1
+                            for postcode_candidates in candidates], dtype = np.int64)
+        return entries, candidates
+
+    # function for getting the postcodes of entries of the store
+    def get_postcodes(self, entries):
+        return np.char.decode(self.postcodes[entries], 'utf-8').astype(object)
+
+    # function for getting the countries of entries of the store
+    def get_countries(self, entries):
+        return self.countries[self.country_codes[entries]]
+
+# function for getting the path of the compiled postcode store stored next to the postcode data set
+def get_postcode_store_filepath(postcode_data_filepath):
+    return re.sub('\.csv$', '', postcode_data_filepath) + '.bin'
+
+# function for getting a description of the postcode data set, used to check whether the compiled store is out of date
+# (the file size and modification time, as the data set is too large to hash on every run)
+def get_postcode_data_source(postcode_data_filepath):
+    stat = os.stat(postcode_data_filepath)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+# function for compiling the postcode data set and saving it next to the data set
+def build_postcode_store(postcode_data_filepath):
+    postcode_data = pd.read_csv(postcode_data_filepath, usecols = ['Postcode', 'In Use?', 'Country'])
+    store_filepath = get_postcode_store_filepath(postcode_data_filepath)
+    PostcodeStore.compile(postcode_data, store_filepath, get_postcode_data_source(postcode_data_filepath))
+    return PostcodeStore(store_filepath)
+
+# function for loading the compiled postcode store, recompiling it if it is missing or out of date
+def load_postcode_store(postcode_data_filepath):
+
+    store_filepath = get_postcode_store_filepath(postcode_data_filepath)
+
+    if os.path.exists(store_filepath):
+        postcode_store = PostcodeStore(store_filepath)
+        # the compiled file can be used on its own if the data set is not available
+        if not os.path.exists(postcode_data_filepath) or \
+                (postcode_store.metadata['source'] == get_postcode_data_source(postcode_data_filepath) and
+                 postcode_store.metadata.get('version') == STORE_VERSION):
+            return postcode_store
+
+    return build_postcode_store(postcode_data_filepath)
@@ -0,0 +1,32 @@
+from functools import lru_cache
+
+# accessors for the large resources shared by the scripts - nothing is loaded when this module is imported,
+# each resource is loaded the first time it is requested and reused by later requests in the same process
+
+# default locations of the data files, relative to the repository
+DRUG_DICTIONARY_FILEPATH = 'data/drug_dictionary.p'
+BNF_CLASSES_FILEPATH = 'data/bnf_drug_classifications.csv'
+DRUGBANK_XML_FILEPATH = 'data/drugbank.xml'
+
+@lru_cache(maxsize = None)
+def load_compiled_drug_dictionary(filepath):
+    from utils.drug_dictionary import load_drug_dictionary
+    return load_drug_dictionary(filepath)
+
+# function for getting the drug dictionary - each call returns a separate copy sharing the memory-mapped data,
+# so aliases added by one caller (e.g. by AnswerMapper) are not seen by the others
+def get_drug_dictionary(filepath = DRUG_DICTIONARY_FILEPATH):
+    return load_compiled_drug_dictionary(filepath).copy()
+
+@lru_cache(maxsize = None)
+def load_bnf_classes(filepath):
+    import pandas as pd
+    bnf_classes = pd.read_csv(filepath)
+    bnf_classes['drugs'] = bnf_classes['drugs'].str.split('; ')
+    return bnf_classes
+
+# function for getting the BNF drug classes data frame, with the drugs of each entry split into a list
+# each call returns a separate copy, so callers can add columns to it
+def get_bnf_classes(filepath = BNF_CLASSES_FILEPATH):
+    return load_bnf_classes(filepath).copy()
+